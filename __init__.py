@@ -239,6 +239,22 @@ class N64_AddF3dMat(bpy.types.Operator):
 		self.report({'INFO'}, 'Created F3D material.')
 		return {'FINISHED'} # must return a set
 
+class F3D_ClearTextureCache(bpy.types.Operator):
+	# set bl_ properties
+	bl_idname = 'object.f3d_clear_texture_cache'
+	bl_label = "Clear Texture Cache"
+	bl_options = {'REGISTER'}
+
+	def execute(self, context):
+		try:
+			TextureCache(getTextureCacheDir(), 0).clear()
+		except Exception as e:
+			raisePluginError(self, e)
+			return {"CANCELLED"}
+
+		self.report({'INFO'}, 'Cleared texture cache.')
+		return {'FINISHED'} # must return a set
+
 class SM64_AddrConv(bpy.types.Operator):
 	# set bl_ properties
 	bl_idname = 'object.addr_conv'
@@ -252,7 +268,7 @@ class SM64_AddrConv(bpy.types.Operator):
 		try:
 			address = int(context.scene.convertibleAddr, 16)
 			importRom = context.scene.importRom
-			romfileSrc = open(bpy.path.abspath(importRom), 'rb')
+			romfileSrc = RomView(bpy.path.abspath(importRom))
 			checkExpanded(bpy.path.abspath(importRom))
 			levelParsed = parseLevelAtPointer(romfileSrc, 
 				level_pointers[context.scene.levelConvert])
@@ -301,7 +317,7 @@ class SM64_ImportGeolayout(bpy.types.Operator):
 			raisePluginError(self, e)
 			return {'CANCELLED'}
 		try:
-			romfileSrc = open(bpy.path.abspath(importRom), 'rb')
+			romfileSrc = RomView(bpy.path.abspath(importRom))
 			checkExpanded(bpy.path.abspath(importRom))
 
 			armatureObj = None
@@ -894,7 +910,7 @@ class SM64_ImportDL(bpy.types.Operator):
 			return {'CANCELLED'}
 		try:
 			checkExpanded(bpy.path.abspath(context.scene.importRom))
-			romfileSrc = open(bpy.path.abspath(context.scene.importRom), 'rb')
+			romfileSrc = RomView(bpy.path.abspath(context.scene.importRom))
 			levelParsed = parseLevelAtPointer(romfileSrc, 
 				level_pointers[context.scene.levelDLImport])
 			segmentData = levelParsed.segmentData
@@ -1306,7 +1322,8 @@ class SM64_ExportLevel(bpy.types.Operator):
 			exportLevelC(obj, finalTransform,
 				context.scene.f3d_type, context.scene.isHWv1, levelName, exportPath, 
 				context.scene.levelSaveTextures or bpy.context.scene.ignoreTextureRestrictions, 
-				context.scene.levelCustomExport, triggerName, "Static")
+				context.scene.levelCustomExport, triggerName, "Static",
+				context.scene.levelForceRebuild)
 			self.report({'INFO'}, 'Success!')
 
 			applyRotation([obj], math.radians(-90), 'X')
@@ -1343,6 +1360,7 @@ class SM64_ExportLevelPanel(bpy.types.Panel):
 		col.operator(SM64_ExportLevel.bl_idname)
 		if not bpy.context.scene.ignoreTextureRestrictions:
 			col.prop(context.scene, 'levelSaveTextures')
+		col.prop(context.scene, 'levelForceRebuild')
 		col.prop(context.scene, 'levelCustomExport')
 		if context.scene.levelCustomExport:
 			prop_split(col, context.scene, 'levelExportPath', 'Directory')
@@ -1388,7 +1406,7 @@ class SM64_ImportAnimMario(bpy.types.Operator):
 		romfileSrc = None
 		try:
 			checkExpanded(bpy.path.abspath(context.scene.importRom))
-			romfileSrc = open(bpy.path.abspath(context.scene.importRom), 'rb')
+			romfileSrc = RomView(bpy.path.abspath(context.scene.importRom))
 		except Exception as e:
 			raisePluginError(self, e)
 			return {'CANCELLED'}
@@ -1402,10 +1420,12 @@ class SM64_ImportAnimMario(bpy.types.Operator):
 				animStart = decodeSegmentedAddr(
 					animStart.to_bytes(4, 'big'), segmentData)
 
-			if not context.scene.isDMAImport and context.scene.animIsAnimList:
-				romfileSrc.seek(animStart + 4 * context.scene.animListIndexImport)
-				actualPtr = romfileSrc.read(4)
-				animStart = decodeSegmentedAddr(actualPtr, segmentData)
+			importTable = context.scene.animImportTable and \
+				(context.scene.isDMAImport or context.scene.animIsAnimList)
+			if not importTable and not context.scene.isDMAImport and \
+				context.scene.animIsAnimList:
+				animStart = romfileSrc.readSegmentedAddr(
+					animStart + 4 * context.scene.animListIndexImport, segmentData)
 
 			if len(context.selected_objects) == 0:
 				raise PluginError("Armature not selected.")
@@ -1413,9 +1433,14 @@ class SM64_ImportAnimMario(bpy.types.Operator):
 			if type(armatureObj.data) is not bpy.types.Armature:
 				raise PluginError("Armature not selected.")
 			
-			importAnimationToBlender(romfileSrc, 
-				animStart, armatureObj, 
-				segmentData, context.scene.isDMAImport)
+			if importTable:
+				importAnimationTableToBlender(romfileSrc, 
+					animStart, armatureObj, segmentData, 
+					context.scene.isDMAImport, context.scene.animListCountImport)
+			else:
+				importAnimationToBlender(romfileSrc, 
+					animStart, armatureObj, 
+					segmentData, context.scene.isDMAImport)
 			romfileSrc.close()
 			self.report({'INFO'}, 'Success!')
 		except Exception as e:
@@ -1442,13 +1467,24 @@ class SM64_ImportAnimPanel(bpy.types.Panel):
 		col = self.layout.column()
 		propsAnimImport = col.operator(SM64_ImportAnimMario.bl_idname)
 		col.prop(context.scene, 'isDMAImport')
+		importTable = False
 		if not context.scene.isDMAImport:
 			col.prop(context.scene, 'animIsAnimList')
 			if context.scene.animIsAnimList:
-				prop_split(col, context.scene, 'animListIndexImport', 
-					'Anim List Index')
+				col.prop(context.scene, 'animImportTable')
+				importTable = context.scene.animImportTable
+				if importTable:
+					prop_split(col, context.scene, 'animListCountImport', 
+						'Anim List Count')
+				else:
+					prop_split(col, context.scene, 'animListIndexImport', 
+						'Anim List Index')
+		else:
+			col.prop(context.scene, 'animImportTable')
+			importTable = context.scene.animImportTable
 
-		prop_split(col, context.scene, 'animStartImport', 'Start Address')
+		prop_split(col, context.scene, 'animStartImport', 
+			'Table Address' if importTable else 'Start Address')
 		col.prop(context.scene, 'animIsSegPtr')
 		col.prop(context.scene, 'levelAnimImport')
 
@@ -1485,11 +1521,20 @@ class SM64_ExportAnimMario(bpy.types.Operator):
 					context.scene.animLevelOption)
 				if not context.scene.animCustomExport:
 					applyBasicTweaks(exportPath)
-				exportAnimationC(armatureObj, context.scene.loopAnimation, 
-					exportPath, bpy.context.scene.animName,
-					bpy.context.scene.animGroupName,
-					context.scene.animCustomExport, context.scene.animExportHeaderType, levelName)
-				self.report({'INFO'}, 'Success!')
+				if context.scene.animExportAll:
+					totalSize = exportAnimationBankC(armatureObj, 
+						context.scene.loopAnimation, exportPath, 
+						bpy.context.scene.animName, bpy.context.scene.animGroupName,
+						context.scene.animCustomExport, 
+						context.scene.animExportHeaderType, levelName)
+					self.report({'INFO'}, 'Success! Animation data is ' + \
+						str(totalSize) + ' bytes, see console for each animation.')
+				else:
+					exportAnimationC(armatureObj, context.scene.loopAnimation, 
+						exportPath, bpy.context.scene.animName,
+						bpy.context.scene.animGroupName,
+						context.scene.animCustomExport, context.scene.animExportHeaderType, levelName)
+					self.report({'INFO'}, 'Success!')
 			except Exception as e:
 				raisePluginError(self, e)
 				return {'CANCELLED'} # must return a set
@@ -1533,6 +1578,21 @@ class SM64_ExportAnimMario(bpy.types.Operator):
 					ExtendBank0x04(romfileOutput, segmentData, 
 						defaultExtendSegment4)
 
+				if context.scene.isDMAExport and context.scene.animExportAll:
+					addrRange, animCount = exportAnimationBankBinary(romfileOutput,
+						[int(context.scene.animExportStart, 16), 
+						int(context.scene.animExportEnd, 16)],
+						armatureObj, context.scene.loopAnimation)
+					romfileOutput.close()
+					if os.path.exists(bpy.path.abspath(context.scene.outputRom)):
+						os.remove(bpy.path.abspath(context.scene.outputRom))
+					os.rename(bpy.path.abspath(tempROM),
+						bpy.path.abspath(context.scene.outputRom))
+					self.report({'INFO'}, 'Success! ' + str(animCount) + \
+						' animations in DMA table at (' + hex(addrRange[0]) + ', ' + \
+						hex(addrRange[1]) + '), see console for each animation.')
+					return {'FINISHED'}
+
 				DMAAddresses = None
 				if context.scene.animOverwriteDMAEntry:
 					DMAAddresses = {}
@@ -1609,7 +1669,9 @@ class SM64_ExportAnimPanel(bpy.types.Panel):
 		
 		col.prop(context.scene, 'animExportType')
 		col.prop(context.scene, 'loopAnimation')
+		prop_split(col, context.scene, 'animRotationTolerance', 'Rotation Tolerance')
 		if context.scene.animExportType == 'C':
+			col.prop(context.scene, 'animExportAll')
 			col.prop(context.scene, 'animCustomExport')
 			if context.scene.animCustomExport:
 				col.prop(context.scene, 'animExportPath')
@@ -1641,6 +1703,11 @@ class SM64_ExportAnimPanel(bpy.types.Panel):
 		else:
 			col.prop(context.scene, 'isDMAExport')
 			if context.scene.isDMAExport:
+				col.prop(context.scene, 'animExportAll')
+			if context.scene.isDMAExport and context.scene.animExportAll:
+				infoBox = col.box()
+				infoBox.label(text = 'Start address is the DMA table address.')
+			elif context.scene.isDMAExport:
 				col.prop(context.scene, 'animOverwriteDMAEntry')
 				if context.scene.animOverwriteDMAEntry:
 					prop_split(col, context.scene, 'DMAStartAddress', 
@@ -1983,6 +2050,15 @@ class SM64_FileSettingsPanel(bpy.types.Panel):
 		col.prop(context.scene, 'ignoreTextureRestrictions')
 		if context.scene.ignoreTextureRestrictions:
 			col.box().label(text = "Width/height must be < 1024. Must be RGBA32. Must be png format.")
+		col.prop(context.scene, 'useTextureCache')
+		if context.scene.useTextureCache:
+			prop_split(col, context.scene, 'textureCacheSize', 'Texture Cache Size (MB)')
+			col.operator(F3D_ClearTextureCache.bl_idname)
+		col.prop(context.scene, 'optimizeVertexLoads')
+		col.prop(context.scene, 'optimizeDisplayLists')
+		if context.scene.optimizeDisplayLists:
+			prop_split(col, context.scene, 'displayListInlineSize', 'Inline Material Size')
+		col.prop(context.scene, 'useTextureAtlas')
 		col.prop(context.scene, 'decompPath')
 		
 		prop_split(col, context.scene, 'refreshVer', 'Decomp Func Map')
@@ -2017,6 +2093,7 @@ classes = (
 	CreateMetarig,
 	N64_AddF3dMat,
 	SM64_AddrConv,
+	F3D_ClearTextureCache,
 
 	F3D_GlobalSettingsPanel,
 	SM64_FileSettingsPanel,
@@ -2231,6 +2308,13 @@ def register():
 	bpy.types.Scene.levelAnimImport = bpy.props.EnumProperty(items = level_enums, name = 'Level', default = 'IC')
 	bpy.types.Scene.levelAnimExport = bpy.props.EnumProperty(items = level_enums, name = 'Level', default = 'IC')
 	bpy.types.Scene.loopAnimation = bpy.props.BoolProperty(name = 'Loop Animation', default = True)
+	bpy.types.Scene.animExportAll = bpy.props.BoolProperty(
+		name = 'Export All Actions', 
+		description = 'Export every action of the armature as one animation bank')
+	bpy.types.Scene.animRotationTolerance = bpy.props.IntProperty(
+		name = 'Rotation Tolerance', min = 0, max = 0x100, default = 0,
+		description = 'Trailing rotation frames within this many 1/65536 turns ' + \
+		'of the last kept frame are removed')
 	bpy.types.Scene.setAnimListIndex = bpy.props.BoolProperty(name = 'Set Anim List Entry', default = True)
 	bpy.types.Scene.overwrite_0x28 = bpy.props.BoolProperty(name = 'Overwrite 0x28 behaviour command', default = True)
 	bpy.types.Scene.addr_0x27 = bpy.props.StringProperty(
@@ -2253,6 +2337,10 @@ def register():
 		name = 'Is Anim List', default = True)
 	bpy.types.Scene.animListIndexImport = bpy.props.IntProperty(
 		name = 'Anim List Index', min = 0, max = 255)
+	bpy.types.Scene.animImportTable = bpy.props.BoolProperty(
+		name = 'Import Whole Table')
+	bpy.types.Scene.animListCountImport = bpy.props.IntProperty(
+		name = 'Anim List Count', min = 1, max = 256, default = 1)
 	bpy.types.Scene.animListIndexExport = bpy.props.IntProperty(
 		name = "Anim List Index", min = 0, max = 255)
 	bpy.types.Scene.animName = bpy.props.StringProperty(
@@ -2328,6 +2416,8 @@ def register():
 		name = 'Save Textures As PNGs (Breaks CI Textures)')
 	bpy.types.Scene.levelCustomExport = bpy.props.BoolProperty(
 		name = 'Custom Export Path')
+	bpy.types.Scene.levelForceRebuild = bpy.props.BoolProperty(
+		name = 'Force Full Rebuild', description = 'Export every area, even if unchanged since the last export')
 
 	# ROM
 	bpy.types.Scene.importRom = bpy.props.StringProperty(
@@ -2357,6 +2447,19 @@ def register():
 		name = 'Disable Scrolling Textures')
 	bpy.types.Scene.ignoreTextureRestrictions = bpy.props.BoolProperty(
 		name = 'Ignore Texture Restrictions (Breaks CI Textures)')
+	bpy.types.Scene.useTextureCache = bpy.props.BoolProperty(
+		name = 'Cache Converted Textures', default = True)
+	bpy.types.Scene.textureCacheSize = bpy.props.IntProperty(
+		name = 'Texture Cache Size (MB)', default = 256, min = 1)
+	bpy.types.Scene.optimizeVertexLoads = bpy.props.BoolProperty(
+		name = 'Optimize Vertex Loads', description = 'Reorder triangles to reduce the number of vertex loads. Slower to export')
+	bpy.types.Scene.optimizeDisplayLists = bpy.props.BoolProperty(
+		name = 'Optimize Display Lists', description = 'Remove redundant state changes and syncs between materials in mesh draw lists')
+	bpy.types.Scene.displayListInlineSize = bpy.props.IntProperty(
+		name = 'Inline Material Size', default = 0, min = 0,
+		description = 'Copy static material and revert lists with at most this many commands into draw lists, so redundant state between them can be removed. 0 disables inlining')
+	bpy.types.Scene.useTextureAtlas = bpy.props.BoolProperty(
+		name = 'Atlas Small Textures', description = 'Pack the textures of materials within a mesh that only differ by texture into shared TMEM sized textures. Only applies to faces with UVs inside their texture')
 	bpy.types.Scene.compressionFormat = bpy.props.EnumProperty(
 		items = enumCompressionFormat, name = 'Compression', default = 'mio0')
 
@@ -2417,6 +2520,8 @@ def unregister():
 	del bpy.types.Scene.DMAStartAddress
 	del bpy.types.Scene.DMAEntryAddress
 	del bpy.types.Scene.loopAnimation
+	del bpy.types.Scene.animRotationTolerance
+	del bpy.types.Scene.animExportAll
 	del bpy.types.Scene.setAnimListIndex
 	del bpy.types.Scene.overwrite_0x28
 	del bpy.types.Scene.addr_0x27
@@ -2429,6 +2534,8 @@ def unregister():
 	del bpy.types.Scene.animIsSegPtr
 	del bpy.types.Scene.animIsAnimList
 	del bpy.types.Scene.animListIndexImport
+	del bpy.types.Scene.animImportTable
+	del bpy.types.Scene.animListCountImport
 	del bpy.types.Scene.animListIndexExport
 	del bpy.types.Scene.animName
 	del bpy.types.Scene.animGroupName
@@ -2489,6 +2596,7 @@ def unregister():
 	del bpy.types.Scene.levelSaveTextures
 	#del bpy.types.Scene.levelCamera	
 	del bpy.types.Scene.levelCustomExport
+	del bpy.types.Scene.levelForceRebuild
 	del bpy.types.Scene.levelOption
 
 	# Collision
@@ -2532,6 +2640,12 @@ def unregister():
 	del bpy.types.Scene.decomp_compatible
 	del bpy.types.Scene.disableScroll
 	del bpy.types.Scene.ignoreTextureRestrictions
+	del bpy.types.Scene.useTextureCache
+	del bpy.types.Scene.textureCacheSize
+	del bpy.types.Scene.optimizeVertexLoads
+	del bpy.types.Scene.optimizeDisplayLists
+	del bpy.types.Scene.displayListInlineSize
+	del bpy.types.Scene.useTextureAtlas
 
 	sm64_spline_unregister()
 	level_unregister()
@@ -4,7 +4,10 @@ from .utility import decodeSegmentedAddr, encodeSegmentedAddr, get64bitAlignedAd
 from math import ceil
 import os
 from .utility import getNameFromPath, PluginError
+from .utility import writeCLines, writeCValueArray, formatCHexByte
 import copy
+import io
+import struct
 
 dlTypeEnum = [
 	('STATIC', "Static", "Static"),
@@ -46,6 +49,8 @@ drawLayerRenderMode = {
 
 class F3D:
 	def __init__(self, F3D_VER, _HW_VERSION_1):
+		# (command type, command fields) : encoded command, see GfxList.to_binary
+		self.binaryCache = {}
 		if F3D_VER == 'F3DEX2.Rej/LX2.Rej' or \
 			F3D_VER == 'F3DEX2/LX2':
 			self.F3DEX_GBI = False
@@ -1314,6 +1319,9 @@ def _SHIFTL(value, amount, mask):
 
 VTX_SIZE = 16
 GFX_SIZE = 8
+
+# position, padding, uv, colorOrNormal
+vtxStruct = struct.Struct('>3h2x2h4B')
 VP_SIZE = 8
 LIGHT_SIZE = 16 # 12, but padded to 64bit alignment
 AMBIENT_SIZE = 8
@@ -1326,16 +1334,17 @@ class Vtx:
 		self.colorOrNormal = colorOrNormal
 	
 	def to_binary(self):
+		data = bytearray(VTX_SIZE)
+		self.pack_into(data, 0)
+		return data
+
+	def pack_into(self, data, offset):
 		signX = 1 if self.uv[0] >= 0 else -1
 		signY = 1 if self.uv[1] >= 0 else -1
-		uv = [self.uv[0] % (signX * 2**15), self.uv[1] % (signY * 2**15)]
-		return self.position[0].to_bytes(2, 'big', signed=True) + \
-			self.position[1].to_bytes(2, 'big', signed=True) + \
-			self.position[2].to_bytes(2, 'big', signed=True) + \
-			bytearray([0x00, 0x00]) + \
-			uv[0].to_bytes(2, 'big', signed = True) +\
-			uv[1].to_bytes(2, 'big', signed = True) +\
-			bytearray(self.colorOrNormal)
+		vtxStruct.pack_into(data, offset, 
+			self.position[0], self.position[1], self.position[2],
+			self.uv[0] % (signX * 2**15), self.uv[1] % (signY * 2**15),
+			*self.colorOrNormal)
 
 	def to_c(self):
 		if bpy.context.scene.decomp_compatible:
@@ -1404,17 +1413,20 @@ class VtxList:
 		return len(self.vertices) * VTX_SIZE
 	
 	def to_binary(self):
-		data = bytearray(0)
-		for vert in self.vertices:
-			data.extend(vert.to_binary())	
+		data = bytearray(len(self.vertices) * VTX_SIZE)
+		for i in range(len(self.vertices)):
+			self.vertices[i].pack_into(data, i * VTX_SIZE)
 		return data
 	
 	def to_c(self):
-		data = 'Vtx ' + self.name + '[' + str(len(self.vertices)) + '] = {\n'
-		for vert in self.vertices:
-			data += '\t' + vert.to_c() + ',\n'
-		data += '};'
-		return data
+		out = io.StringIO()
+		self.write_c(out)
+		return out.getvalue()
+
+	def write_c(self, out):
+		out.write('Vtx ' + self.name + '[' + str(len(self.vertices)) + '] = {\n')
+		writeCLines(out, self.vertices, lambda vert: '\t' + vert.to_c() + ',\n')
+		out.write('};')
 	
 	def to_c_def(self):
 		data = 'extern Vtx ' + self.name + '[' + str(len(self.vertices)) + '];\n'
@@ -1426,19 +1438,115 @@ class VtxList:
 			data += vert.to_sm64_decomp_s() + '\n'
 		return data
 
+# Commands without pointers encode the same way wherever they are,
+# so their encodings are cached and shared between display lists.
+def getCommandBinary(command, f3d, segments):
+	if type(command) in F3DClassesWithPointers:
+		return command.to_binary(f3d, segments)
+	try:
+		key = (type(command), tuple(command.__dict__.items()))
+		data = f3d.binaryCache.get(key)
+	except TypeError:
+		# Unhashable command fields
+		return command.to_binary(f3d, segments)
+	if data is None:
+		data = bytes(command.to_binary(f3d, segments))
+		f3d.binaryCache[key] = data
+	return data
+
+# Collects the seek / write calls of save_binary in memory, so that data
+# saved back to back is written to the ROM with a single write.
+class BinaryWriteBuffer:
+	def __init__(self):
+		self.position = 0
+		self.blocks = []
+
+	def seek(self, position):
+		self.position = position
+
+	def write(self, data):
+		if len(self.blocks) > 0 and \
+			self.position == self.blocks[-1][0] + len(self.blocks[-1][1]):
+			self.blocks[-1][1].extend(data)
+		else:
+			self.blocks.append((self.position, bytearray(data)))
+		self.position += len(data)
+
+	def save_binary(self, romfile):
+		for position, data in self.blocks:
+			romfile.seek(position)
+			romfile.write(data)
+
+# A list of commands that counts its modifications,
+# so that GfxList can tell when its layout is out of date.
+class GfxCommandList(list):
+	def __init__(self, commands = ()):
+		list.__init__(self, commands)
+		self.version = 0
+
+def versionedListMethod(name):
+	method = getattr(list, name)
+	def versionedMethod(self, *args, **kwargs):
+		self.version += 1
+		return method(self, *args, **kwargs)
+	return versionedMethod
+
+def addVersionedListMethods(cls):
+	for name in ['append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort', 
+		'reverse', '__setitem__', '__delitem__', '__iadd__', '__imul__']:
+		setattr(cls, name, versionedListMethod(name))
+
+addVersionedListMethods(GfxCommandList)
+
 class GfxList:
 	def __init__(self, name, DLFormat):
 		self.commands = []
 		self.name = name
 		self.startAddress = 0
 		self.DLFormat = DLFormat
+		self.layout = None
+
+	# Assigned lists are copied into a GfxCommandList.
+	@property
+	def commands(self):
+		return self.commandList
+
+	@commands.setter
+	def commands(self, commands):
+		self.commandList = GfxCommandList(commands)
+
+	# Returns (size, pointer offsets, size excluding SPDisplayList commands,
+	# SPDisplayList commands), computed once for the current command list.
+	# The layout is recomputed whenever the command list is modified or replaced.
+	def get_layout(self, f3d):
+		if self.layout is None or self.layout[0] is not f3d or \
+			self.layout[1] is not self.commandList or \
+			self.layout[2] != self.commandList.version:
+			size = 0
+			ptrOffsets = []
+			otherSize = 0
+			displayListCommands = []
+			for command in self.commands:
+				commandSize = command.size(f3d)
+				if type(command) in F3DClassesWithPointers:
+					for offset in command.get_ptr_offsets(f3d):
+						ptrOffsets.append(size + offset)
+				if isinstance(command, SPDisplayList):
+					displayListCommands.append(command)
+				else:
+					otherSize += commandSize
+				size += commandSize
+			self.layout = (f3d, self.commandList, self.commandList.version, 
+				(size, ptrOffsets, otherSize, displayListCommands))
+		return self.layout[3]
 	
 	def set_addr(self, startAddress, f3d):
 		startAddress = get64bitAlignedAddr(startAddress)
 		self.startAddress = startAddress
+		size = self.size(f3d)
 		print('GfxList ' + self.name + ': ' + str(startAddress) + \
-			', ' + str(self.size(f3d)))
-		return startAddress, startAddress + self.size(f3d)
+			', ' + str(size))
+		return startAddress, startAddress + size
 	
 	def save_binary(self, romfile, f3d, segments):
 		print('GfxList ' + self.name + ': ' + str(self.startAddress) + \
@@ -1447,57 +1555,53 @@ class GfxList:
 		romfile.write(self.to_binary(f3d, segments))
 	
 	def size(self, f3d):
-		size = 0
-		for command in self.commands:
-			size += command.size(f3d)
-		return size
+		return self.get_layout(f3d)[0]
 
 	# Size, including display lists called with SPDisplayList
 	def size_total(self,f3d):
-		size = 0
-		for command in self.commands:
-			if isinstance(command, SPDisplayList) and command.displayList.DLFormat != "Static":
-				size += command.displayList.size_total(f3d)
+		size, ptrOffsets, otherSize, displayListCommands = self.get_layout(f3d)
+		for command in displayListCommands:
+			if command.displayList.DLFormat != "Static":
+				otherSize += command.displayList.size_total(f3d)
 			else:
-				size += command.size(f3d)
-		return size
+				otherSize += command.size(f3d)
+		return otherSize
 	
 	def get_ptr_addresses(self, f3d):
-		ptrs = []
-		address = self.startAddress
-		for command in self.commands:
-			if type(command) in F3DClassesWithPointers:
-				for offset in command.get_ptr_offsets(f3d):
-					ptrs.append(address + offset)
-			address += command.size(f3d)
-		return ptrs
+		return [self.startAddress + offset for offset in self.get_layout(f3d)[1]]
 	
 	def to_binary(self, f3d, segments):
-		data = bytearray(0)
+		data = []
 		for command in self.commands:
-			data.extend(command.to_binary(f3d, segments))
-		
-		return data
+			data.append(getCommandBinary(command, f3d, segments))
+		return bytearray(b''.join(data))
 	
 	def to_c(self, f3d):
+		out = io.StringIO()
+		self.write_c(out, f3d)
+		return out.getvalue()
+
+	def write_c(self, out, f3d):
 		if self.DLFormat == "Static":
-			data = 'Gfx ' + self.name + '[] = {\n'
-			for command in self.commands:
-				data += '\t' + command.to_c(True) + ',\n'
-			data += '};'	
+			out.write('Gfx ' + self.name + '[] = {\n')
+			writeCLines(out, self.commands, lambda command: '\t' + command.to_c(True) + ',\n')
+			out.write('};')
 		elif self.DLFormat == 'SM64 Function Node':
-			return self.to_c_sm64_func_node(f3d)
+			self.write_c_sm64_func_node(out, f3d)
 		elif self.DLFormat == 'Dynamic':
-			data = 'Gfx* ' + self.name + '(Gfx* glistp) {\n'
-			for command in self.commands:
-				data += '\t' + command.to_c(False) + ';\n'
-			data += '\treturn glistp;\n}'
+			out.write('Gfx* ' + self.name + '(Gfx* glistp) {\n')
+			writeCLines(out, self.commands, lambda command: '\t' + command.to_c(False) + ';\n')
+			out.write('\treturn glistp;\n}')
 		else:
 			raise PluginError("Invalid GfxList format: " + str(self.DLFormat))	
-		return data
 
 	def to_c_sm64_func_node(self, f3d):
-		data = 'Gfx* ' + self.name + '(s32 renderContext, struct GraphNode* node, struct AllocOnlyPool *a2) {\n' +\
+		out = io.StringIO()
+		self.write_c_sm64_func_node(out, f3d)
+		return out.getvalue()
+
+	def write_c_sm64_func_node(self, out, f3d):
+		out.write('Gfx* ' + self.name + '(s32 renderContext, struct GraphNode* node, struct AllocOnlyPool *a2) {\n' +\
 			'\tGfx* startCmd = NULL;\n' +\
 			'\tGfx* glistp = NULL;\n' +\
 			'\tstruct GraphNodeGenerated *generatedNode;\n' +\
@@ -1506,12 +1610,10 @@ class GfxList:
 			'\t\tgeneratedNode->fnNode.node.flags = (generatedNode->fnNode.node.flags & 0xFF) | (generatedNode->parameter << 8);\n' +\
 			'\t\tstartCmd = glistp = alloc_display_list(sizeof(Gfx) * ' + \
 			str(int(round(self.size_total(f3d) / GFX_SIZE))) + ');\n' +\
-			'\t\tif(startCmd == NULL) return NULL;\n'
+			'\t\tif(startCmd == NULL) return NULL;\n')
 
-		for command in self.commands:
-			data += '\t\t' + command.to_c(False) + ';\n'
-		data += '\t}\n\treturn startCmd;\n}'	
-		return data
+		writeCLines(out, self.commands, lambda command: '\t\t' + command.to_c(False) + ';\n')
+		out.write('\t}\n\treturn startCmd;\n}')
 
 
 	def to_c_def(self):
@@ -1735,46 +1837,50 @@ class FModel:
 		return startAddress, addrRange[1]
 
 	def save_binary(self, romfile, segments):
+		writeBuffer = BinaryWriteBuffer()
 		for name, light in self.lights.items():
-			light.save_binary(romfile)
+			light.save_binary(writeBuffer)
 		for info, texture in self.textures.items():
-			texture.save_binary(romfile)
+			texture.save_binary(writeBuffer)
 		for materialKey, (fMaterial, texDimensions) in self.materials.items():
-			fMaterial.save_binary(romfile, self.f3d, segments)
+			fMaterial.save_binary(writeBuffer, self.f3d, segments)
 		for name, meshGroup in self.meshGroups.items():
-			meshGroup.save_binary(romfile, self.f3d, segments)
+			meshGroup.save_binary(writeBuffer, self.f3d, segments)
 		if self.materialRevert is not None:
-			self.materialRevert.save_binary(romfile, self.f3d, segments)
+			self.materialRevert.save_binary(writeBuffer, self.f3d, segments)
+		writeBuffer.save_binary(romfile)
 
 	def to_c(self, texCSeparate, savePNG, texDir, scrollName):
-		static_data = ''
-		dynamic_data = ''
-		texC = ''
+		staticOut = io.StringIO()
+		dynamicOut = io.StringIO()
+		texOut = io.StringIO() if texCSeparate else None
+		scroll_data = self.write_c(staticOut, dynamicOut, texOut, savePNG, texDir, scrollName)
+		texC = texOut.getvalue() if texCSeparate else None
+		return staticOut.getvalue(), dynamicOut.getvalue(), texC, scroll_data
+
+	# Streams the model C data into the given outputs and returns the scroll data.
+	# Textures are written to staticOut if texOut is None.
+	def write_c(self, staticOut, dynamicOut, texOut, savePNG, texDir, scrollName):
 		scroll_data = ''
 		# since decomp is linux, don't use os.path.join 
 		# on windows this results in '\', which is incorrect (should be '/')
 		if texDir[-1] != '/':
 			texDir += '/'
+		if texOut is None:
+			texOut = staticOut
 		for name, light in self.lights.items():
-			static_data += light.to_c() + '\n'
+			staticOut.write(light.to_c() + '\n')
 		for info, texture in self.textures.items():
 			if savePNG:
-				if texCSeparate:
-					texC += texture.to_c_tex_separate(texDir) + '\n'
-				else:
-					static_data += texture.to_c_tex_separate(texDir) + '\n'
+				texOut.write(texture.to_c_tex_separate(texDir) + '\n')
 			else:
-				if texCSeparate:
-					texC += texture.to_c() + '\n'
-				else:
-					static_data += texture.to_c() + '\n'
+				texture.write_c(texOut)
+				texOut.write('\n')
 		for materialKey, (fMaterial, texDimensions) in self.materials.items():
-			dynamic_data += fMaterial.to_c(self.f3d) + '\n'
+			fMaterial.write_c(dynamicOut, self.f3d)
+			dynamicOut.write('\n')
 		for name, meshGroup in self.meshGroups.items():
-			meshGroupStatic, meshGroupDynamic, meshGroupScroll = meshGroup.to_c(self.f3d)
-			static_data += meshGroupStatic + '\n'
-			dynamic_data += meshGroupDynamic + '\n'
-			scroll_data += meshGroupScroll
+			scroll_data += meshGroup.write_c(staticOut, dynamicOut, self.f3d)
 
 		scrollDefinesSplit = self.to_c_def(None)[2].split('extern void ')
 		scroll_data += 'void scroll_' + scrollName + '() {\n'
@@ -1785,17 +1891,22 @@ class FModel:
 		scroll_data += '}\n'
 
 		if self.materialRevert is not None:
-			dynamic_data += self.materialRevert.to_c(self.f3d) + '\n'
-		if not texCSeparate:
-			texC = None
-		return static_data, dynamic_data, texC, scroll_data
+			self.materialRevert.write_c(dynamicOut, self.f3d)
+			dynamicOut.write('\n')
+		return scroll_data
 
+	# Returns the names of the saved png files.
 	def save_textures(self, dirpath):
+		imageFileNames = []
 		for (image, texInfo), texture in self.textures.items():
 			if texInfo[1] != 'PAL':
 				# remove '.inc.c'
 				imageFileName = texture.filename[:-6] + '.png'
-				if False:
+				imageFileNames.append(imageFileName)
+				if not isinstance(image, bpy.types.Image):
+					# Texture atlases have no image data block.
+					image.save(os.path.join(dirpath, imageFileName))
+				elif False:
 					image.save_render(os.path.join(dirpath, imageFileName))
 				else:
 					isPacked = image.packed_file is not None
@@ -1812,6 +1923,7 @@ class FModel:
 						image.filepath = oldpath
 						raise Exception(str(e))
 					image.filepath = oldpath
+		return imageFileNames
 	
 	def freePalettes(self):
 		# Palettes no longer saved
@@ -1884,20 +1996,19 @@ class FMeshGroup:
 			self.skinnedMesh.save_binary(romfile, f3d, segments)
 	
 	def to_c(self, f3d):
-		static_data = ""
-		dynamic_data = ""
+		staticOut = io.StringIO()
+		dynamicOut = io.StringIO()
+		scroll_data = self.write_c(staticOut, dynamicOut, f3d)
+		return staticOut.getvalue(), dynamicOut.getvalue(), scroll_data
+
+	def write_c(self, staticOut, dynamicOut, f3d):
 		scroll_data = ""
-		if self.mesh is not None:
-			meshStatic, meshDynamic, meshScroll = self.mesh.to_c(f3d)
-			static_data += meshStatic + '\n'
-			dynamic_data += meshDynamic + '\n'
-			scroll_data += meshScroll
-		if self.skinnedMesh is not None:
-			skinnedMeshStatic, skinnedMeshDynamic, skinnedMeshScroll = self.skinnedMesh.to_c(f3d)
-			static_data += skinnedMeshStatic + '\n'
-			dynamic_data += skinnedMeshDynamic + '\n'
-			scroll_data += skinnedMeshScroll
-		return static_data, dynamic_data, scroll_data
+		for mesh in [self.mesh, self.skinnedMesh]:
+			if mesh is not None:
+				scroll_data += mesh.write_c(staticOut, dynamicOut, f3d)
+				staticOut.write('\n')
+				dynamicOut.write('\n')
+		return scroll_data
 	
 	def to_c_def(self):
 		static_data = ''
@@ -1967,18 +2078,24 @@ class FMesh:
 			drawOverride.save_binary(romfile, f3d, segments)
 	
 	def to_c(self, f3d):
-		static_data = ''
+		staticOut = io.StringIO()
+		dynamicOut = io.StringIO()
+		scroll_data = self.write_c(staticOut, dynamicOut, f3d)
+		return staticOut.getvalue(), dynamicOut.getvalue(), scroll_data
+
+	def write_c(self, staticOut, dynamicOut, f3d):
 		scroll_data = ''
 		if self.cullVertexList is not None:
-			static_data += self.cullVertexList.to_c() + '\n\n'
+			self.cullVertexList.write_c(staticOut)
+			staticOut.write('\n\n')
 		for triGroup in self.triangleGroups:
-			triGroupStatic, triGroupScroll = triGroup.to_c(f3d)
-			static_data += triGroupStatic
-			scroll_data += triGroupScroll
-		dynamic_data = self.draw.to_c(f3d) + '\n\n'
+			scroll_data += triGroup.write_c(staticOut, f3d)
+		self.draw.write_c(dynamicOut, f3d)
+		dynamicOut.write('\n\n')
 		for materialTuple, drawOverride in self.drawMatOverrides.items():
-			dynamic_data += drawOverride.to_c(f3d) + '\n\n'
-		return static_data, dynamic_data, scroll_data
+			drawOverride.write_c(dynamicOut, f3d)
+			dynamicOut.write('\n\n')
+		return scroll_data
 
 	def to_c_def(self):
 		dynamic_data = self.draw.to_c_def()
@@ -2014,13 +2131,18 @@ class FTriGroup:
 		self.vertexList.save_binary(romfile)
 	
 	def to_c(self, f3d):
-		static_data = self.vertexList.to_c() + '\n\n' +\
-			self.triList.to_c(f3d)
+		out = io.StringIO()
+		scroll_data = self.write_c(out, f3d)
+		return out.getvalue(), scroll_data
+
+	def write_c(self, out, f3d):
+		self.vertexList.write_c(out)
+		out.write('\n\n')
+		self.triList.write_c(out, f3d)
 		if self.fMaterial.scrollData is not None:
-			scroll_data = self.fMaterial.scrollData.to_c(self.vertexList.name, len(self.vertexList.vertices))
+			return self.fMaterial.scrollData.to_c(self.vertexList.name, len(self.vertexList.vertices))
 		else:
-			scroll_data = ''
-		return static_data, scroll_data
+			return ''
 
 	def to_c_def(self):
 		static_data = self.vertexList.to_c_def() +\
@@ -2233,10 +2355,16 @@ class FMaterial:
 			self.revert.save_binary(romfile, f3d, segments)
 
 	def to_c(self, f3d):
-		data = self.material.to_c(f3d) + '\n\n'
+		out = io.StringIO()
+		self.write_c(out, f3d)
+		return out.getvalue()
+
+	def write_c(self, out, f3d):
+		self.material.write_c(out, f3d)
+		out.write('\n\n')
 		if self.revert is not None:
-			data += self.revert.to_c(f3d) + '\n\n'
-		return data
+			self.revert.write_c(out, f3d)
+			out.write('\n\n')
 	
 	def to_c_def(self):
 		data = self.material.to_c_def()
@@ -2464,12 +2592,16 @@ class FImage:
 		return 'extern u8 ' + self.name + '[];'
 	
 	def to_c(self):
+		out = io.StringIO()
+		self.write_c(out)
+		return out.getvalue()
+
+	def write_c(self, out):
 		# This is to force 8 byte alignment
-		code = 'Gfx ' + self.name + '_aligner[] = {gsSPEndDisplayList()};\n'
-		code += 'u8 ' + self.name + '[] = {\n\t'
-		code += self.to_c_data()
-		code += '\n};\n'
-		return code
+		out.write('Gfx ' + self.name + '_aligner[] = {gsSPEndDisplayList()};\n')
+		out.write('u8 ' + self.name + '[] = {\n\t')
+		self.write_c_data(out)
+		out.write('\n};\n')
 
 	def to_c_tex_separate(self, texPath):
 		# This is to force 8 byte alignment
@@ -2480,15 +2612,12 @@ class FImage:
 		return code
 
 	def to_c_data(self):
-		code = ''
-		counter = 0
-		for i in range(len(self.data)):
-			code += '0x' + format(self.data[i], 'X') + ', '
-			counter += 1
-			if counter > 8:
-				code += '\n\t'
-				counter = 0
-		return code
+		out = io.StringIO()
+		self.write_c_data(out)
+		return out.getvalue()
+
+	def write_c_data(self, out):
+		writeCValueArray(out, self.data, formatCHexByte, 9)
 
 	
 	def set_addr(self, startAddress):
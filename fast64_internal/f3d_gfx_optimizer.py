@@ -0,0 +1,265 @@
+import bpy
+
+from .utility import *
+from .f3d_gbi import *
+
+# Peephole pass over the draw lists of a model.
+# Each material is called as its own display list, followed by its revert list,
+# so consecutive materials often revert and immediately reapply the same state.
+# RDP / RSP state is tracked symbolically within a single draw list only,
+# since the state a draw list starts with is unknown.
+
+# Commands that set a single piece of state, compared by their arguments.
+stateCommands = (DPSetAlphaDither, DPSetColorDither, DPSetCombineKey,
+	DPSetTextureConvert, DPSetTextureFilter, DPSetTextureLUT, DPSetTextureLOD,
+	DPSetTextureDetail, DPSetTexturePersp, DPSetCycleType, DPPipelineMode,
+	DPSetAlphaCompare, DPSetDepthSource, DPSetRenderMode, DPSetCombineMode,
+	DPSetPrimColor, DPSetEnvColor, DPSetBlendColor, DPSetFogColor, DPSetConvert,
+	DPSetKeyR, DPSetKeyGB, SPFogPosition, SPClipRatio, SPTexture, SPSetLights)
+
+# Geometry mode commands are tracked per flag.
+geoModeCommands = (SPSetGeometryMode, SPClearGeometryMode)
+
+# State that only the RSP reads, which doesn't need a pipe sync.
+rspStateCommands = geoModeCommands + (SPFogPosition, SPClipRatio, SPTexture, SPSetLights)
+
+syncCommands = (DPPipeSync, DPLoadSync, DPTileSync)
+
+drawCommands = (SPVertex, SP1Triangle, SP2Triangles, SPLine3D, SPLineW3D)
+
+# Texture state is tracked per tile, along with what was loaded at each TMEM address.
+# Texture load macros are not tracked.
+tmemLoadCommands = (DPLoadTile, DPLoadBlock, DPLoadTLUTCmd)
+
+# Used to mark where triangles are drawn when estimating material transitions.
+transitionDraw = SP1Triangle(0, 0, 0, 0)
+
+def isDrawOnlyList(gfxList):
+	for command in gfxList.commands:
+		if not isinstance(command, drawCommands) and \
+			not isinstance(command, SPEndDisplayList):
+			return False
+	return True
+
+# Commands that draw without changing any tracked state,
+# including calls to triangle lists.
+def isDrawOnly(command):
+	return isinstance(command, drawCommands) or \
+		(isinstance(command, SPDisplayList) and isDrawOnlyList(command.displayList))
+
+def isStateCommand(command):
+	return isinstance(command, stateCommands) or isinstance(command, geoModeCommands)
+
+# Returns the key of the state set by a command, compared by its arguments.
+def getStateKey(command):
+	if isinstance(command, stateCommands) or isinstance(command, DPSetTextureImage):
+		return type(command)
+	elif isinstance(command, DPSetTile):
+		return DPSetTile, command.tile
+	elif isinstance(command, DPSetTileSize):
+		return DPSetTileSize, command.t
+	return None
+
+def getLoadTile(command):
+	return command.t if isinstance(command, DPLoadTile) else command.tile
+
+# Returns the commands of a static display list without the end command,
+# or None if it can't be inlined.
+def getInlineCommands(gfxList, f3d, inlineSize):
+	commands = gfxList.commands
+	if gfxList.DLFormat != 'Static' or len(commands) == 0 or \
+		not isinstance(commands[-1], SPEndDisplayList):
+		return None
+	for command in commands[:-1]:
+		if isinstance(command, SPEndDisplayList) or isinstance(command, SPBranchList):
+			return None
+	if gfxList.size(f3d) // GFX_SIZE - 1 > inlineSize:
+		return None
+	return commands[:-1]
+
+# Removes a revert list that is directly followed by its own material again.
+# Inlines material and revert lists of at most inlineSize commands into static draw lists.
+def expandMaterialCalls(gfxList, fModel, inlineSize):
+	revertMaterials = {}
+	materialLists = set()
+	for fMaterial, texDimensions in fModel.materials.values():
+		materialLists.add(fMaterial.material)
+		if fMaterial.revert is not None:
+			revertMaterials[fMaterial.revert] = fMaterial.material
+			materialLists.add(fMaterial.revert)
+
+	commands = []
+	i = 0
+	while i < len(gfxList.commands):
+		command = gfxList.commands[i]
+		if isinstance(command, SPDisplayList) and command.displayList in revertMaterials and \
+			i + 1 < len(gfxList.commands) and \
+			isinstance(gfxList.commands[i + 1], SPDisplayList) and \
+			gfxList.commands[i + 1].displayList is revertMaterials[command.displayList]:
+			i += 2
+			continue
+
+		inlineCommands = None
+		if inlineSize > 0 and gfxList.DLFormat == 'Static' and \
+			isinstance(command, SPDisplayList) and command.displayList in materialLists:
+			inlineCommands = getInlineCommands(command.displayList, fModel.f3d, inlineSize)
+		if inlineCommands is not None:
+			commands.extend(inlineCommands)
+		else:
+			commands.append(command)
+		i += 1
+	return commands
+
+# Removes state commands that are overwritten before anything uses them.
+def removeOverwrittenState(commands):
+	result = []
+	overwritten = set()
+	for command in reversed(commands):
+		if isinstance(command, geoModeCommands):
+			flagList = [flag for flag in command.flagList if flag not in overwritten]
+			overwritten.update(command.flagList)
+			if len(flagList) == 0:
+				continue
+			elif len(flagList) < len(command.flagList):
+				command = type(command)(flagList)
+		elif isinstance(command, stateCommands):
+			if type(command) in overwritten:
+				continue
+			overwritten.add(type(command))
+		elif not isinstance(command, syncCommands):
+			overwritten = set()
+		result.append(command)
+	result.reverse()
+	return result
+
+# Removes state commands that set the value the state already has,
+# and TMEM loads of data that is already loaded at the same address.
+def removeUnchangedState(commands):
+	result = []
+	state = {}
+	# dict of TMEM address : (texture image, load tile, load command)
+	tmem = {}
+	for command in commands:
+		stateKey = getStateKey(command)
+		if isinstance(command, geoModeCommands):
+			value = isinstance(command, SPSetGeometryMode)
+			flagList = [flag for flag in command.flagList if state.get(flag) != value]
+			for flag in flagList:
+				state[flag] = value
+			if len(flagList) == 0:
+				continue
+			elif len(flagList) < len(command.flagList):
+				command = type(command)(flagList)
+		elif stateKey is not None:
+			value = dict(vars(command))
+			if state.get(stateKey) == value:
+				continue
+			state[stateKey] = value
+		elif isinstance(command, tmemLoadCommands):
+			# Loads also set the size of the load tile.
+			tile = getLoadTile(command)
+			loadValue = ('load', dict(vars(command)))
+			image = state.get(DPSetTextureImage)
+			loadTile = state.get((DPSetTile, tile))
+			if image is None or loadTile is None:
+				tmem = {}
+			else:
+				loadData = (image, loadTile, loadValue)
+				if tmem.get(loadTile['tmem']) == loadData and \
+					state.get((DPSetTileSize, tile)) == loadValue:
+					continue
+				# Other loaded data may overlap this load.
+				tmem = {loadTile['tmem'] : loadData}
+			state[(DPSetTileSize, tile)] = loadValue
+		elif not isDrawOnly(command) and not isinstance(command, syncCommands):
+			state = {}
+			tmem = {}
+		result.append(command)
+	return result
+
+# Returns True if a sync is needed before the command.
+def needsSync(sync, command):
+	if isinstance(sync, DPPipeSync):
+		return not isinstance(command, rspStateCommands)
+	else:
+		return not isStateCommand(command)
+
+# Removes syncs with no draw or load since the last sync of the same kind,
+# and syncs followed by nothing that needs them before the next draw.
+def removeRedundantSyncs(commands):
+	result = []
+	synced = set()
+	for command in commands:
+		if isinstance(command, syncCommands):
+			if type(command) in synced:
+				continue
+			synced.add(type(command))
+		elif not isStateCommand(command):
+			synced = set()
+		result.append(command)
+
+	commands = result
+	result = []
+	for i in range(len(commands)):
+		command = commands[i]
+		if isinstance(command, syncCommands):
+			nextIndex = i + 1
+			while nextIndex < len(commands) and \
+				not isDrawOnly(commands[nextIndex]) and \
+				(isinstance(commands[nextIndex], syncCommands) or \
+				not needsSync(command, commands[nextIndex])):
+				nextIndex += 1
+			if nextIndex < len(commands) and isDrawOnly(commands[nextIndex]):
+				continue
+		result.append(command)
+	return result
+
+def optimizeCommands(commands):
+	commands = removeOverwrittenState(commands)
+	commands = removeUnchangedState(commands)
+	return removeRedundantSyncs(commands)
+
+def optimizeDrawList(gfxList, fModel, inlineSize):
+	gfxList.commands = optimizeCommands(expandMaterialCalls(gfxList, fModel, inlineSize))
+
+def getMaterialCommands(gfxList):
+	if gfxList is None:
+		return []
+	return [command for command in gfxList.commands if not isinstance(command, SPEndDisplayList)]
+
+# Size of the commands left between drawing with one material and the next,
+# once its revert list and the next material are inlined and optimized.
+def getMaterialTransitionCost(fromMaterial, toMaterial, f3d):
+	commands = optimizeCommands(getMaterialCommands(fromMaterial.material) + [transitionDraw] + \
+		getMaterialCommands(fromMaterial.revert) + getMaterialCommands(toMaterial.material) + \
+		[transitionDraw])
+	start = commands.index(transitionDraw) + 1
+	return sum([command.size(f3d) for command in commands[start:-1]])
+
+# Returns the indices of fMaterials in the order to draw them in.
+# Starts with the first material, then always picks the cheapest transition.
+def getMaterialStateOrder(fMaterials, f3d):
+	costs = [[getMaterialTransitionCost(fromMaterial, toMaterial, f3d) \
+		for toMaterial in fMaterials] for fromMaterial in fMaterials]
+	order = [0]
+	remaining = list(range(1, len(fMaterials)))
+	while len(remaining) > 0:
+		nextIndex = min(remaining, key = lambda index: costs[order[-1]][index])
+		order.append(nextIndex)
+		remaining.remove(nextIndex)
+	return order
+
+# meshGroups is a list of mesh group names to optimize, or None for all of them.
+def optimizeModelDrawLists(fModel, meshGroups = None):
+	if not bpy.context.scene.optimizeDisplayLists:
+		return
+	inlineSize = bpy.context.scene.displayListInlineSize
+	for name, meshGroup in fModel.meshGroups.items():
+		if meshGroups is not None and name not in meshGroups:
+			continue
+		for fMesh in [meshGroup.mesh, meshGroup.skinnedMesh]:
+			if fMesh is None:
+				continue
+			optimizeDrawList(fMesh.draw, fModel, inlineSize)
+			for drawOverride in fMesh.drawMatOverrides.values():
+				optimizeDrawList(drawOverride, fModel, inlineSize)
@@ -0,0 +1,157 @@
+import numpy as np
+
+def getLoopColorArray(colorLayer, loopCount):
+	colors = np.empty(loopCount * 4, dtype = np.float32)
+	colorLayer.data.foreach_get('color', colors)
+	return colors.reshape((loopCount, 4))
+
+# Per loop F3D vertex data, read from the mesh in bulk with foreach_get.
+# Every loop is given an integer vertex ID. Two loops share an ID exactly
+# when their (position, uv, colorOrNormal) F3D vertices would be equal,
+# so IDs can be compared / hashed instead of tuples of mathutils vectors.
+# Vertex colors are used for loops whose face material has lighting
+# disabled, normals otherwise.
+class F3DMeshData:
+	def __init__(self, mesh, uv_data, exportVertexColorsByMaterial):
+		loopCount = len(mesh.loops)
+		vertCount = len(mesh.vertices)
+		triCount = len(mesh.loop_triangles)
+
+		positions = np.empty(vertCount * 3, dtype = np.float32)
+		mesh.vertices.foreach_get('co', positions)
+		positions = positions.reshape((vertCount, 3))
+
+		loopVertIndices = np.empty(loopCount, dtype = np.int32)
+		mesh.loops.foreach_get('vertex_index', loopVertIndices)
+
+		# N64 is -Y, Blender is +Y
+		uvs = np.empty(loopCount * 2, dtype = np.float32)
+		uv_data.foreach_get('uv', uvs)
+		uvs = uvs.reshape((loopCount, 2))
+		uvs[:, 1] = 1 - uvs[:, 1]
+
+		# Normals are rounded to multiples of 1/128.
+		normals = np.empty(loopCount * 3, dtype = np.float32)
+		mesh.loops.foreach_get('normal', normals)
+		normals = np.round(normals.reshape((loopCount, 3)).astype(np.float64) * 128) / 128
+
+		if 'Col' in mesh.vertex_colors:
+			colors = getLoopColorArray(mesh.vertex_colors['Col'], loopCount)[:, :3]
+		else:
+			colors = np.ones((loopCount, 3), dtype = np.float32)
+
+		# Alpha is the HSV value of the alpha layer color.
+		if 'Alpha' in mesh.vertex_colors:
+			alpha = getLoopColorArray(mesh.vertex_colors['Alpha'], loopCount)[:, :3].max(axis = 1)
+		else:
+			alpha = np.ones(loopCount, dtype = np.float32)
+
+		# Loops take the lighting setting of the triangle they belong to.
+		triLoops = np.empty(triCount * 3, dtype = np.int32)
+		mesh.loop_triangles.foreach_get('loops', triLoops)
+		triMaterials = np.empty(triCount, dtype = np.int32)
+		mesh.loop_triangles.foreach_get('material_index', triMaterials)
+		loopExportVertexColors = np.zeros(loopCount, dtype = bool)
+		if len(exportVertexColorsByMaterial) > 0:
+			loopExportVertexColors[triLoops] = np.repeat(
+				np.array(exportVertexColorsByMaterial, dtype = bool)[triMaterials], 3)
+
+		colorOrNormal = np.where(loopExportVertexColors[:, None],
+			np.column_stack((colors, alpha)), np.column_stack((normals, alpha)))
+
+		# float32 values are exact in float64, so equality matches the
+		# comparison of the original mathutils vectors.
+		rows = np.column_stack((positions[loopVertIndices], uvs, colorOrNormal,
+			loopExportVertexColors)).astype(np.float64)
+		self.vertData, loopVertIDs = np.unique(rows, axis = 0, return_inverse = True)
+		self.loopVertIDs = loopVertIDs.reshape(-1).tolist()
+
+	def getLoopVertID(self, loopIndex):
+		return self.loopVertIDs[loopIndex]
+
+# Groups elements of keys, one key per triangle corner (triangle index * 3 + corner).
+# Returns (group keys, [[element indices]]), with groups in order of first appearance
+# and elements in ascending order, keeping only the first element of each triangle.
+def groupTriangleCorners(keys):
+	# Meshes without triangles, like vertex / edge only meshes.
+	if len(keys) == 0:
+		return [], []
+	order = np.argsort(keys, kind = 'stable')
+	sortedKeys = keys[order]
+	sortedTris = order // 3
+	keep = np.ones(len(order), dtype = bool)
+	keep[1:] = (sortedKeys[1:] != sortedKeys[:-1]) | (sortedTris[1:] != sortedTris[:-1])
+	order = order[keep]
+	sortedKeys = sortedKeys[keep]
+
+	starts = np.flatnonzero(np.concatenate(([True], sortedKeys[1:] != sortedKeys[:-1])))
+	ends = np.append(starts[1:], len(order)).tolist()
+	groupOrder = np.argsort(order[starts], kind = 'stable').tolist()
+	groupKeys = sortedKeys[starts].tolist()
+	starts = starts.tolist()
+	order = order.tolist()
+	return [groupKeys[i] for i in groupOrder], \
+		[order[starts[i]:ends[i]] for i in groupOrder]
+
+# Returns the vert, edge, edgeValid and validNeighbors dicts of getInfoDict, 
+# built from loop triangle arrays instead of one face at a time. 
+# An edge is valid when the loops of both faces have the same F3D vertex IDs.
+# Contents and order match adding faces in order, using the first loop
+# of a face with a given vertex.
+def getMeshAdjacency(mesh, faces, loopVertIDs):
+	triCount = len(faces)
+	triVerts = np.empty(triCount * 3, dtype = np.int32)
+	mesh.loop_triangles.foreach_get('vertices', triVerts)
+	triVerts = triVerts.reshape((triCount, 3)).astype(np.int64)
+	triLoops = np.empty(triCount * 3, dtype = np.int32)
+	mesh.loop_triangles.foreach_get('loops', triLoops)
+	triVertIDs = np.asarray(loopVertIDs, dtype = np.int64)[triLoops].reshape((triCount, 3))
+
+	# Use the first loop of the face with a given vertex.
+	triVertIDs[:, 2] = np.where(triVerts[:, 2] == triVerts[:, 1], 
+		triVertIDs[:, 1], triVertIDs[:, 2])
+	triVertIDs[:, 1:] = np.where(triVerts[:, 1:] == triVerts[:, 0:1], 
+		triVertIDs[:, 0:1], triVertIDs[:, 1:])
+
+	# Same order as edge_keys, (v0, v1), (v1, v2), (v2, v0)
+	nextVerts = np.roll(triVerts, -1, axis = 1)
+	nextVertIDs = np.roll(triVertIDs, -1, axis = 1)
+	swapped = triVerts > nextVerts
+	edgeStarts = np.minimum(triVerts, nextVerts).reshape(-1)
+	edgeEnds = np.maximum(triVerts, nextVerts).reshape(-1)
+	edgeStartIDs = np.where(swapped, nextVertIDs, triVertIDs).reshape(-1).tolist()
+	edgeEndIDs = np.where(swapped, triVertIDs, nextVertIDs).reshape(-1).tolist()
+
+	vertDict = {}
+	vertKeys, vertGroups = groupTriangleCorners(triVerts.reshape(-1))
+	for i in range(len(vertKeys)):
+		vertDict[vertKeys[i]] = [faces[element // 3] for element in vertGroups[i]]
+
+	edgeDict = {}
+	vertCount = max(len(mesh.vertices), 1)
+	edgeKeys, edgeGroups = groupTriangleCorners(edgeStarts * vertCount + edgeEnds)
+	facePairs = []
+	for i in range(len(edgeKeys)):
+		elements = edgeGroups[i]
+		edgeDict[divmod(edgeKeys[i], vertCount)] = \
+			[faces[element // 3] for element in elements]
+		for j in range(len(elements)):
+			for k in range(j + 1, len(elements)):
+				facePairs.append((elements[j], elements[k]))
+
+	# Each face pair is checked once, on the first edge of the earlier face 
+	# that they share, and pairs are handled in order of that face and edge.
+	edgeValidDict = {}
+	validNeighborDict = {face : [] for face in faces}
+	for element, otherElement in sorted(facePairs):
+		face = faces[element // 3]
+		otherFace = faces[otherElement // 3]
+		if (otherFace, face) in edgeValidDict:
+			continue
+		edgeValid = edgeStartIDs[element] == edgeStartIDs[otherElement] and \
+			edgeEndIDs[element] == edgeEndIDs[otherElement]
+		edgeValidDict[(otherFace, face)] = edgeValid
+		if edgeValid:
+			validNeighborDict[face].append(otherFace)
+			validNeighborDict[otherFace].append(face)
+	return vertDict, edgeDict, edgeValidDict, validNeighborDict
@@ -87,8 +87,7 @@ def parseF3D(romfile, startAddress, scene,
 	bMesh, obj, transformMatrix, groupName,  segmentData, vertexBuffer):
 	f3d = F3D('F3D', False)
 	currentAddress = startAddress
-	romfile.seek(currentAddress)
-	command = romfile.read(8)
+	command = romfile.readBytes(currentAddress, 8)
 	
 	faceSeq = bMesh.faces
 	vertSeq = bMesh.verts
@@ -130,8 +129,7 @@ def parseF3D(romfile, startAddress, scene,
 				jumps.append(currentAddress)
 			currentAddress = decodeSegmentedAddr(command[4:8], 
 				segmentData = segmentData)
-			romfile.seek(currentAddress)
-			command = romfile.read(8)
+			command = romfile.readBytes(currentAddress, 8)
 			continue
 
 		elif command[0] == cmdToPositiveInt(f3d.G_ENDDL):
@@ -159,8 +157,7 @@ def parseF3D(romfile, startAddress, scene,
 			#print(format(command[0], '#04x') + ' at ' + hex(currentAddress))
 
 		currentAddress += 8
-		romfile.seek(currentAddress)
-		command = romfile.read(8)
+		command = romfile.readBytes(currentAddress, 8)
 	
 	bmesh.ops.remove_doubles(bMesh, verts = vertList, dist = 0.0001)
 	return vertexBuffer
@@ -240,8 +237,7 @@ def interpretLoadVertices(romfile, vertexBuffer, transformMatrix, command,
 	dataStartAddr = decodeSegmentedAddr(segmentedAddr.to_bytes(4, 'big'), 
 		segmentData = segmentData)
 
-	romfile.seek(dataStartAddr)
-	data = romfile.read(dataLength)
+	data = romfile.readBytes(dataStartAddr, dataLength)
 
 	for i in range(numVerts):
 		vert = mathutils.Vector(readVectorFromShorts(data, i * 16))
@@ -323,10 +319,9 @@ def createNewTextureMaterial(romfile, textureStart, textureSize, texelCount, col
 	
 	obj.data.materials.append(newMat)
 	
-	romfile.seek(textureStart)
 	texelSize = int(colorDepth / 8)
 	dataLength = texelCount * texelSize
-	textureData = romfile.read(dataLength)
+	textureData = romfile.readBytes(textureStart, dataLength)
 
 	if colorDepth != 16:
 		print("Warning: Only 16bit RGBA supported, input was " + \
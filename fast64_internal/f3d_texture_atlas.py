@@ -0,0 +1,250 @@
+import bpy
+import numpy as np
+
+from .utility import *
+from .f3d_material import all_combiner_uses, getTmemWordUsage
+from .f3d_texture_encoder import *
+
+# Packs the textures of materials that only differ by their texture into
+# atlases that fit in TMEM. The faces of those materials are then drawn with
+# a single material and one texture load per atlas. Only faces whose UVs stay
+# inside their texture are atlased, since a texture in an atlas can't wrap.
+
+atlasTmemWords = 512
+
+# Each texture gets a one texel border, so that filtering at its edges
+# samples the same texels as wrapping / clamping the original texture would.
+atlasBorder = 1
+
+atlasWidths = [16, 32, 64, 128, 256, 512, 1024]
+
+# Material properties that don't affect the exported material,
+# or that are replaced by the atlas.
+ignoredAtlasProperties = {'rna_type', 'name', 'name_full', 'session_uid', 'tag',
+	'is_evaluated', 'original', 'users', 'use_fake_user', 'is_runtime_data',
+	'is_library_indirect', 'library', 'preview', 'texture_paint_images',
+	'texture_paint_slots', 'paint_active_slot', 'node_tree', 'tex0'}
+
+class TextureAtlas:
+	def __init__(self, name, texFormat):
+		self.name = name
+		self.texFormat = texFormat
+		self.width = 0
+		self.height = 0
+		# (height, width, 4) array, like getImagePixels
+		self.pixels = None
+		# dict of material index : (x, y, width, height) of its texture
+		self.regions = {}
+
+	# Used instead of Image.save when exporting textures as png.
+	def save(self, filepath):
+		image = bpy.data.images.new(self.name, self.width, self.height, alpha = True)
+		try:
+			image.pixels[:] = self.pixels[::-1].reshape(-1).tolist()
+			image.filepath_raw = filepath
+			image.file_format = 'PNG'
+			image.save()
+		finally:
+			bpy.data.images.remove(image)
+
+# Materials with equal keys export the same commands, apart from their texture.
+def getAtlasMaterialKey(material):
+	key = [material.tex0.tex_format, 
+		getRNAPropertyValues(material, ignoredAtlasProperties, lambda value: value)]
+	if material.node_tree is not None:
+		for node in material.node_tree.nodes:
+			for nodeInput in node.inputs:
+				if hasattr(nodeInput, 'default_value'):
+					value = nodeInput.default_value
+					key.append((node.name, nodeInput.name, tuple(value) \
+						if hasattr(value, '__len__') else value))
+	return key
+
+# Returns the (width, height) of a texture including its border.
+def getPaddedSize(image):
+	return image.size[0] + 2 * atlasBorder, image.size[1] + 2 * atlasBorder
+
+# Returns the texture of a material if it can be put in an atlas, else None.
+def getAtlasTexture(material):
+	if not material.is_f3d or material.rdp_settings.g_tex_gen:
+		return None
+	useDict = all_combiner_uses(material)
+	texProp = material.tex0
+	if not useDict['Texture 0'] or useDict['Texture 1'] or \
+		not texProp.tex_set or texProp.tex is None or texProp.tex_format[:2] == 'CI':
+		return None
+	if any([field.animType != 'None' for field in \
+		[material.UVanim.x, material.UVanim.y, material.UVanim.z]]):
+		return None
+	if tuple(material.tex_scale) != (1, 1):
+		return None
+
+	tex = texProp.tex
+	if len(tex.pixels) == 0:
+		return None
+	for field, length in [(texProp.S, tex.size[0]), (texProp.T, tex.size[1])]:
+		if field.low != 0 or field.high != length - 1 or field.shift != 0:
+			return None
+	paddedWidth, paddedHeight = getPaddedSize(tex)
+	if getTmemWordUsage(texProp.tex_format, paddedWidth, paddedHeight) > atlasTmemWords // 2:
+		return None
+	return tex
+
+# Shelf packs (width, height) sizes, in the given order.
+# Returns (atlas width, atlas height, [(x, y)]) using the least TMEM, or None.
+def packAtlas(sizes, texFormat):
+	best = None
+	maxWidth = max([size[0] for size in sizes])
+	for atlasWidth in atlasWidths:
+		if atlasWidth < maxWidth:
+			continue
+		positions = []
+		x = 0
+		y = 0
+		shelfHeight = 0
+		usedWidth = 0
+		for width, height in sizes:
+			if x + width > atlasWidth:
+				x = 0
+				y += shelfHeight
+				shelfHeight = 0
+			positions.append((x, y))
+			x += width
+			usedWidth = max(usedWidth, x)
+			shelfHeight = max(shelfHeight, height)
+		# Rows of 4 bit textures must be whole bytes.
+		packedSize = ((usedWidth + 3) // 4 * 4, y + shelfHeight)
+		if packedSize[1] > 1024:
+			continue
+		words = getTmemWordUsage(texFormat, packedSize[0], packedSize[1])
+		if words <= atlasTmemWords and \
+			(best is None or (words, packedSize[1]) < (best[0], best[2][1])):
+			best = (words, positions, packedSize)
+	if best is None:
+		return None
+	return best[2][0], best[2][1], best[1]
+
+# Pads a texture with its border, following the texture's clamp / mirror settings.
+def getPaddedPixels(image, texProp):
+	pixels = getImagePixels(image)
+	sMode = 'wrap' if not texProp.S.clamp and not texProp.S.mirror else 'edge'
+	tMode = 'wrap' if not texProp.T.clamp and not texProp.T.mirror else 'edge'
+	pixels = np.pad(pixels, ((0, 0), (atlasBorder, atlasBorder), (0, 0)), mode = sMode)
+	return np.pad(pixels, ((atlasBorder, atlasBorder), (0, 0), (0, 0)), mode = tMode)
+
+# entries is a list of (material index, image, texProp) sharing one atlas.
+def createTextureAtlas(name, texFormat, entries, layout):
+	atlasWidth, atlasHeight, positions = layout
+	atlas = TextureAtlas(name, texFormat)
+	atlas.width = atlasWidth
+	atlas.height = atlasHeight
+	atlas.pixels = np.zeros((atlasHeight, atlasWidth, 4), dtype = np.float64)
+	textureKeys = getAtlasTextureKeys(entries)
+	for (textureKey, (image, texProp)), (x, y) in zip(textureKeys.items(), positions):
+		paddedWidth, paddedHeight = getPaddedSize(image)
+		atlas.pixels[y:y + paddedHeight, x:x + paddedWidth] = getPaddedPixels(image, texProp)
+		for materialIndex, entryImage, entryTexProp in entries:
+			if getAtlasTextureKey(entryImage, entryTexProp) == textureKey:
+				atlas.regions[materialIndex] = (x + atlasBorder, y + atlasBorder,
+					image.size[0], image.size[1])
+	return atlas
+
+# Textures with the same image and border can share a region.
+def getAtlasTextureKey(image, texProp):
+	return image, texProp.S.clamp or texProp.S.mirror, texProp.T.clamp or texProp.T.mirror
+
+# Returns an ordered dict of texture key : (image, texProp), largest first.
+def getAtlasTextureKeys(entries):
+	textureKeys = {}
+	for materialIndex, image, texProp in entries:
+		textureKeys.setdefault(getAtlasTextureKey(image, texProp), (image, texProp))
+	return dict(sorted(textureKeys.items(), key = lambda item: \
+		(-getPaddedSize(item[1][0])[1], -getPaddedSize(item[1][0])[0])))
+
+# Splits entries into atlases that fit in TMEM, adding textures in order of
+# decreasing size to the first atlas they fit in.
+# Returns a list of (entries, layout), with at least two textures per atlas.
+def groupAtlasEntries(entries, texFormat):
+	atlasGroups = []
+	for textureKey, (image, texProp) in getAtlasTextureKeys(entries).items():
+		textureEntries = [entry for entry in entries if \
+			getAtlasTextureKey(entry[1], entry[2]) == textureKey]
+		for i in range(len(atlasGroups)):
+			groupEntries = atlasGroups[i][0] + textureEntries
+			layout = packAtlas([getPaddedSize(textureImage) for textureImage, textureProp in \
+				getAtlasTextureKeys(groupEntries).values()], texFormat)
+			if layout is not None:
+				atlasGroups[i] = (groupEntries, layout)
+				break
+		else:
+			atlasGroups.append((textureEntries, None))
+	return [(group, layout) for group, layout in atlasGroups \
+		if len(getAtlasTextureKeys(group)) > 1]
+
+# Puts the textures of compatible materials of a mesh into atlases.
+# UVs of the atlased faces are moved into the atlas, and the faces are
+# given the material index of the first material in their atlas.
+# The mesh must be a temporary copy. Call before calc_loop_triangles.
+# Returns a dict of material index : TextureAtlas.
+def applyTextureAtlases(obj, name):
+	mesh = obj.data
+	if 'UVMap' not in mesh.uv_layers or len(mesh.polygons) == 0:
+		return {}
+	polyCount = len(mesh.polygons)
+	loopCount = len(mesh.loops)
+	polyMaterials = np.empty(polyCount, dtype = np.int32)
+	mesh.polygons.foreach_get('material_index', polyMaterials)
+	loopStarts = np.empty(polyCount, dtype = np.int32)
+	mesh.polygons.foreach_get('loop_start', loopStarts)
+	loopTotals = np.empty(polyCount, dtype = np.int32)
+	mesh.polygons.foreach_get('loop_total', loopTotals)
+	loopMaterials = np.full(loopCount, -1, dtype = np.int32)
+	loopOffsets = np.arange(loopTotals.sum()) - np.repeat(np.cumsum(loopTotals) - loopTotals, loopTotals)
+	loopMaterials[np.repeat(loopStarts, loopTotals) + loopOffsets] = np.repeat(polyMaterials, loopTotals)
+
+	uv_data = mesh.uv_layers['UVMap'].data
+	uvs = np.empty(loopCount * 2, dtype = np.float32)
+	uv_data.foreach_get('uv', uvs)
+	uvs = uvs.reshape((loopCount, 2)).astype(np.float64)
+
+	# list of (key, [(material index, image, texProp)])
+	materialGroups = []
+	for materialIndex in np.unique(polyMaterials).tolist():
+		if materialIndex >= len(mesh.materials) or mesh.materials[materialIndex] is None:
+			continue
+		material = mesh.materials[materialIndex]
+		image = getAtlasTexture(material)
+		if image is None:
+			continue
+		materialUVs = uvs[loopMaterials == materialIndex]
+		if materialUVs.size > 0 and (materialUVs.min() < -0.0001 or materialUVs.max() > 1.0001):
+			continue
+		key = getAtlasMaterialKey(material)
+		entry = (materialIndex, image, material.tex0)
+		for groupKey, entries in materialGroups:
+			if groupKey == key:
+				entries.append(entry)
+				break
+		else:
+			materialGroups.append((key, [entry]))
+
+	atlases = {}
+	for key, entries in materialGroups:
+		texFormat = key[0]
+		for atlasEntries, layout in groupAtlasEntries(entries, texFormat):
+			atlas = createTextureAtlas(name + '_atlas_' + str(len(atlases)),
+				texFormat, atlasEntries, layout)
+			baseIndex = atlasEntries[0][0]
+			atlases[baseIndex] = atlas
+			for materialIndex, (x, y, width, height) in atlas.regions.items():
+				loopMask = loopMaterials == materialIndex
+				uvs[loopMask, 0] = (x + uvs[loopMask, 0] * width) / atlas.width
+				# UV V is flipped compared to N64 T
+				uvs[loopMask, 1] = 1 - (y + (1 - uvs[loopMask, 1]) * height) / atlas.height
+				polyMaterials[polyMaterials == materialIndex] = baseIndex
+
+	if len(atlases) > 0:
+		uv_data.foreach_set('uv', uvs.astype(np.float32).reshape(-1))
+		mesh.polygons.foreach_set('material_index', polyMaterials)
+		mesh.update()
+	return atlases
@@ -0,0 +1,154 @@
+import bpy
+import hashlib
+import os
+import struct
+
+from .utility import *
+from .f3d_texture_encoder import *
+
+# On disk cache of encoded texture data, shared across exports and sessions.
+# Entries are keyed by a hash of the pixel data, image size and formats,
+# so an edited image or a changed format simply misses the cache.
+# File modification times are used as access times for LRU eviction.
+
+textureCacheVersion = b'fast64_texture_cache_1'
+textureCacheHeader = struct.Struct('>II')
+
+# Eviction removes entries until the cache is this fraction of its max size,
+# so a full cache isn't scanned again on every store.
+textureCacheEvictRatio = 0.9
+
+# The TextureCache used by exports, so its size total is kept between textures.
+currentTextureCache = None
+
+def getTextureCacheDir():
+	return bpy.utils.user_resource('DATAFILES', path = 'fast64_texture_cache', create = True)
+
+def getTextureCacheKey(pixels, texFormat, palFormat):
+	hashObj = hashlib.sha1(textureCacheVersion)
+	hashObj.update(str((pixels.shape, texFormat, palFormat)).encode())
+	hashObj.update(pixels.tobytes())
+	return hashObj.hexdigest()
+
+class TextureCache:
+	def __init__(self, cacheDir, maxSize):
+		self.cacheDir = cacheDir
+		self.maxSize = maxSize
+		# Total size of the entries, found by scanning the directory on first store.
+		self.totalSize = None
+
+	def getPath(self, key):
+		return os.path.join(self.cacheDir, key + '.bin')
+
+	# Returns (palette data, texture data), or None on a cache miss.
+	def load(self, key):
+		path = self.getPath(key)
+		try:
+			with open(path, 'rb') as cacheFile:
+				data = cacheFile.read()
+			os.utime(path)
+		except OSError:
+			return None
+		if len(data) < textureCacheHeader.size:
+			return None
+		paletteSize, textureSize = textureCacheHeader.unpack_from(data)
+		start = textureCacheHeader.size
+		if len(data) != start + paletteSize + textureSize:
+			return None
+		return bytearray(data[start:start + paletteSize]), \
+			bytearray(data[start + paletteSize:])
+
+	def store(self, key, paletteData, textureData):
+		path = self.getPath(key)
+		tempPath = path + '.tmp'
+		try:
+			if self.totalSize is None:
+				self.totalSize = self.getEntries()[1]
+			if os.path.exists(path):
+				self.totalSize -= os.path.getsize(path)
+			with open(tempPath, 'wb') as cacheFile:
+				cacheFile.write(textureCacheHeader.pack(len(paletteData), len(textureData)))
+				cacheFile.write(paletteData)
+				cacheFile.write(textureData)
+			os.replace(tempPath, path)
+			self.totalSize += textureCacheHeader.size + len(paletteData) + len(textureData)
+			if self.totalSize > self.maxSize:
+				self.evict()
+		except OSError:
+			# The cache is only an optimization, never fail an export over it.
+			pass
+
+	# Returns ([(access time, size, path)], total size) of the cache entries.
+	def getEntries(self):
+		entries = []
+		totalSize = 0
+		for entry in os.scandir(self.cacheDir):
+			if entry.is_file() and entry.name.endswith('.bin'):
+				stat = entry.stat()
+				entries.append((stat.st_mtime, stat.st_size, entry.path))
+				totalSize += stat.st_size
+		return entries, totalSize
+
+	# Removes least recently used entries until the cache fits in
+	# textureCacheEvictRatio of maxSize.
+	def evict(self):
+		entries, totalSize = self.getEntries()
+		entries.sort()
+		for mtime, size, path in entries:
+			if totalSize <= self.maxSize * textureCacheEvictRatio:
+				break
+			os.remove(path)
+			totalSize -= size
+		self.totalSize = totalSize
+
+	def clear(self):
+		for entry in os.scandir(self.cacheDir):
+			if entry.is_file() and entry.name.endswith('.bin'):
+				os.remove(entry.path)
+		self.totalSize = 0
+		if currentTextureCache is not None and currentTextureCache.cacheDir == self.cacheDir:
+			currentTextureCache.totalSize = None
+
+def getTextureCache():
+	global currentTextureCache
+	if not bpy.context.scene.useTextureCache:
+		return None
+	try:
+		cacheDir = getTextureCacheDir()
+	except OSError:
+		return None
+	maxSize = bpy.context.scene.textureCacheSize * 1024 * 1024
+	if currentTextureCache is None or currentTextureCache.cacheDir != cacheDir:
+		currentTextureCache = TextureCache(cacheDir, maxSize)
+	currentTextureCache.maxSize = maxSize
+	return currentTextureCache
+
+def getEncodedTexture(image, texFormat, fmt, bitSize, name):
+	pixels = getImagePixels(image)
+	cache = getTextureCache()
+	if cache is not None:
+		key = getTextureCacheKey(pixels, texFormat, 'NONE')
+		cachedData = cache.load(key)
+		if cachedData is not None:
+			return cachedData[1]
+
+	textureData = encodeTexture(pixels, fmt, bitSize, name)
+	if cache is not None:
+		cache.store(key, bytearray(0), textureData)
+	return textureData
+
+# Returns (palette data, texture data, palette color count).
+def getEncodedPaletteTexture(image, texFmt, palFmt, palFormat, bitSize, name):
+	pixels = getImagePixels(image)
+	cache = getTextureCache()
+	if cache is not None:
+		key = getTextureCacheKey(pixels, texFmt, palFmt)
+		cachedData = cache.load(key)
+		if cachedData is not None:
+			return cachedData[0], cachedData[1], len(cachedData[0]) // 2
+
+	paletteData, textureData, colorCount = \
+		encodePaletteTexture(pixels, palFormat, bitSize, name)
+	if cache is not None:
+		cache.store(key, paletteData, textureData)
+	return paletteData, textureData, colorCount
@@ -0,0 +1,138 @@
+import numpy as np
+
+from .utility import *
+
+# Vectorized versions of the per texel conversions done by the texture
+# exporter. Every function here produces the same bytes as converting the
+# image one pixel at a time with getRGBA16Tuple / getIA16Tuple etc.
+
+# Returns a (height, width, 4) float64 array of the image pixels.
+# Rows are flipped, since N64 is -Y and Blender is +Y.
+# Missing channels are filled with 1, like the [1,1,1,1] default color.
+def getImagePixels(image):
+	width, height = image.size[0], image.size[1]
+	channels = image.channels
+	if hasattr(image.pixels, 'foreach_get'):
+		data = np.empty(width * height * channels, dtype = np.float32)
+		image.pixels.foreach_get(data)
+	else:
+		# pixels[:] materializes the whole buffer with a single access.
+		data = np.array(image.pixels[:], dtype = np.float32)
+
+	# Conversion to float64 is exact, and matches the Python float math.
+	data = data.astype(np.float64).reshape((height, width, channels))[::-1]
+	pixels = np.ones((height, width, 4), dtype = np.float64)
+	pixels[:, :, :min(channels, 4)] = data[:, :, :4]
+	return pixels
+
+# Same as mathutils.Color(color[0:3]).v
+def getIntensity(pixels):
+	return pixels[..., 0:3].max(axis = -1)
+
+# Same as int(), which truncates towards zero.
+def truncate(values):
+	return np.trunc(values).astype(np.int64)
+
+def toByteArray(values, name):
+	if values.size > 0 and (values.min() < 0 or values.max() > 0xFF):
+		raise PluginError("Texture " + name + " has pixel values outside of the 0-1 range.")
+	return bytearray(values.astype(np.uint8).tobytes())
+
+def toShortArray(values, name):
+	if values.size > 0 and (values.min() < 0 or values.max() > 0xFFFF):
+		raise PluginError("Texture " + name + " has pixel values outside of the 0-1 range.")
+	return bytearray(values.astype('>u2').tobytes())
+
+def getRGBA16Array(pixels):
+	return ((truncate(pixels[..., 0] * 0x1F) & 0x1F) << 11) | \
+		((truncate(pixels[..., 1] * 0x1F) & 0x1F) << 6) | \
+		((truncate(pixels[..., 2] * 0x1F) & 0x1F) << 1) | \
+		(pixels[..., 3] > 0.5).astype(np.int64)
+
+def getIA16Array(pixels):
+	return (truncate(getIntensity(pixels) * 0xFF) << 8) | \
+		truncate(pixels[..., 3] * 0xFF)
+
+# Packs an array of 4 bit values into bytes, high nibble first.
+def compactNibbleArray(texture, width, height):
+	values = np.asarray(texture, dtype = np.int64).reshape(-1)[:width * height] & 0xF
+	if values.size % 2 == 1:
+		values = np.append(values, 0)
+	return bytearray(((values[0::2] << 4) | values[1::2]).astype(np.uint8).tobytes())
+
+def encodeTexture(pixels, fmt, bitSize, name):
+	height, width = pixels.shape[0], pixels.shape[1]
+	if fmt == 'G_IM_FMT_RGBA':
+		if bitSize == 'G_IM_SIZ_16b':
+			return toShortArray(getRGBA16Array(pixels), name)
+		elif bitSize == 'G_IM_SIZ_32b':
+			return toByteArray(truncate(pixels * 0xFF) & 0xFF, name)
+		else:
+			raise PluginError("Invalid combo: " + fmt + ', ' + bitSize)
+
+	elif fmt == 'G_IM_FMT_YUV':
+		raise PluginError("YUV not yet implemented.")
+
+	elif fmt == 'G_IM_FMT_CI':
+		raise PluginError("CI not yet implemented.")
+
+	elif fmt == 'G_IM_FMT_IA':
+		intensity = getIntensity(pixels)
+		alpha = pixels[..., 3]
+		if bitSize == 'G_IM_SIZ_4b':
+			return compactNibbleArray(
+				((truncate(intensity * 0x7) & 0x7) << 1) | \
+				(alpha > 0.5).astype(np.int64), width, height)
+		elif bitSize == 'G_IM_SIZ_8b':
+			return toByteArray(
+				((truncate(intensity * 0xF) & 0xF) << 4) | \
+				(truncate(alpha * 0xF) & 0xF), name)
+		elif bitSize == 'G_IM_SIZ_16b':
+			return toByteArray(np.stack((truncate(intensity * 0xFF),
+				truncate(alpha * 0xFF)), axis = -1), name)
+		else:
+			raise PluginError("Invalid combo: " + fmt + ', ' + bitSize)
+
+	elif fmt == 'G_IM_FMT_I':
+		intensity = getIntensity(pixels)
+		if bitSize == 'G_IM_SIZ_4b':
+			values = truncate(intensity * 0xF)
+			# Checked as bytes before the nibbles are masked.
+			toByteArray(values, name)
+			return compactNibbleArray(values, width, height)
+		elif bitSize == 'G_IM_SIZ_8b':
+			return toByteArray(truncate(intensity * 0xFF), name)
+		else:
+			raise PluginError("Invalid combo: " + fmt + ', ' + bitSize)
+	else:
+		raise PluginError("Invalid image format " + fmt)
+
+# Returns (palette data, texture data, palette color count).
+# Palette colors are ordered by their first occurrence in the texture.
+def encodePaletteTexture(pixels, palFormat, bitSize, name):
+	height, width = pixels.shape[0], pixels.shape[1]
+	if palFormat == 'G_IM_FMT_RGBA':
+		pixelColors = getRGBA16Array(pixels).reshape(-1)
+	elif palFormat == 'G_IM_FMT_IA':
+		pixelColors = getIA16Array(pixels).reshape(-1)
+	else:
+		raise PluginError("Invalid combo: " + palFormat + ', ' + bitSize)
+
+	maxColors = 16 if bitSize == 'G_IM_SIZ_4b' else 256
+	colors, firstIndices, inverse = np.unique(pixelColors,
+		return_index = True, return_inverse = True)
+	if len(colors) > maxColors:
+		raise PluginError('Texture ' + name + ' has more than ' + \
+			str(maxColors) + ' colors.')
+
+	order = np.argsort(firstIndices, kind = 'stable')
+	colorIndex = np.empty(len(colors), dtype = np.int64)
+	colorIndex[order] = np.arange(len(colors))
+	texture = colorIndex[inverse.reshape(-1)]
+
+	paletteData = toShortArray(colors[order], name)
+	if bitSize == 'G_IM_SIZ_4b':
+		textureData = compactNibbleArray(texture, width, height)
+	else:
+		textureData = bytearray(texture.astype(np.uint8).tobytes())
+	return paletteData, textureData, len(colors)
@@ -3,15 +3,21 @@ import bmesh
 import mathutils
 from math import pi
 from io import BytesIO
-import os, re
+import os, re, io
 
 import copy
+import heapq
 from math import pi, ceil
 from .utility import *
 from .sm64_constants import *
 from .f3d_material import all_combiner_uses, getMaterialScrollDimensions, getTmemWordUsage, bitSizeDict, texBitSizeOf, texFormatOf
 from .f3d_gbi import *
 from .f3d_gbi import _DPLoadTextureBlock
+from .f3d_mesh_data import *
+from .f3d_texture_encoder import *
+from .f3d_texture_cache import *
+from .f3d_gfx_optimizer import *
+from .f3d_texture_atlas import *
 from .sm64_texscroll import *
 
 def getEdgeToFaceDict(mesh):
@@ -34,27 +40,18 @@ def getVertToFaceDict(mesh):
 				vertDict[vertIndex].append(face)
 	return vertDict
 
-def getLoopFromVert(inputIndex, face):
-	for i in range(len(face.vertices)):
-		if face.vertices[i] == inputIndex:
-			return face.loops[i]
-
 def getInfoDict(obj):
 	if len(obj.data.materials) == 0:
 		raise PluginError("Mesh does not have any Fast3D materials.")
 	infoDict = {
 		'vert' : {}, # all faces connected to a vert
 		'edge' : {}, # all faces connected to an edge
-		'f3dVert' : {}, # f3d vertex of a given loop
+		'f3dVert' : {}, # f3d vertex ID of a given loop
 		'edgeValid' : {}, # bool given two faces
 		'validNeighbors' : {}, # all neighbors of a face with a valid connecting edge
 		'texDimensions' : {}, # texture dimensions for each material
+		'meshData' : None, # F3DMeshData, bulk per loop vertex data
 	}
-	vertDict = infoDict['vert']
-	edgeDict = infoDict['edge']
-	f3dVertDict = infoDict['f3dVert']
-	edgeValidDict = infoDict['edgeValid']
-	validNeighborDict = infoDict['validNeighbors']
 	#texSizeDict = infoDict['texDimensions']
 
 	#for material in obj.data.materials:
@@ -70,45 +67,25 @@ def getInfoDict(obj):
 				uv_data = uv_layer.data
 		if uv_data is None:
 			raise PluginError("Object \'" + obj.name + "\' does not have a UV layer named \'UVMap.\'")
-	for face in mesh.loop_triangles:
-		validNeighborDict[face] = []
-		material = mesh.materials[face.material_index] 
-		if material is None:
+
+	faces = list(mesh.loop_triangles)
+	triMaterials = np.empty(len(faces), dtype = np.int32)
+	mesh.loop_triangles.foreach_get('material_index', triMaterials)
+	for materialIndex in np.unique(triMaterials).tolist():
+		if mesh.materials[materialIndex] is None:
 			raise PluginError("There are some faces on your mesh that are assigned to an empty material slot.")
-		for vertIndex in face.vertices:
-			if vertIndex not in vertDict:
-				vertDict[vertIndex] = []
-			if face not in vertDict[vertIndex]:
-				vertDict[vertIndex].append(face)
-		for edgeKey in face.edge_keys:
-			if edgeKey not in edgeDict:
-				edgeDict[edgeKey] = []
-			if face not in edgeDict[edgeKey]:
-				edgeDict[edgeKey].append(face)
 
-		# modify UVs here
-		#fixLargeUVs(texSizeDict[material], face, uv_data)
+	# modify UVs here
+	#for face in faces:
+	#	fixLargeUVs(texSizeDict[material], face, uv_data)
 
-		for loopIndex in face.loops:
-			convertInfo = LoopConvertInfo(uv_data, obj, 
-				isLightingDisabled(mesh.materials[face.material_index]))
-			f3dVertDict[loopIndex] = getF3DVert(mesh.loops[loopIndex], face, convertInfo, mesh)
-	for face in mesh.loop_triangles:	
-		for edgeKey in face.edge_keys:
-			for otherFace in edgeDict[edgeKey]:
-				if otherFace == face:
-					continue
-				if (otherFace, face) not in edgeValidDict and \
-					(face, otherFace) not in edgeValidDict:
-					edgeValid = \
-						f3dVertDict[getLoopFromVert(edgeKey[0], face)] == \
-						f3dVertDict[getLoopFromVert(edgeKey[0], otherFace)] and \
-						f3dVertDict[getLoopFromVert(edgeKey[1], face)] == \
-						f3dVertDict[getLoopFromVert(edgeKey[1], otherFace)]
-					edgeValidDict[(otherFace, face)] = edgeValid
-					if edgeValid:
-						validNeighborDict[face].append(otherFace)
-						validNeighborDict[otherFace].append(face)
+	meshData = F3DMeshData(mesh, uv_data, [material is not None and \
+		isLightingDisabled(material) for material in mesh.materials])
+	infoDict['meshData'] = meshData
+	infoDict['f3dVert'] = meshData.loopVertIDs
+
+	infoDict['vert'], infoDict['edge'], infoDict['edgeValid'], \
+		infoDict['validNeighbors'] = getMeshAdjacency(mesh, faces, meshData.loopVertIDs)
 	return infoDict
 
 def fixLargeUVs(size, face, uv_data):
@@ -173,6 +150,8 @@ def saveStaticModel(fModel, obj, transformMatrix, name, DLFormat, convertTexture
 	
 	#checkForF3DMaterial(obj)
 
+	atlases = applyTextureAtlases(obj, toAlnum(obj.original_name)) \
+		if bpy.context.scene.useTextureAtlas else {}
 	obj.data.calc_loop_triangles()
 	obj.data.calc_normals_split()
 	infoDict = getInfoDict(obj)
@@ -190,12 +169,14 @@ def saveStaticModel(fModel, obj, transformMatrix, name, DLFormat, convertTexture
 			facesByMat[face.material_index] = []
 		facesByMat[face.material_index].append(face)
 
-	for material_index, faces in facesByMat.items():
+	for material_index, faces in getStateOrderedFaceGroups(facesByMat, 
+		fModel, obj, int(obj.draw_layer_static), convertTextureData, atlases):
 		material = obj.data.materials[material_index]
 		checkForF3dMaterialInFaces(obj, material)
 		saveMeshByFaces(material, faces, 
 			fModel, fMeshGroup.mesh, obj, transformMatrix, 
-			infoDict, int(obj.draw_layer_static), convertTextureData)
+			infoDict, int(obj.draw_layer_static), convertTextureData,
+			atlases.get(material_index))
 	
 	if revertMatAtEnd:
 		revertMatAndEndDraw(fMeshGroup.mesh.draw, [])
@@ -203,15 +184,53 @@ def saveStaticModel(fModel, obj, transformMatrix, name, DLFormat, convertTexture
 		fMeshGroup.mesh.draw.commands.append(SPEndDisplayList())
 	return fMeshGroup
 
+# True if the material draws the same regardless of the order of triangles,
+# i.e. it uses an opaque, depth tested and depth updating render mode.
+def isDrawOrderIndependent(material, drawLayer):
+	settings = material.rdp_settings
+	if not settings.g_zbuffer:
+		return False
+	world = bpy.context.scene.world
+	renderModes = [getattr(world, 'draw_layer_' + str(drawLayer) + '_cycle_1'),
+		getattr(world, 'draw_layer_' + str(drawLayer) + '_cycle_2')]
+	if settings.set_rendermode:
+		if settings.rendermode_advanced_enabled:
+			return False
+		presets = [settings.rendermode_preset_cycle_1, settings.rendermode_preset_cycle_2]
+		renderModes = [renderModes[i] if presets[i] == 'Use Draw Layer' else presets[i] \
+			for i in range(2)]
+	renderMode = renderModes[1] if settings.g_mdsft_cycletype == 'G_CYC_2CYCLE' else renderModes[0]
+	return '_ZB_' in renderMode and \
+		any([name in renderMode for name in ['OPA_SURF', 'OPA_INTER', 'TEX_EDGE']])
+
+# Returns the (material index, faces) items of facesByMat, ordered so that
+# consecutive materials share as much state as possible.
+# The order only matters when materials are inlined by the display list optimizer.
+def getStateOrderedFaceGroups(facesByMat, fModel, obj, drawLayer, convertTextureData, atlases = None):
+	faceGroups = list(facesByMat.items())
+	if not bpy.context.scene.optimizeDisplayLists or \
+		bpy.context.scene.displayListInlineSize == 0 or \
+		fModel.DLFormat != 'Static' or len(faceGroups) < 2:
+		return faceGroups
+
+	fMaterials = []
+	for material_index, faces in faceGroups:
+		material = obj.data.materials[material_index]
+		checkForF3dMaterialInFaces(obj, material)
+		if not isDrawOrderIndependent(material, drawLayer):
+			return faceGroups
+		fMaterial, texDimensions = saveOrGetF3DMaterial(material, fModel, obj, drawLayer,
+			convertTextureData, None if atlases is None else atlases.get(material_index))
+		fMaterials.append(fMaterial)
+	return [faceGroups[i] for i in getMaterialStateOrder(fMaterials, fModel.f3d)]
+
 def addCullCommand(obj, fMesh, transformMatrix):
 	fMesh.add_cull_vtx()
-	for vertexPos in obj.bound_box:
-		# Most other fields of convertVertexData are unnecessary for bounding box verts
-		fMesh.cullVertexList.vertices.append(
-			convertVertexData(obj.data, 
-				mathutils.Vector(vertexPos), [0,0], 
-				mathutils.Vector([0,0,0,0]), [32, 32],
-				transformMatrix, False, False))
+	# Most other fields of convertVertexArrays are unnecessary for bounding box verts
+	vertData = np.zeros((len(obj.bound_box), 10))
+	vertData[:, 0:3] = [vertexPos[0:3] for vertexPos in obj.bound_box]
+	fMesh.cullVertexList.vertices.extend(convertVertexArrays(vertData, [32, 32],
+		getVertexTransforms(transformMatrix), False, False))
 
 
 	defaults = bpy.context.scene.world.rdp_defaults
@@ -398,6 +417,7 @@ def exportF3DCommon(obj, f3dType, isHWv1, transformMatrix, includeChildren, name
 		bpy.context.view_layer.objects.active = obj
 		raise Exception(str(e))
 
+	optimizeModelDrawLists(fModel)
 	return fModel, fMeshGroup
 
 def exportF3DtoC(basePath, obj, DLFormat, transformMatrix, 
@@ -419,14 +439,26 @@ def exportF3DtoC(basePath, obj, DLFormat, transformMatrix,
 	elif headerType == 'Level':
 		scrollName = levelName + '_level_dl_' + name
 
-	static_data, dynamic_data, texC, scroll_data = fModel.to_c(texSeparate, savePNG, texDir, scrollName)
 	cDefineStatic, cDefineDynamic, cDefineScroll, hasScrolling = fModel.to_c_def(scrollName)
 
-	
+	# Static data is streamed straight to model.inc.c
+	modelPath = os.path.join(modelDirPath, 'model.inc.c')
+	outFile = open(modelPath, 'w', newline='\n')
+	texCFile = open(os.path.join(modelDirPath, 'texture.inc.c'), 'w', newline='\n') if texSeparate else None
+	dynamicOut = io.StringIO()
+	try:
+		scroll_data = fModel.write_c(outFile, dynamicOut, texCFile, savePNG, texDir, scrollName)
+		dynamic_data = dynamicOut.getvalue()
+		if DLFormat == "Static":
+			outFile.write('\n' + dynamic_data)
+	finally:
+		outFile.close()
+		if texCFile is not None:
+			texCFile.close()
+
 	modifyTexScrollFiles(basePath, modelDirPath, cDefineScroll, scroll_data, hasScrolling)
 	
 	if DLFormat == "Static":
-		static_data += '\n' + dynamic_data
 		cDefineStatic += cDefineDynamic
 	else:
 		geoString = writeMaterialFiles(basePath, modelDirPath, 
@@ -438,16 +470,6 @@ def exportF3DtoC(basePath, obj, DLFormat, transformMatrix,
 		fModel.save_textures(modelDirPath)
 
 	fModel.freePalettes()
-
-	if texSeparate:
-		texCFile = open(os.path.join(modelDirPath, 'texture.inc.c'), 'w', newline='\n')
-		texCFile.write(texC)
-		texCFile.close()
-
-	modelPath = os.path.join(modelDirPath, 'model.inc.c')
-	outFile = open(modelPath, 'w', newline='\n')
-	outFile.write(static_data)
-	outFile.close()
 		
 	headerPath = os.path.join(modelDirPath, 'header.h')
 	cDefFile = open(headerPath, 'w', newline='\n')
@@ -612,89 +634,174 @@ def edgeValid(edgeValidDict, face, otherFace):
 	else:
 		return edgeValidDict[(otherFace, face)]
 
-def getLowestUnvisitedNeighborCountFace(unvisitedFaces, infoDict):
-	lowestNeighborFace = unvisitedFaces[0]
-	lowestNeighborCount = len(infoDict['validNeighbors'][lowestNeighborFace])
-	for face in unvisitedFaces:
-		neighborCount = len(infoDict['validNeighbors'][face])
-		if neighborCount < lowestNeighborCount:
-			lowestNeighborFace = face
-			lowestNeighborCount = neighborCount
-	return lowestNeighborFace
-
-def getNextNeighborFace(faces, face, lastEdgeKey, visitedFaces, possibleFaces,
+# Returns the unvisited face with the fewest unvisited valid neighbors,
+# the earliest one in the face list on ties.
+# The heap holds (neighbor count, face list index), and gets a new entry
+# whenever a count goes down, so outdated entries are skipped here.
+def popLowestNeighborCountFace(neighborCountHeap, faces, visitedFaces, validNeighborDict):
+	while True:
+		neighborCount, faceIndex = heapq.heappop(neighborCountHeap)
+		face = faces[faceIndex]
+		if face not in visitedFaces and neighborCount == len(validNeighborDict[face]):
+			return face
+
+# possibleFaces is a stack, the last unvisited face in it is the most recently queued one.
+def popPossibleFace(possibleFaces, visitedFaces):
+	while len(possibleFaces) > 0:
+		face = possibleFaces.pop()
+		if face not in visitedFaces:
+			return face
+	return None
+
+def getNextNeighborFace(faceSet, face, lastEdgeKey, visitedFaces, possibleFaces,
 	infoDict):
 	
+	edgeKeys = face.edge_keys
 	if lastEdgeKey is not None:
 		handledEdgeKeys = [lastEdgeKey]
-		nextEdgeKey = face.edge_keys[
-			(face.edge_keys.index(lastEdgeKey) + 1) % 3]
+		nextEdgeKey = edgeKeys[(edgeKeys.index(lastEdgeKey) + 1) % 3]
 	else:
 		handledEdgeKeys = []
-		nextEdgeKey = face.edge_keys[0]
+		nextEdgeKey = edgeKeys[0]
 
+	edgeDict = infoDict['edge']
+	edgeValidDict = infoDict['edgeValid']
 	nextFaceAndEdge = (None, None)
 	while nextEdgeKey not in handledEdgeKeys:
-		for linkedFace in infoDict['edge'][nextEdgeKey]:
-			if linkedFace == face or linkedFace not in faces:
+		for linkedFace in edgeDict[nextEdgeKey]:
+			if linkedFace == face or linkedFace not in faceSet:
 				continue
-			elif edgeValid(infoDict['edgeValid'], linkedFace, face) and \
-				linkedFace not in visitedFaces:
+			elif linkedFace not in visitedFaces and \
+				edgeValid(edgeValidDict, linkedFace, face):
 				if nextFaceAndEdge[0] is None:
-					#print(nextLoop.face)
 					nextFaceAndEdge = (linkedFace, nextEdgeKey)
 				else:
 					# Move face to front of queue
-					if linkedFace in possibleFaces:
-						possibleFaces.remove(linkedFace)
-					possibleFaces.insert(0, linkedFace)
+					possibleFaces.append(linkedFace)
 		handledEdgeKeys.append(nextEdgeKey)
-		nextEdgeKey = face.edge_keys[
-			(face.edge_keys.index(nextEdgeKey) + 1) % 3]
+		nextEdgeKey = edgeKeys[(edgeKeys.index(nextEdgeKey) + 1) % 3]
 	return nextFaceAndEdge
 
-def saveTriangleStrip(faces, convertInfo, triList, vtxList, f3d, 
+def saveTriangleStrip(faces, triList, vtxList, f3d, 
 	texDimensions, transformMatrix, isPointSampled, exportVertexColors,
 	existingVertexData, existingVertexMaterialRegions, infoDict, mesh):
-	visitedFaces = []
-	unvisitedFaces = copy.copy(faces)
+	faceSet = set(faces)
+	if len(faceSet) != len(faces):
+		raise PluginError("Repeated face")
+	faceIndices = {face : i for i, face in enumerate(faces)}
+	validNeighborDict = infoDict['validNeighbors']
+	neighborCountHeap = [(len(validNeighborDict[face]), i) for i, face in enumerate(faces)]
+	heapq.heapify(neighborCountHeap)
+
+	visitedFaces = set()
 	possibleFaces = []
 	lastEdgeKey = None
-	neighborFace = getLowestUnvisitedNeighborCountFace(unvisitedFaces, infoDict)
+	neighborFace = popLowestNeighborCountFace(neighborCountHeap, faces, 
+		visitedFaces, validNeighborDict)
 
-	triConverter = TriangleConverter(mesh, convertInfo, triList, vtxList, f3d, 
-		texDimensions, transformMatrix, isPointSampled, exportVertexColors,
-		existingVertexData, existingVertexMaterialRegions)
+	triConverter = TriangleConverter(mesh, infoDict['meshData'],
+		triList, vtxList, f3d, texDimensions, transformMatrix, isPointSampled,
+		exportVertexColors, existingVertexData, existingVertexMaterialRegions)
 
+	stripFaces = []
 	while len(visitedFaces) < len(faces):
-		#print(str(len(visitedFaces)) + " " + str(len(bFaces)))
 		if neighborFace is None:
-			if len(possibleFaces) > 0:
-				#print("get neighbor from queue")
-				neighborFace = possibleFaces[0]
-				lastEdgeKey = None
-				possibleFaces = []
-			else:
-				#print('get new neighbor')
-				neighborFace =  getLowestUnvisitedNeighborCountFace(
-					unvisitedFaces, infoDict)
-				lastEdgeKey = None
+			neighborFace = popPossibleFace(possibleFaces, visitedFaces)
+			possibleFaces = []
+			if neighborFace is None:
+				neighborFace = popLowestNeighborCountFace(neighborCountHeap, faces, 
+					visitedFaces, validNeighborDict)
+			lastEdgeKey = None
 		
-		triConverter.addFace(neighborFace)
+		stripFaces.append(neighborFace)
 		if neighborFace in visitedFaces:
 			raise PluginError("Repeated face")
-		visitedFaces.append(neighborFace)
-		unvisitedFaces.remove(neighborFace)
-		if neighborFace in possibleFaces:
-			possibleFaces.remove(neighborFace)
-		for otherFace in infoDict['validNeighbors'][neighborFace]:
-			infoDict['validNeighbors'][otherFace].remove(neighborFace)
-
-		neighborFace, lastEdgeKey = getNextNeighborFace(faces, 
+		visitedFaces.add(neighborFace)
+		for otherFace in validNeighborDict[neighborFace]:
+			otherNeighbors = validNeighborDict[otherFace]
+			otherNeighbors.remove(neighborFace)
+			if otherFace in faceIndices and otherFace not in visitedFaces:
+				heapq.heappush(neighborCountHeap, (len(otherNeighbors), faceIndices[otherFace]))
+
+		neighborFace, lastEdgeKey = getNextNeighborFace(faceSet, 
 			neighborFace, lastEdgeKey, visitedFaces, possibleFaces, infoDict)
-	
+
+	# Only used if it actually needs fewer loads than the strip order.
+	if bpy.context.scene.optimizeVertexLoads:
+		optimizedFaces = getVertexLoadOptimizedFaces(stripFaces, triConverter)
+		if triConverter.getVertexLoadCost(optimizedFaces) < \
+			triConverter.getVertexLoadCost(stripFaces):
+			stripFaces = optimizedFaces
+
+	for face in stripFaces:
+		triConverter.addFace(face)
 	triConverter.finish()
 
+# Reorders faces to reduce vertex loads, which the strip walk doesn't account for.
+# Similar to a vertex cache optimizer, except that the vertex buffer is only 
+# ever flushed as a whole. The face needing the fewest vertices not already in 
+# the buffer is added next, preferring faces whose vertices have the fewest 
+# other faces left, so that vertices are finished before the buffer is flushed.
+def getVertexLoadOptimizedFaces(faces, triConverter):
+	faceVerts = [triConverter.getFaceVerts(face) for face in faces]
+	vertFaces = {} # f3dVert : face indices
+	for faceIndex in range(len(faces)):
+		for f3dVert in set(faceVerts[faceIndex]):
+			if f3dVert not in vertFaces:
+				vertFaces[f3dVert] = []
+			vertFaces[f3dVert].append(faceIndex)
+	remainingFaceCounts = {f3dVert : len(faceIndices) for f3dVert, faceIndices in vertFaces.items()}
+
+	visited = [False] * len(faces)
+	orderedFaces = []
+	loadSize = triConverter.f3d.vert_load_size
+	bufferSize = len(triConverter.vertBuffer)
+	liveVerts = set(triConverter.liveVertIndices)
+	candidates = set() # unvisited faces using a vertex in the buffer
+	for f3dVert in liveVerts:
+		candidates.update(vertFaces.get(f3dVert, []))
+	nextUnvisited = 0
+
+	while len(orderedFaces) < len(faces):
+		faceIndex = None
+		bestKey = None
+		for candidate in candidates:
+			addedVerts, allVerts = triConverter.getFaceLoadVerts(
+				faceVerts[candidate], faces[candidate].material_index, liveVerts)
+			key = (len(addedVerts), sum([remainingFaceCounts[f3dVert] \
+				for f3dVert in faceVerts[candidate]]), candidate)
+			if bestKey is None or key < bestKey:
+				faceIndex = candidate
+				bestKey = key
+
+		# Start the next load from the face list order, which begins at corners.
+		if faceIndex is None:
+			while visited[nextUnvisited]:
+				nextUnvisited += 1
+			faceIndex = nextUnvisited
+
+		addedVerts, allVerts = triConverter.getFaceLoadVerts(
+			faceVerts[faceIndex], faces[faceIndex].material_index, liveVerts)
+		if bufferSize + len(addedVerts) > loadSize:
+			bufferSize = triConverter.bufferStart + len(allVerts)
+			liveVerts = set(allVerts)
+			candidates = set()
+			addedVerts = liveVerts
+		else:
+			bufferSize += len(addedVerts)
+			liveVerts.update(addedVerts)
+
+		visited[faceIndex] = True
+		orderedFaces.append(faces[faceIndex])
+		for f3dVert in set(faceVerts[faceIndex]):
+			remainingFaceCounts[f3dVert] -= 1
+		for f3dVert in addedVerts:
+			candidates.update([otherIndex for otherIndex in vertFaces[f3dVert] \
+				if not visited[otherIndex]])
+		candidates.discard(faceIndex)
+
+	return orderedFaces
+
 # Necessary for UV half pixel offset (see 13.7.5.3)
 def isTexturePointSampled(material):
 	return material.rdp_settings.g_mdsft_text_filt == 'G_TF_POINT'
@@ -702,21 +809,15 @@ def isTexturePointSampled(material):
 def isLightingDisabled(material):
 	return not material.rdp_settings.g_lighting
 
-# Necessary as G_SHADE_SMOOTH actually does nothing
-def checkIfFlatShaded(material):
-	return not material.rdp_settings.g_shade_smooth
-
 def saveMeshByFaces(material, faces, fModel, fMesh, obj, transformMatrix,
-	infoDict, drawLayer, convertTextureData):
+	infoDict, drawLayer, convertTextureData, atlas = None):
 	if len(faces) == 0:
 		print('0 Faces Provided.')
 		return
 	fMaterial, texDimensions = \
-		saveOrGetF3DMaterial(material, fModel, obj, drawLayer, convertTextureData)
+		saveOrGetF3DMaterial(material, fModel, obj, drawLayer, convertTextureData, atlas)
 	isPointSampled = isTexturePointSampled(material)
 	exportVertexColors = isLightingDisabled(material)
-	uv_data = obj.data.uv_layers['UVMap'].data
-	convertInfo = LoopConvertInfo(uv_data, obj, exportVertexColors)
 
 	fMesh.draw.commands.append(SPDisplayList(fMaterial.material))
 	triGroup = fMesh.tri_group_new(fMaterial)
@@ -725,36 +826,13 @@ def saveMeshByFaces(material, faces, fModel, fMesh, obj, transformMatrix,
 	#saveGeometry(obj, triList, fMesh.vertexList, bFaces, 
 	#	bMesh, texDimensions, transformMatrix, isPointSampled, isFlatShaded,
 	#	exportVertexColors, fModel.f3d)
-	saveTriangleStrip(faces, convertInfo, triGroup.triList, triGroup.vertexList,
+	saveTriangleStrip(faces, triGroup.triList, triGroup.vertexList,
 		fModel.f3d, texDimensions, transformMatrix, isPointSampled,
 		exportVertexColors, None, None, infoDict, obj.data)
 	
 	if fMaterial.revert is not None:
 		fMesh.draw.commands.append(SPDisplayList(fMaterial.revert))
 
-def get8bitRoundedNormal(loop, mesh):
-	alpha_layer = mesh.vertex_colors['Alpha'].data if 'Alpha' in \
-		mesh.vertex_colors else None
-	
-	if alpha_layer is not None:
-		normalizedAColor = alpha_layer[loop.index].color
-		normalizedA = mathutils.Color(normalizedAColor[0:3]).v
-	else:
-		normalizedA = 1
-	
-	return mathutils.Vector(
-		(round(loop.normal[0] * 128) / 128,
-		round(loop.normal[1] * 128) / 128,
-		round(loop.normal[2] * 128) / 128,
-		normalizedA)
-	)
-
-class LoopConvertInfo:
-	def __init__(self, uv_data, obj, exportVertexColors):
-		self.uv_data = uv_data
-		self.obj = obj
-		self.exportVertexColors = exportVertexColors
-
 def getNewIndices(existingIndices, bufferStart):
 	n = bufferStart
 	newIndices = []
@@ -767,15 +845,15 @@ def getNewIndices(existingIndices, bufferStart):
 	return newIndices
 
 class TriangleConverter:
-	def __init__(self, mesh, convertInfo, triList, vtxList, f3d, 
+	def __init__(self, mesh, meshData, triList, vtxList, f3d, 
 		texDimensions, transformMatrix, isPointSampled, exportVertexColors,
 		existingVertexData, existingVertexMaterialRegions):
-		self.convertInfo = convertInfo
 		self.mesh = mesh
+		self.meshData = meshData
 
 		# Existing data assumed to be already loaded in.
 		if existingVertexData is not None:
-			# [(position, uv, colorOrNormal)]
+			# [f3d vertex ID], see F3DMeshData
 			self.vertBuffer = existingVertexData 
 		else:
 			self.vertBuffer = []
@@ -788,25 +866,74 @@ class TriangleConverter:
 
 		self.texDimensions = texDimensions
 		self.transformMatrix = transformMatrix
+		self.vertexTransforms = getVertexTransforms(transformMatrix)
 		self.isPointSampled = isPointSampled
 		self.exportVertexColors = exportVertexColors
 
+		# f3dVert -> first buffer index, used instead of scanning vertBuffer.
+		# The pre-loaded region never changes, so its indices are built once.
+		# The live region (bufferStart onwards) is rebuilt on every flush.
+		self.preloadedVertIndices = getFirstIndexDict(self.vertBuffer, 0, self.bufferStart)
+		self.regionVertIndices = {}
+		if existingVertexMaterialRegions is not None:
+			for material_index, matRegion in existingVertexMaterialRegions.items():
+				self.regionVertIndices[material_index] = \
+					getFirstIndexDict(self.vertBuffer, matRegion[0], matRegion[1])
+		self.liveVertIndices = {}
+
 	def vertInBuffer(self, f3dVert, material_index):
 		if self.existingVertexMaterialRegions is None:
-			if f3dVert in self.vertBuffer:
-				return self.vertBuffer.index(f3dVert)
-			else:
-				return None
+			# Pre-loaded indices are always lower than live indices.
+			if f3dVert in self.preloadedVertIndices:
+				return self.preloadedVertIndices[f3dVert]
+			return self.liveVertIndices.get(f3dVert)
+		else:
+			if material_index in self.regionVertIndices:
+				regionIndices = self.regionVertIndices[material_index]
+				if f3dVert in regionIndices:
+					return regionIndices[f3dVert]
+			return self.liveVertIndices.get(f3dVert)
+
+	def vertPreloaded(self, f3dVert, material_index):
+		if self.existingVertexMaterialRegions is None:
+			return f3dVert in self.preloadedVertIndices
 		else:
-			if material_index in self.existingVertexMaterialRegions:
-				matRegion = self.existingVertexMaterialRegions[material_index]
-				for i in range(matRegion[0], matRegion[1]):
-					if self.vertBuffer[i] == f3dVert:
-						return i
-			for i in range(self.bufferStart, len(self.vertBuffer)): 
-				if self.vertBuffer[i] == f3dVert:
-					return i
-			return None
+			return material_index in self.regionVertIndices and \
+				f3dVert in self.regionVertIndices[material_index]
+
+	def getFaceVerts(self, face):
+		return [self.meshData.getLoopVertID(loopIndex) for loopIndex in face.loops]
+
+	# Returns (verts added to the buffer, verts in the buffer after a flush) 
+	# for a face, the same as addFace given the live verts of the buffer.
+	def getFaceLoadVerts(self, faceVerts, material_index, liveVerts):
+		addedVerts = [f3dVert for f3dVert in faceVerts if f3dVert not in liveVerts and \
+			not self.vertPreloaded(f3dVert, material_index)]
+		allVerts = [f3dVert for f3dVert in faceVerts if f3dVert not in self.preloadedVertIndices]
+		return addedVerts, allVerts
+
+	# Returns (vertex load count, loaded vertex count) for adding faces in
+	# this order, without adding them.
+	def getVertexLoadCost(self, faces):
+		bufferSize = len(self.vertBuffer)
+		liveVerts = set(self.liveVertIndices)
+		loadCount = 0
+		loadedVertCount = 0
+		for face in faces:
+			addedVerts, allVerts = self.getFaceLoadVerts(
+				self.getFaceVerts(face), face.material_index, liveVerts)
+			if bufferSize + len(addedVerts) > self.f3d.vert_load_size:
+				loadCount += 1
+				loadedVertCount += bufferSize - self.bufferStart
+				bufferSize = self.bufferStart + len(allVerts)
+				liveVerts = set(allVerts)
+			else:
+				bufferSize += len(addedVerts)
+				liveVerts.update(addedVerts)
+		if len(faces) > 0:
+			loadCount += 1
+			loadedVertCount += bufferSize - self.bufferStart
+		return loadCount, loadedVertCount
 
 	def addFace(self, face):
 		triIndices = []
@@ -815,8 +942,7 @@ class TriangleConverter:
 		allVerts = [] # all verts not in 'untouched' buffer region
 
 		for loopIndex in face.loops:
-			loop = self.mesh.loops[loopIndex]
-			f3dVert = getF3DVert(loop, face, self.convertInfo, self.mesh)
+			f3dVert = self.meshData.getLoopVertID(loopIndex)
 			vertIndex = self.vertInBuffer(f3dVert, face.material_index)
 			if vertIndex is not None:
 				triIndices.append(vertIndex)			
@@ -824,8 +950,8 @@ class TriangleConverter:
 				addedVerts.append(f3dVert)
 				triIndices.append(len(self.vertBuffer) + len(addedVerts) - 1)
 
-			if f3dVert in self.vertBuffer[:self.bufferStart]:
-				existingVertIndices.append(self.vertBuffer.index(f3dVert))
+			if f3dVert in self.preloadedVertIndices:
+				existingVertIndices.append(self.preloadedVertIndices[f3dVert])
 			else:
 				allVerts.append(f3dVert)
 				existingVertIndices.append(None)
@@ -838,18 +964,24 @@ class TriangleConverter:
 				len(self.vertBuffer) - self.bufferStart, self.bufferStart))
 			self.triList.commands.extend(createTriangleCommands(
 				self.vertexBufferTriangles, self.f3d.F3DEX_GBI))
-			for vertData in self.vertBuffer[self.bufferStart:]:
-				self.vtxList.vertices.append(convertVertexData(self.convertInfo.obj.data, 
-					vertData[0], vertData[1], vertData[2], self.texDimensions,
-					self.transformMatrix, self.isPointSampled,
-					self.exportVertexColors))
+			self.saveBufferVertices()
 			self.vertBuffer = self.vertBuffer[:self.bufferStart] + allVerts
+			self.liveVertIndices = getFirstIndexDict(
+				self.vertBuffer, self.bufferStart, len(self.vertBuffer))
 			self.vertexBufferTriangles = \
 				[getNewIndices(existingVertIndices, self.bufferStart)]
 		else:
-			self.vertBuffer.extend(addedVerts)
+			for f3dVert in addedVerts:
+				self.liveVertIndices.setdefault(f3dVert, len(self.vertBuffer))
+				self.vertBuffer.append(f3dVert)
 			self.vertexBufferTriangles.append(triIndices)
 	
+	def saveBufferVertices(self):
+		self.vtxList.vertices.extend(convertVertexArrays(
+			self.meshData.vertData[self.vertBuffer[self.bufferStart:]],
+			self.texDimensions, self.vertexTransforms, self.isPointSampled,
+			self.exportVertexColors))
+
 	def finish(self):
 		if len(self.vertexBufferTriangles) > 0:
 			self.triList.commands.append(SPVertex(self.vtxList, 
@@ -857,35 +989,17 @@ class TriangleConverter:
 				len(self.vertBuffer) - self.bufferStart, self.bufferStart))
 			self.triList.commands.extend(createTriangleCommands(
 				self.vertexBufferTriangles, self.f3d.F3DEX_GBI))
-			for vertData in self.vertBuffer[self.bufferStart:]:
-				self.vtxList.vertices.append(convertVertexData(
-					self.convertInfo.obj.data, vertData[0], vertData[1], 
-					vertData[2], self.texDimensions, self.transformMatrix,
-					self.isPointSampled, self.exportVertexColors))
+			self.saveBufferVertices()
 		
 		self.triList.commands.append(SPEndDisplayList())
-	
-def getF3DVert(loop, face, convertInfo, mesh):
-	position = mesh.vertices[loop.vertex_index].co.copy().freeze()
-	# N64 is -Y, Blender is +Y
-	uv = convertInfo.uv_data[loop.index].uv.copy()
-	uv[1] = 1 - uv[1]
-	uv = uv.freeze()
-	colorOrNormal = getLoopColorOrNormal(loop, face, 
-		convertInfo.obj.data, convertInfo.obj, convertInfo.exportVertexColors)
-	
-	return (position, uv, colorOrNormal)
-
-def getLoopNormal(loop, face, mesh, isFlatShaded):
-	# This is a workaround for flat shading not working well.
-	# Since we support custom blender normals we can now ignore this.
-	#if isFlatShaded:
-	#	normal = -face.normal #???
-	#else:
-	#	normal = -loop.normal #???
-	#return get8bitRoundedNormal(normal).freeze()
-	return get8bitRoundedNormal(loop, mesh).freeze()
 
+# Maps each value in data[start:end] to the index of its first occurrence.
+def getFirstIndexDict(data, start, end):
+	indexDict = {}
+	for i in range(start, end):
+		indexDict.setdefault(data[i], i)
+	return indexDict
+	
 '''
 def getLoopNormalCreased(bLoop, obj):
 	edges = obj.data.edges
@@ -988,15 +1102,33 @@ def getHighestFaceWeight(faceWeights):
 	return highestFaceWeight
 '''
 
-def convertVertexData(mesh, loopPos, loopUV, loopColorOrNormal, 
-	texDimensions, transformMatrix, isPointSampled, exportVertexColors):
-	#uv_layer = mesh.uv_layers.active
-	#color_layer = mesh.vertex_colors['Col']
-	#alpha_layer = mesh.vertex_colors['Alpha']
+# Returns (transform matrix, normal matrix) for convertVertexArrays,
+# so the normal matrix is only computed once per transform.
+def getVertexTransforms(transformMatrix):
+	return np.array(transformMatrix, dtype = np.float32), \
+		np.array(transformMatrix.inverted().transposed(), dtype = np.float32)
+
+# Same as Vector.normalized() in mathutils for each vector.
+def normalizeVectors(vectors):
+	squares = vectors * vectors
+	lengths = squares[:, -1].astype(np.float64)
+	for i in reversed(range(squares.shape[1] - 1)):
+		lengths += squares[:, i]
+	isNonZero = lengths > 1.0e-35
+	lengths = np.sqrt(lengths).astype(np.float32)
+	lengths[~isNonZero] = 1
+	scales = np.where(isNonZero, np.float32(1) / lengths, np.float32(0))
+	return vectors * scales[:, np.newaxis]
+
+# Converts rows of (position, uv, colorOrNormal, ...) vertex data, 
+# like F3DMeshData.vertData, to Vtx in one pass.
+# transforms is the result of getVertexTransforms.
+def convertVertexArrays(vertData, texDimensions, transforms, isPointSampled, 
+	exportVertexColors):
+	transformMatrix, normalMatrix = transforms
 
 	# Position (8 bytes)
-	position = [int(round(floatValue)) for \
-		floatValue in (transformMatrix @ loopPos)]
+	positions = np.round(transformVectors(transformMatrix, vertData[:, 0:3])[:, 0:3])
 
 	# UV (4 bytes)
 	# For F3D, Bilinear samples the point from the center of the pixel.
@@ -1004,57 +1136,26 @@ def convertVertexData(mesh, loopPos, loopUV, loopColorOrNormal,
 	# Thus we add 0.5 to the UV only if bilinear filtering.
 	# see section 13.7.5.3 in programming manual.
 	pixelOffset = 0 if isPointSampled else 0.5
-	uv = [
-		convertFloatToFixed16(loopUV[0] * texDimensions[0] - pixelOffset),
-		convertFloatToFixed16(loopUV[1] * texDimensions[1] - pixelOffset)
-	]
+	uvs = np.round((vertData[:, 3:5] * [texDimensions[0], texDimensions[1]] - \
+		pixelOffset) * 2**5)
 
 	# Color/Normal (4 bytes)
 	if exportVertexColors:
-		colorOrNormal = [
-			int(round(loopColorOrNormal[0] * 255)).to_bytes(1, 'big')[0],
-			int(round(loopColorOrNormal[1] * 255)).to_bytes(1, 'big')[0],
-			int(round(loopColorOrNormal[2] * 255)).to_bytes(1, 'big')[0],
-			int(round(loopColorOrNormal[3] * 255)).to_bytes(1, 'big')[0]
-		]
+		colorOrNormals = np.round(vertData[:, 5:9] * 255)
 	else:
 		# normal transformed correctly.
-		normal = (transformMatrix.inverted().transposed() @ \
-			loopColorOrNormal).normalized()
-		colorOrNormal = [
-			int(round(normal[0] * 127)).to_bytes(1, 'big', signed = True)[0],
-			int(round(normal[1] * 127)).to_bytes(1, 'big', signed = True)[0],
-			int(round(normal[2] * 127)).to_bytes(1, 'big', signed = True)[0],
-			int(round(loopColorOrNormal[3] * 255)).to_bytes(1, 'big')[0],
-		]
-
-	return Vtx(position, uv, colorOrNormal)
-
-def getLoopColor(loop, mesh):
-	color_layer = mesh.vertex_colors['Col'].data if 'Col' in \
-		mesh.vertex_colors else None
-	alpha_layer = mesh.vertex_colors['Alpha'].data if 'Alpha' in \
-		mesh.vertex_colors else None
-
-	if color_layer is not None:
-		normalizedRGB = color_layer[loop.index].color
-	else:
-		normalizedRGB = [1,1,1]
-	if alpha_layer is not None:
-		normalizedAColor = alpha_layer[loop.index].color
-		normalizedA = mathutils.Color(normalizedAColor[0:3]).v
-	else:
-		normalizedA = 1
-	
-	return (normalizedRGB[0], normalizedRGB[1], normalizedRGB[2], normalizedA)
-
-def getLoopColorOrNormal(loop, face, mesh, obj, exportVertexColors):
-	material = obj.data.materials[face.material_index]
-	isFlatShaded = checkIfFlatShaded(material)
-	if exportVertexColors:
-		return getLoopColor(loop, mesh)
-	else:
-		return getLoopNormal(loop, face, mesh, isFlatShaded)
+		normals = normalizeVectors(transformVectors(normalMatrix, vertData[:, 5:9]))
+		colorOrNormals = np.column_stack((
+			np.round(normals[:, 0:3].astype(np.float64) * 127) % 256, 
+			np.round(vertData[:, 8] * 255)))
+	if colorOrNormals.size > 0 and \
+		(colorOrNormals.min() < 0 or colorOrNormals.max() > 255):
+		raise PluginError("Vertex color or alpha is outside of the 0-1 range.")
+
+	positions = positions.astype(np.int64).tolist()
+	uvs = uvs.astype(np.int64).tolist()
+	colorOrNormals = colorOrNormals.astype(np.int64).tolist()
+	return [Vtx(positions[i], uvs[i], colorOrNormals[i]) for i in range(len(vertData))]
 
 def createTriangleCommands(triangles, useSP2Triangle):
 	triangles = copy.deepcopy(triangles)
@@ -1123,18 +1224,22 @@ def getTexDimensions(material):
 		texDimensions = [32, 32]
 	return texDimensions
 
-def saveOrGetF3DMaterial(material, fModel, obj, drawLayer, convertTextureData):
+# atlas is the TextureAtlas replacing texture 0, if any.
+# The materials sharing an atlas are saved once, keyed by the atlas.
+def saveOrGetF3DMaterial(material, fModel, obj, drawLayer, convertTextureData, atlas = None):
 	areaKey = fModel.global_data.getCurrentAreaKey(material)
 	areaIndex = fModel.global_data.current_area_index
+	keyMaterial = material if atlas is None else atlas
 	if material.rdp_settings.set_rendermode:
-		if (material, drawLayer, areaKey) in fModel.materials:
-			return fModel.materials[(material, drawLayer, areaKey)]
-	elif (material, None, areaKey) in fModel.materials:
-		return fModel.materials[(material, None, areaKey)]
+		if (keyMaterial, drawLayer, areaKey) in fModel.materials:
+			return fModel.materials[(keyMaterial, drawLayer, areaKey)]
+	elif (keyMaterial, None, areaKey) in fModel.materials:
+		return fModel.materials[(keyMaterial, None, areaKey)]
 	
 	if len(obj.data.materials) == 0:
 		raise PluginError("Mesh must have at least one material.")
-	materialName = fModel.name + "_" + toAlnum(material.name) + (('_layer' + str(drawLayer)) \
+	materialName = fModel.name + "_" + toAlnum(material.name if atlas is None else atlas.name) + \
+		(('_layer' + str(drawLayer)) \
 		if material.rdp_settings.set_rendermode and drawLayer is not None else '') +\
 		(('_area' + str(areaIndex)) if \
 			material.set_fog and material.use_global_fog and areaKey is not None else '')
@@ -1234,7 +1339,10 @@ def saveOrGetF3DMaterial(material, fModel, obj, drawLayer, convertTextureData):
 	texDimensions0 = None
 	texDimensions1 = None
 	nextTmem = 0
-	if useDict['Texture 0'] and material.tex0.tex_set:
+	if atlas is not None:
+		texDimensions0, nextTmem = saveTextureAtlasIndex(fModel, 
+			fMaterial.material, atlas, 0, nextTmem, convertTextureData)
+	elif useDict['Texture 0'] and material.tex0.tex_set:
 		if material.tex0.tex is None:
 			raise PluginError('In material \"' + material.name + '\", a texture has not been set.')
 		texDimensions0, nextTmem = saveTextureIndex(material.name, fModel, 
@@ -1333,7 +1441,7 @@ def saveOrGetF3DMaterial(material, fModel, obj, drawLayer, convertTextureData):
 	else:
 		fMaterial.revert = None
 	
-	materialKey = material, (drawLayer if material.rdp_settings.set_rendermode else None), \
+	materialKey = keyMaterial, (drawLayer if material.rdp_settings.set_rendermode else None), \
 		fModel.global_data.getCurrentAreaKey(material)
 	fModel.materials[materialKey] = (fMaterial, texDimensions)
 
@@ -1400,6 +1508,14 @@ def saveTextureIndex(propName, fModel, loadTexGfx, revertTexGfx, texProp, index,
 
 	return texDimensions, nextTmem
 
+def saveTextureAtlasIndex(fModel, loadTexGfx, atlas, index, tmem, convertTextureData):
+	fImage = saveOrGetTextureAtlasDefinition(fModel, atlas, convertTextureData)
+	# Textures are padded inside the atlas, so it is never wrapped.
+	saveTextureLoading(fImage, loadTexGfx, True, False, True, False, 0, 0, 0, 0,
+		0, 0, atlas.width - 1, atlas.height - 1, atlas.texFormat, index, fModel.f3d, tmem)
+	nextTmem = tmem + getTmemWordUsage(atlas.texFormat, atlas.width, atlas.height)
+	return (fImage.width, fImage.height), nextTmem
+
 # texIndex: 0 for texture0, 1 for texture1
 def saveTextureLoading(fImage, loadTexGfx, clamp_S, mirror_S, clamp_T,
 	mirror_T, mask_S, mask_T, shift_S, shift_T,
@@ -1517,30 +1633,12 @@ def saveOrGetPaletteDefinition(fModelOrTexRect, image, imageName, texFmt, palFmt
 	if imageKey in fModelOrTexRect.textures:
 		return fModelOrTexRect.textures[imageKey], fModelOrTexRect.textures[palKey]
 
-	palette = []
-	texture = []
-	maxColors = 16 if bitSize == 'G_IM_SIZ_4b' else 256
+	paletteData = bytearray(0)
+	textureData = bytearray(0)
+	colorCount = 0
 	if convertTextureData:
-		# N64 is -Y, Blender is +Y
-		for j in reversed(range(image.size[1])):
-			for i in range(image.size[0]):
-				color = [1,1,1,1]
-				for field in range(image.channels):
-					color[field] = image.pixels[
-						(j * image.size[0] + i) * image.channels + field]
-				if palFormat == 'G_IM_FMT_RGBA':
-					pixelColor = getRGBA16Tuple(color)
-				elif palFormat == 'G_IM_FMT_IA':
-					pixelColor = getIA16Tuple(color)
-				else:
-					raise PluginError("Invalid combo: " + palFormat + ', ' + bitSize)
-				
-				if pixelColor not in palette:
-					palette.append(pixelColor)
-					if len(palette) > maxColors:
-						raise PluginError('Texture ' + imageName + ' has more than ' + \
-							str(maxColors) + ' colors.')
-				texture.append(palette.index(pixelColor))
+		paletteData, textureData, colorCount = getEncodedPaletteTexture(
+			image, texFmt, palFmt, palFormat, bitSize, imageName)
 	
 	if image.filepath == "":
 		name = image.name
@@ -1554,41 +1652,21 @@ def saveOrGetPaletteDefinition(fModelOrTexRect, image, imageName, texFmt, palFmt
 		image.size[0], image.size[1], filename)
 
 	fPalette = FImage(checkDuplicateTextureName(fModelOrTexRect, paletteName), palFormat, 'G_IM_SIZ_16b', 1, 
-		len(palette), paletteFilename)
+		colorCount, paletteFilename)
 	#paletteTex = bpy.data.images.new(paletteName, 1, len(palette))
 	#paletteTex.pixels = palette
 	#paletteTex.filepath = getNameFromPath(name, True) + '.' + \
 	#	texFmt.lower() + '.pal'
 
 	if convertTextureData:
-		for color in palette:
-			fPalette.data.extend(color.to_bytes(2, 'big')) 
-
-		if bitSize == 'G_IM_SIZ_4b':
-			fImage.data = compactNibbleArray(texture, image.size[0], image.size[1])
-		else:	
-			fImage.data = bytearray(texture)
+		fPalette.data = paletteData
+		fImage.data = textureData
 	
 	fModelOrTexRect.textures[(image, (texFmt, palFmt))] = fImage
 	fModelOrTexRect.textures[(image, (palFmt, 'PAL'))] = fPalette
 
 	return fImage, fPalette #, paletteTex
 
-def compactNibbleArray(texture, width, height):
-	nibbleData = bytearray(0)
-	dataSize = int(width * height / 2)
-
-	for i in range(dataSize):
-		nibbleData.append(
-			((texture[i * 2] & 0xF) << 4) |\
-			(texture[i * 2 + 1] & 0xF)
-		)
-
-	if (width * height) % 2 == 1:
-		nibbleData.append((texture[-1] & 0xF) << 4)
-	
-	return nibbleData
-
 def checkDuplicateTextureName(fModelOrTexRect, name):
 	names = []
 	for info, texture in fModelOrTexRect.textures.items():
@@ -1617,72 +1695,29 @@ def saveOrGetTextureDefinition(fModel, image, imageName, texFormat, convertTextu
 		image.size[0], image.size[1], filename)
 
 	if convertTextureData:
-		# N64 is -Y, Blender is +Y
-		for j in reversed(range(image.size[1])):
-			for i in range(image.size[0]):
-				color = [1,1,1,1]
-				for field in range(image.channels):
-					color[field] = image.pixels[
-						(j * image.size[0] + i) * image.channels + field]
-				if fmt == 'G_IM_FMT_RGBA':
-					if bitSize == 'G_IM_SIZ_16b':
-						words = \
-							((int(color[0] * 0x1F) & 0x1F) << 11) | \
-							((int(color[1] * 0x1F) & 0x1F) << 6) | \
-							((int(color[2] * 0x1F) & 0x1F) << 1) | \
-							(1 if color[3] > 0.5 else 0)
-						fImage.data.extend(bytearray(words.to_bytes(2, 'big')))
-					elif bitSize == 'G_IM_SIZ_32b':
-						fImage.data.extend(bytearray([
-							int(value * 0xFF) & 0xFF for value in color]))
-					else:
-						raise PluginError("Invalid combo: " + fmt + ', ' + bitSize)
-
-				elif fmt == 'G_IM_FMT_YUV':
-					raise PluginError("YUV not yet implemented.")
-					if bitSize == 'G_IM_SIZ_16b':
-						pass
-					else:
-						raise PluginError("Invalid combo: " + fmt + ', ' + bitSize)
-
-				elif fmt == 'G_IM_FMT_CI':
-					raise PluginError("CI not yet implemented.")
-
-				elif fmt == 'G_IM_FMT_IA':
-					intensity = mathutils.Color(color[0:3]).v
-					alpha = color[3]
-					if bitSize == 'G_IM_SIZ_4b':
-						fImage.data.append(
-							((int(intensity * 0x7) & 0x7) << 1) | \
-							(1 if alpha > 0.5 else 0))
-					elif bitSize == 'G_IM_SIZ_8b':
-						fImage.data.append(
-							((int(intensity * 0xF) & 0xF) << 4) | \
-							(int(alpha * 0xF) & 0xF))
-					elif bitSize == 'G_IM_SIZ_16b':
-						fImage.data.extend(bytearray(
-							[int(intensity * 0xFF), int(alpha * 0xFF)]))
-					else:
-						raise PluginError("Invalid combo: " + fmt + ', ' + bitSize)
-				elif fmt == 'G_IM_FMT_I':
-					intensity = mathutils.Color(color[0:3]).v
-					if bitSize == 'G_IM_SIZ_4b':
-						fImage.data.append(int(intensity * 0xF))
-					elif bitSize == 'G_IM_SIZ_8b':
-						fImage.data.append(int(intensity * 0xFF))
-					else:
-						raise PluginError("Invalid combo: " + fmt + ', ' + bitSize)
-				else:
-					raise PluginError("Invalid image format " + fmt)
-			
-		# We stored 4bit values in byte arrays, now to convert
-		if bitSize == 'G_IM_SIZ_4b':
-			fImage.data = \
-				compactNibbleArray(fImage.data, image.size[0], image.size[1])
+		fImage.data = getEncodedTexture(image, texFormat, fmt, bitSize, imageName)
 	
 	fModel.textures[(image, (texFormat, 'NONE'))] = fImage
 	return fImage
 
+def saveOrGetTextureAtlasDefinition(fModel, atlas, convertTextureData):
+	fmt = texFormatOf[atlas.texFormat]
+	bitSize = texBitSizeOf[atlas.texFormat]
+
+	imageKey = (atlas, (atlas.texFormat, 'NONE'))
+	if imageKey in fModel.textures:
+		return fModel.textures[imageKey]
+
+	imageName = fModel.name + '_' + atlas.name + '_' + atlas.texFormat.lower()
+	fImage = FImage(checkDuplicateTextureName(fModel, toAlnum(imageName)), fmt, bitSize, 
+		atlas.width, atlas.height, atlas.name + '.' + atlas.texFormat.lower() + '.inc.c')
+
+	if convertTextureData:
+		fImage.data = encodeTexture(atlas.pixels, fmt, bitSize, imageName)
+
+	fModel.textures[imageKey] = fImage
+	return fImage
+
 def saveLightsDefinition(fModel, material, lightsName):
 	lights = Lights(toAlnum(lightsName))
 
@@ -6,7 +6,9 @@ from .utility import *
 from .sm64_constants import *
 from math import pi
 import os
+import io
 import copy
+import numpy as np
 
 sm64_anim_types = {'ROTATE', 'TRANSLATE'}
 
@@ -26,9 +28,15 @@ class SM64_Animation:
 			self.values.to_binary()
 	
 	def to_c(self):
-		return self.values.to_c() + '\n' +\
-			self.indices.to_c() + '\n' +\
-			self.header.to_c() + '\n'
+		out = io.StringIO()
+		self.write_c(out)
+		return out.getvalue()
+
+	def write_c(self, out):
+		self.values.write_c(out)
+		out.write('\n')
+		self.indices.write_c(out)
+		out.write('\n' + self.header.to_c() + '\n')
 		#return self.header.to_c() + '\n' +\
 		#	self.indices.to_c() + '\n' +\
 		#	self.values.to_c() + '\n'
@@ -58,17 +66,15 @@ class SM64_ShortArray:
 		return data
 	
 	def to_c(self):
-		data = 'static const ' + ('s' if self.signed else 'u') + \
-			'16 ' + self.name + '[] = {\n\t'
-		wrapCounter = 0
-		for short in self.shortData:
-			data += '0x' + format(short, '04X') + ', '
-			wrapCounter += 1
-			if wrapCounter > 8:
-				data += '\n\t'
-				wrapCounter = 0
-		data += '\n};\n'
-		return data
+		out = io.StringIO()
+		self.write_c(out)
+		return out.getvalue()
+
+	def write_c(self, out):
+		out.write('static const ' + ('s' if self.signed else 'u') + \
+			'16 ' + self.name + '[] = {\n\t')
+		writeCValueArray(out, self.shortData, formatCHexShort, 9)
+		out.write('\n};\n')
 	
 	def to_json(self, assigned_name = ""):
 		if (assigned_name == ""):
@@ -106,6 +112,7 @@ class SM64_AnimationHeader:
 		self.transformValuesStart = transformValuesStart
 		self.transformIndicesStart = transformIndicesStart
 		self.animSize = animSize # DMA animations only
+		self.valuesName = name + '_values'
 		
 		self.transformIndices = []
 
@@ -144,7 +151,7 @@ class SM64_AnimationHeader:
 			'\t' + str(int(round(self.frameInterval[0]))) + ',\n' + \
 			'\t' + str(int(round(self.frameInterval[1] - 1))) + ',\n' + \
 			'\tANIMINDEX_NUMPARTS(' + self.name + '_indices),\n' + \
-			'\t' + self.name + '_values,\n' + \
+			'\t' + self.valuesName + ',\n' + \
 			'\t' + self.name + '_indices,\n' + \
 			'\t0,\n' + \
 			'};\n'
@@ -183,11 +190,37 @@ def getLastKeyframeTime(keyframes):
 # add data/table files
 def exportAnimationC(armatureObj, loopAnim, dirPath, dirName, groupName,
 	customExport, headerType, levelName):
-	dirPath, texDir = getExportDir(customExport, dirPath, headerType, 
-		levelName, '', dirName)
-
 	sm64_anim = exportAnimationCommon(armatureObj, loopAnim, dirName + "_anim")
 	animName = armatureObj.animation_data.action.name
+	writeAnimationsC([(animName, sm64_anim)], None, dirPath, dirName, groupName,
+		customExport, headerType, levelName)
+
+# Exports every action of the armature, with values tables shared between them.
+# Returns the total size of the animation data.
+def exportAnimationBankC(armatureObj, loopAnim, dirPath, dirName, groupName,
+	customExport, headerType, levelName):
+	actions, sm64_anims = exportAnimationsCommon(armatureObj, loopAnim, 
+		dirName + "_anim", True)
+	sharedValues = []
+	for values in getAnimValueTables(sm64_anims):
+		suffix = '_' + str(len(sharedValues)) if len(sharedValues) > 0 else ''
+		valuesArray = SM64_ShortArray(dirName + '_anims_values' + suffix, True)
+		valuesArray.shortData = values
+		sharedValues.append(('anim_values' + suffix + '.inc.c', valuesArray))
+		for sm64_anim in sm64_anims:
+			if sm64_anim.values.shortData is values:
+				sm64_anim.header.valuesName = valuesArray.name
+	writeAnimationsC([(actions[i].name, sm64_anims[i]) for i in range(len(actions))],
+		sharedValues, dirPath, dirName, groupName, customExport, headerType, levelName)
+	return printAnimationSizes(sm64_anims, True)
+
+# namedAnims is a list of (action name, SM64_Animation).
+# If sharedValues is not None, it is a list of (file name, SM64_ShortArray)
+# values tables, each written once, and the animation headers already use them.
+def writeAnimationsC(namedAnims, sharedValues, dirPath, dirName, groupName,
+	customExport, headerType, levelName):
+	dirPath, texDir = getExportDir(customExport, dirPath, headerType, 
+		levelName, '', dirName)
 
 	geoDirPath = os.path.join(dirPath, toAlnum(dirName))
 	if not os.path.exists(geoDirPath):
@@ -198,34 +231,60 @@ def exportAnimationC(armatureObj, loopAnim, dirPath, dirName, groupName,
 		os.mkdir(animDirPath)
 
 	animsName = dirName + '_anims'
-	animFileName = 'anim_' + toAlnum(animName) + '.inc.c'
-	animPath = os.path.join(animDirPath, animFileName)
-
-	data = sm64_anim.to_c()
-	outFile = open(animPath, 'w', newline='\n')
-	outFile.write(data)
-	outFile.close()
 
 	headerPath = os.path.join(geoDirPath, 'anim_header.h')
 	headerFile = open(headerPath, 'w', newline='\n')
 	headerFile.write('extern const struct Animation *const ' + animsName + '[];\n')
 	headerFile.close()
 
-	# write to data.inc.c
 	dataFilePath = os.path.join(animDirPath, 'data.inc.c')
 	if not os.path.exists(dataFilePath):
 		dataFile = open(dataFilePath, 'w', newline='\n')
 		dataFile.close()
-	writeIfNotFound(dataFilePath, '#include "' + animFileName + '"\n', '')
 
-	# write to table.inc.c
 	tableFilePath = os.path.join(animDirPath, 'table.inc.c')
 	if not os.path.exists(tableFilePath):
 		tableFile = open(tableFilePath, 'w', newline='\n')
 		tableFile.write('const struct Animation *const ' + \
 			animsName + '[] = {\n\tNULL,\n};\n')
 		tableFile.close()
-	writeIfNotFound(tableFilePath, '\t&' + sm64_anim.header.name + ',\n', '\tNULL,\n};')
+
+	if sharedValues is not None:
+		# The values must be included before any animation using them.
+		dataFile = open(dataFilePath, 'r')
+		dataFileContents = dataFile.read()
+		dataFile.close()
+		valuesIncludes = ''
+		for valuesFileName, valuesArray in sharedValues:
+			outFile = open(os.path.join(animDirPath, valuesFileName), 'w', newline='\n')
+			valuesArray.write_c(outFile)
+			outFile.close()
+
+			valuesInclude = '#include "' + valuesFileName + '"\n'
+			if valuesInclude not in dataFileContents:
+				valuesIncludes += valuesInclude
+		if valuesIncludes != '':
+			dataFile = open(dataFilePath, 'w', newline='\n')
+			dataFile.write(valuesIncludes + dataFileContents)
+			dataFile.close()
+
+	for animName, sm64_anim in namedAnims:
+		animFileName = 'anim_' + toAlnum(animName) + '.inc.c'
+		animPath = os.path.join(animDirPath, animFileName)
+
+		outFile = open(animPath, 'w', newline='\n')
+		if sharedValues is None:
+			sm64_anim.write_c(outFile)
+		else:
+			sm64_anim.indices.write_c(outFile)
+			outFile.write('\n' + sm64_anim.header.to_c() + '\n')
+		outFile.close()
+
+		# write to data.inc.c
+		writeIfNotFound(dataFilePath, '#include "' + animFileName + '"\n', '')
+
+		# write to table.inc.c
+		writeIfNotFound(tableFilePath, '\t&' + sm64_anim.header.name + ',\n', '\tNULL,\n};')
 
 	if not customExport:
 		if headerType == 'Actor':
@@ -275,6 +334,35 @@ def exportAnimationBinary(romfile, exportRange, armatureObj, DMAAddresses,
 			romfile.write(len(animData).to_bytes(4, byteorder='big'))
 		return addrRange, None
 
+# Writes every action of the armature as a DMA table, like Mario's animation table:
+# animation count, unused address, then (offset from table start, size) per animation.
+def exportAnimationBankBinary(romfile, exportRange, armatureObj, loopAnim):
+	tableAddress = get64bitAlignedAddr(exportRange[0])
+	actions, sm64_anims = exportAnimationsCommon(armatureObj, loopAnim, 
+		armatureObj.name, False)
+
+	data = bytearray(0)
+	data.extend(len(sm64_anims).to_bytes(4, byteorder = 'big'))
+	data.extend(bytearray([0x00] * 4))
+	data.extend(bytearray([0x00] * 8 * len(sm64_anims)))
+	for i in range(len(sm64_anims)):
+		offset = get64bitAlignedAddr(len(data))
+		data.extend(bytearray([0x00] * (offset - len(data))))
+		animData = sm64_anims[i].to_binary(None, True, tableAddress + offset)
+		data[8 + 8 * i : 16 + 8 * i] = offset.to_bytes(4, byteorder = 'big') + \
+			len(animData).to_bytes(4, byteorder = 'big')
+		data.extend(animData)
+
+	if tableAddress + len(data) > exportRange[1]:
+		raise PluginError('Size too big: Data ends at ' + \
+			hex(tableAddress + len(data)) +\
+			', which is larger than the specified range.')
+
+	romfile.seek(tableAddress)
+	romfile.write(data)
+	printAnimationSizes(sm64_anims, False)
+	return (tableAddress, tableAddress + len(data)), len(sm64_anims)
+
 def exportAnimationInsertableBinary(filepath, armatureObj, isDMA, loopAnim):
 	startAddress = get64bitAlignedAddr(0)
 	sm64_anim = exportAnimationCommon(armatureObj, loopAnim, armatureObj.name)
@@ -308,6 +396,117 @@ def exportAnimationJSON(filepath, armatureObj, loop, name, author):
 	writeIfNotFound(dataFilePath, '', '')
 
 
+# Actions with fcurves for any bone of the armature.
+def getArmatureActions(armatureObj):
+	actions = []
+	for action in bpy.data.actions:
+		for fcurve in action.fcurves:
+			match = re.match(r'pose\.bones\["([^"]*)"\]', fcurve.data_path)
+			if match is not None and match.group(1) in armatureObj.data.bones:
+				actions.append(action)
+				break
+	return actions
+
+# Converts every action of the armature, using the same bone order for all.
+# If shareValues is set, every animation uses one values table.
+# Returns (actions, [SM64_Animation]).
+def exportAnimationsCommon(armatureObj, loopAnim, name, shareValues):
+	actions = getArmatureActions(armatureObj)
+	if len(actions) == 0:
+		raise PluginError("No actions found for " + armatureObj.name + ".")
+	animNames = [toAlnum(name + "_" + action.name) for action in actions]
+	for animName in animNames:
+		if animNames.count(animName) > 1:
+			raise PluginError("Multiple actions have the name " + animName + \
+				" when converted to C identifiers.")
+
+	if armatureObj.animation_data is None:
+		armatureObj.animation_data_create()
+	originalAction = armatureObj.animation_data.action
+	animBones = getAnimExportBones(armatureObj)
+	animChannels = []
+	try:
+		# Frame stepping and sampling both use the armature's active action.
+		for action in actions:
+			armatureObj.animation_data.action = action
+			animChannels.append(getAnimationChannels(action, armatureObj, animBones))
+	finally:
+		armatureObj.animation_data.action = originalAction
+
+	if shareValues:
+		animValues = getSharedAnimValueTables([channels \
+			for frameInterval, channels in animChannels])
+
+	nodeCount = len(armatureObj.data.bones)
+	sm64_anims = []
+	for i in range(len(actions)):
+		frameInterval, channels = animChannels[i]
+		if shareValues:
+			values, channelOffsets = animValues[i]
+		else:
+			values, channelOffsets = getSharedAnimValues(channels)
+		sm64_anim = SM64_Animation(animNames[i])
+		setAnimationData(sm64_anim, loopAnim, nodeCount, frameInterval, channels,
+			values, channelOffsets)
+		sm64_anims.append(sm64_anim)
+	return actions, sm64_anims
+
+# Animation indices store values offsets as u16s, so a shared values table
+# is split into several tables when its offsets would exceed that.
+# Returns [(values, [offset of each channel in values])] for each animation,
+# where animations using the same table share the same values list.
+def getSharedAnimValueTables(animChannels):
+	# Animations are added in order, starting a new table when needed.
+	tables = [list(range(len(animChannels)))]
+	if not fitsAnimValueTable(animChannels):
+		tables = []
+		for i in range(len(animChannels)):
+			if len(tables) > 0 and fitsAnimValueTable(
+				[animChannels[j] for j in tables[-1] + [i]]):
+				tables[-1].append(i)
+			else:
+				tables.append([i])
+
+	animValues = [None] * len(animChannels)
+	for tableAnims in tables:
+		values, channelOffsets = getSharedAnimValues([channel \
+			for i in tableAnims for channel in animChannels[i]])
+		channelIndex = 0
+		for i in tableAnims:
+			channelCount = len(animChannels[i])
+			animValues[i] = (values, channelOffsets[channelIndex:channelIndex + channelCount])
+			channelIndex += channelCount
+	return animValues
+
+def fitsAnimValueTable(animChannels):
+	values, channelOffsets = getSharedAnimValues([channel \
+		for channels in animChannels for channel in channels])
+	return max(channelOffsets, default = 0) <= 2**16 - 1
+
+# Returns the distinct values tables of animations, in order of first use.
+def getAnimValueTables(sm64_anims):
+	tables = []
+	for sm64_anim in sm64_anims:
+		if not any([values is sm64_anim.values.shortData for values in tables]):
+			tables.append(sm64_anim.values.shortData)
+	return tables
+
+# Prints the size of each animation, and returns the total size.
+def printAnimationSizes(sm64_anims, sharedValues):
+	totalSize = 0
+	for sm64_anim in sm64_anims:
+		animSize = sm64_anim.header.animSize
+		if sharedValues:
+			animSize -= len(sm64_anim.values.shortData) * 2
+		print(sm64_anim.name + ": " + str(animSize) + " bytes")
+		totalSize += animSize
+	if sharedValues:
+		for values in getAnimValueTables(sm64_anims):
+			valuesSize = len(values) * 2
+			print("Shared values: " + str(valuesSize) + " bytes")
+			totalSize += valuesSize
+	return totalSize
+
 def exportAnimationCommon(armatureObj, loopAnim, name):
 	if armatureObj.animation_data is None or \
 		armatureObj.animation_data.action is None:
@@ -315,8 +514,16 @@ def exportAnimationCommon(armatureObj, loopAnim, name):
 	anim = armatureObj.animation_data.action
 	sm64_anim = SM64_Animation(toAlnum(name + "_" + anim.name))
 
-	nodeCount = len(armatureObj.data.bones)
-		
+	frameInterval, channels = getAnimationChannels(anim, armatureObj,
+		getAnimExportBones(armatureObj))
+	values, channelOffsets = getSharedAnimValues(channels)
+	setAnimationData(sm64_anim, loopAnim, len(armatureObj.data.bones), 
+		frameInterval, channels, values, channelOffsets)
+	return sm64_anim
+
+# Returns (frame interval, channels), where channels are the root translation
+# and bone rotation frames, as stored in the animation values.
+def getAnimationChannels(anim, armatureObj, animBones):
 	frameInterval = [0,0]
 
 	# frame_start is minimum 0
@@ -327,13 +534,29 @@ def exportAnimationCommon(armatureObj, loopAnim, name):
 	frameInterval[1] = \
 		max(min(bpy.context.scene.frame_end, 
 			int(round(anim.frame_range[1]))), frameInterval[0]) + 1
-	translationData, armatureFrameData = convertAnimationData(anim, armatureObj, frameInterval[1], frameInterval[0])
+	translationData, armatureFrameData = convertAnimationData(anim, armatureObj, 
+		frameInterval[1], frameInterval[0], animBones)
 	print("Frame End:" + str(frameInterval[1]))
 
+	channels = []
+	for translationFrameProperty in translationData:
+		channels.append([int.from_bytes(value.to_bytes(2,'big', signed = True), 
+			byteorder = 'big', signed = False) for value in translationFrameProperty.frames])
+
+	rotationTolerance = bpy.context.scene.animRotationTolerance
+	for boneFrameData in armatureFrameData:
+		for boneFrameDataProperty in boneFrameData:
+			channels.append(removeTrailingRotationFrames(
+				boneFrameDataProperty.frames, rotationTolerance))
+	return frameInterval, channels
+
+# values may be shared with other animations, 
+# in which case sm64_anim.values should be replaced with the shared array.
+def setAnimationData(sm64_anim, loopAnim, nodeCount, frameInterval, channels, 
+	values, channelOffsets):
 	repetitions = 0 if loopAnim else 1
 	marioYOffset = 0x00 # ??? Seems to be this value for most animations
 	
-	transformValuesOffset = 0
 	headerSize = 0x1A
 	transformIndicesStart = headerSize #0x18 if including animSize?
 
@@ -343,28 +566,13 @@ def exportAnimationCommon(armatureObj, loopAnim, name):
 	# transformValuesStart = transformIndicesStart + (nodeCount + 1) * 3 * 4 
 	transformValuesStart = transformIndicesStart
 
-	for translationFrameProperty in translationData:
-		frameCount = len(translationFrameProperty.frames)
-		sm64_anim.indices.shortData.append(frameCount)
-		sm64_anim.indices.shortData.append(transformValuesOffset)
-		if(transformValuesOffset) > 2**16 - 1:
+	sm64_anim.values.shortData = values
+	for i in range(len(channels)):
+		if channelOffsets[i] > 2**16 - 1:
 			raise PluginError('Animation is too large.')
-		transformValuesOffset += frameCount
+		sm64_anim.indices.shortData.append(len(channels[i]))
+		sm64_anim.indices.shortData.append(channelOffsets[i])
 		transformValuesStart += 4
-		for value in translationFrameProperty.frames:
-			sm64_anim.values.shortData.append(int.from_bytes(value.to_bytes(2,'big', signed = True), byteorder = 'big', signed = False))
-
-	for boneFrameData in armatureFrameData:
-		for boneFrameDataProperty in boneFrameData:
-			frameCount = len(boneFrameDataProperty.frames)
-			sm64_anim.indices.shortData.append(frameCount)
-			sm64_anim.indices.shortData.append(transformValuesOffset)
-			if(transformValuesOffset) > 2**16 - 1:
-				raise PluginError('Animation is too large.')
-			transformValuesOffset += frameCount
-			transformValuesStart += 4
-			for value in boneFrameDataProperty.frames:
-				sm64_anim.values.shortData.append(value)
 	
 	animSize = headerSize + len(sm64_anim.indices.shortData) * 2 + \
 		len(sm64_anim.values.shortData) * 2
@@ -372,8 +580,44 @@ def exportAnimationCommon(armatureObj, loopAnim, name):
 	sm64_anim.header = SM64_AnimationHeader(sm64_anim.name, repetitions,
 		marioYOffset, frameInterval, nodeCount, transformValuesStart, 
 		transformIndicesStart, animSize)
-	
-	return sm64_anim
+
+# Returns (values, [offset of each channel in values]).
+# Each channel's frames are only added if they aren't already in the values,
+# either entirely or overlapping the end of the values. 
+# Longer channels are added first, so shorter ones are more likely to be found.
+def getSharedAnimValues(channels):
+	values = []
+	valueData = bytearray(0)
+	channelOffsets = {}
+	for frames in sorted(set([tuple(frames) for frames in channels]), 
+		key = lambda frames: -len(frames)):
+		frameData = b''.join([value.to_bytes(2, 'big') for value in frames])
+		dataOffset = valueData.find(frameData)
+		while dataOffset != -1 and dataOffset % 2 == 1:
+			dataOffset = valueData.find(frameData, dataOffset + 1)
+		if dataOffset != -1:
+			channelOffsets[frames] = dataOffset // 2
+			continue
+
+		overlap = min(len(frames) - 1, len(values))
+		while overlap > 0 and not valueData.endswith(frameData[:overlap * 2]):
+			overlap -= 1
+		channelOffsets[frames] = len(values) - overlap
+		values.extend(frames[overlap:])
+		valueData.extend(frameData[overlap * 2:])
+	return values, [channelOffsets[tuple(frames)] for frames in channels]
+
+# Removes trailing frames within tolerance of the frame held after them,
+# in units of the 16 bit euler angles, which wrap around.
+def removeTrailingRotationFrames(frames, tolerance):
+	if tolerance == 0 or len(frames) < 2:
+		return frames
+	values = np.array(frames, dtype = np.int64)
+	for lastFrame in range(len(values)):
+		differences = (values[lastFrame:] - values[lastFrame]) % 2**16
+		if np.all(np.minimum(differences, 2**16 - differences) <= tolerance):
+			return frames[:lastFrame + 1]
+	return frames
 
 def removeTrailingFrames(frameData):
 	for i in range(3):
@@ -392,7 +636,7 @@ def saveTranslationFrame(frameData, translation):
 	for i in range(3):
 		frameData[i].frames.append(min(int(round(translation[i])), 2**16 - 1))
 
-def convertAnimationData(anim, armatureObj, frameEnd, frameStart = 0):
+def getAnimExportBones(armatureObj):
 	bonesToProcess = findStartBones(armatureObj)
 	currentBone = armatureObj.data.bones[bonesToProcess[0]]
 	animBones = []
@@ -411,7 +655,14 @@ def convertAnimationData(anim, armatureObj, frameEnd, frameStart = 0):
 		# Traverse children in alphabetical order.
 		childrenNames = sorted([bone.name for bone in currentBone.children])
 		bonesToProcess = childrenNames + bonesToProcess
-	
+	return animBones
+
+# animBones is the result of getAnimExportBones, 
+# which can be reused when exporting multiple animations.
+def convertAnimationData(anim, armatureObj, frameEnd, frameStart = 0, animBones = None):
+	if animBones is None:
+		animBones = getAnimExportBones(armatureObj)
+
 	# list of boneFrameData, which is [[x frames], [y frames], [z frames]]
 	translationData = [ValueFrameData(0, i, []) for i in range(3)]
 	armatureFrameData = [[
@@ -419,6 +670,14 @@ def convertAnimationData(anim, armatureObj, frameEnd, frameStart = 0):
 		ValueFrameData(i, 1, []),
 		ValueFrameData(i, 2, [])] for i in range(len(animBones))]
 
+	if canSampleAnimation(armatureObj):
+		sampleAnimationData(anim, armatureObj, animBones, range(frameStart, frameEnd),
+			translationData, armatureFrameData)
+		removeTrailingFrames(translationData)
+		for frameData in armatureFrameData:
+			removeTrailingFrames(frameData)
+		return translationData, armatureFrameData
+
 	currentFrame = bpy.context.scene.frame_current
 	for frame in range(frameStart, frameEnd):
 		bpy.context.scene.frame_set(frame)
@@ -452,6 +711,154 @@ def convertAnimationData(anim, armatureObj, frameEnd, frameStart = 0):
 
 	return translationData, armatureFrameData
 
+# Calling frame_set evaluates the whole scene, so when only the action affects the 
+# armature's pose, its fcurves are sampled and the pose is computed here instead.
+# This follows how Blender builds pose matrices (BKE_pose_where_is_bone).
+def canSampleAnimation(armatureObj):
+	animData = armatureObj.animation_data
+	if len(animData.drivers) > 0 or \
+		len([track for track in animData.nla_tracks if not track.mute]) > 0 or \
+		getattr(animData, 'action_influence', 1) != 1 or \
+		getattr(animData, 'action_blend_type', 'REPLACE') != 'REPLACE':
+		return False
+	for poseBone in armatureObj.pose.bones:
+		bone = poseBone.bone
+		if len(poseBone.constraints) > 0 or \
+			not bone.use_inherit_rotation or \
+			not bone.use_local_location or \
+			not getattr(bone, 'use_inherit_scale', True) or \
+			getattr(bone, 'inherit_scale', 'FULL') != 'FULL':
+			return False
+	return True
+
+# Returns a (frames, size) array of a pose bone property.
+# Channels without an fcurve keep their current value.
+def sampleChannel(anim, poseBone, prop, frames):
+	defaultValue = getattr(poseBone, prop)
+	dataPath = 'pose.bones["' + poseBone.name + '"].' + prop
+	values = np.empty((len(frames), len(defaultValue)))
+	for i in range(len(defaultValue)):
+		fcurve = anim.fcurves.find(dataPath, index = i)
+		if fcurve is None or fcurve.mute or \
+			(fcurve.group is not None and fcurve.group.mute):
+			values[:, i] = defaultValue[i]
+		else:
+			values[:, i] = [fcurve.evaluate(frame) for frame in frames]
+	return values
+
+# Returns (frames, 3, 3) rotation matrices around axis 0, 1 or 2.
+def getAxisRotations(axis, angles):
+	i, j = [(1, 2), (2, 0), (0, 1)][axis]
+	rotations = np.zeros((len(angles), 3, 3))
+	rotations[:, axis, axis] = 1
+	rotations[:, i, i] = np.cos(angles)
+	rotations[:, j, j] = np.cos(angles)
+	rotations[:, i, j] = -np.sin(angles)
+	rotations[:, j, i] = np.sin(angles)
+	return rotations
+
+# Returns (frames, 3, 3) rotation matrices of a pose bone, for any rotation mode.
+def samplePoseBoneRotations(anim, poseBone, frames):
+	rotationMode = poseBone.rotation_mode
+	if rotationMode == 'QUATERNION':
+		quaternions = sampleChannel(anim, poseBone, 'rotation_quaternion', frames)
+		lengths = np.linalg.norm(quaternions, axis = 1)
+		quaternions[lengths == 0] = [1, 0, 0, 0]
+		lengths[lengths == 0] = 1
+		w, x, y, z = (quaternions / lengths[:, np.newaxis]).T
+		return np.stack((
+			np.stack((1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y)), axis = 1),
+			np.stack((2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x)), axis = 1),
+			np.stack((2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y)), axis = 1)),
+			axis = 1)
+	elif rotationMode == 'AXIS_ANGLE':
+		axisAngles = sampleChannel(anim, poseBone, 'rotation_axis_angle', frames)
+		angles = axisAngles[:, 0]
+		axes = axisAngles[:, 1:]
+		lengths = np.linalg.norm(axes, axis = 1)
+		angles[lengths == 0] = 0
+		lengths[lengths == 0] = 1
+		axes = axes / lengths[:, np.newaxis]
+		cross = np.zeros((len(frames), 3, 3))
+		cross[:, 0, 1], cross[:, 0, 2], cross[:, 1, 2] = -axes[:, 2], axes[:, 1], -axes[:, 0]
+		cross[:, 1, 0], cross[:, 2, 0], cross[:, 2, 1] = axes[:, 2], -axes[:, 1], axes[:, 0]
+		return np.eye(3) + np.sin(angles)[:, np.newaxis, np.newaxis] * cross + \
+			(1 - np.cos(angles))[:, np.newaxis, np.newaxis] * (cross @ cross)
+	else:
+		eulers = sampleChannel(anim, poseBone, 'rotation_euler', frames)
+		rotations = np.broadcast_to(np.eye(3), (len(frames), 3, 3))
+		# Axes are applied in the order of the rotation mode, ex. XYZ = Z @ Y @ X
+		for axisName in rotationMode:
+			axis = 'XYZ'.index(axisName)
+			rotations = getAxisRotations(axis, eulers[:, axis]) @ rotations
+		return rotations
+
+# Returns (frames, 4, 4) pose bone matrices relative to the bone's rest pose.
+def samplePoseBoneMatrices(anim, poseBone, frames):
+	matrices = np.zeros((len(frames), 4, 4))
+	scales = sampleChannel(anim, poseBone, 'scale', frames)
+	matrices[:, :3, :3] = samplePoseBoneRotations(anim, poseBone, frames) * \
+		scales[:, np.newaxis, :]
+	# Location is ignored on connected bones.
+	if not poseBone.bone.use_connect:
+		matrices[:, :3, 3] = sampleChannel(anim, poseBone, 'location', frames)
+	matrices[:, 3, 3] = 1
+	return matrices
+
+# Same as saveQuaternionFrame for every frame, 
+# using Blender's matrix to XYZ euler conversion (mat3_normalized_to_eul).
+def saveRotationFrames(frameData, rotations):
+	m = rotations
+	cy = np.hypot(m[:, 0, 0], m[:, 1, 0])
+	euler1 = np.stack((np.arctan2(m[:, 2, 1], m[:, 2, 2]), 
+		np.arctan2(-m[:, 2, 0], cy), np.arctan2(m[:, 1, 0], m[:, 0, 0])), axis = 1)
+	euler2 = np.stack((np.arctan2(-m[:, 2, 1], -m[:, 2, 2]),
+		np.arctan2(-m[:, 2, 0], -cy), np.arctan2(-m[:, 1, 0], -m[:, 0, 0])), axis = 1)
+	gimbalLock = cy <= 16 * np.finfo(np.float32).eps
+	euler1[gimbalLock, 0] = np.arctan2(-m[gimbalLock, 1, 2], m[gimbalLock, 1, 1])
+	euler1[gimbalLock, 2] = 0
+	euler2[gimbalLock] = euler1[gimbalLock]
+	useEuler2 = np.abs(euler1).sum(axis = 1) > np.abs(euler2).sum(axis = 1)
+	eulers = np.where(useEuler2[:, np.newaxis], euler2, euler1)
+
+	values = np.round(np.mod(np.degrees(eulers), 360) / 360 * (2**16 - 1))
+	values = np.minimum(values, 2**16 - 1).astype(np.int64)
+	for i in range(3):
+		frameData[i].frames.extend(values[:, i].tolist())
+
+def sampleAnimationData(anim, armatureObj, animBones, frames, 
+	translationData, armatureFrameData):
+	# Root bone pose, parent pose @ bone offset from parent @ pose bone matrix
+	boneChain = []
+	bone = armatureObj.data.bones[animBones[0]]
+	while bone is not None:
+		boneChain.insert(0, bone)
+		bone = bone.parent
+	rootMatrices = np.broadcast_to(np.eye(4), (len(frames), 4, 4))
+	for bone in boneChain:
+		offset = np.eye(4)
+		if bone.parent is None:
+			offset[:] = np.array(bone.matrix_local)
+		else:
+			offset[:3, :3] = np.array(bone.matrix)
+			offset[:3, 3] = np.array(bone.head) + [0, bone.parent.length, 0]
+		rootMatrices = rootMatrices @ offset @ \
+			samplePoseBoneMatrices(anim, armatureObj.pose.bones[bone.name], frames)
+
+	# Hacky solution to handle Z-up to Y-up conversion
+	# Same as rotating the scaled root location by -90 degrees around X
+	location = rootMatrices[:, :3, 3] * bpy.context.scene.blenderToSM64Scale
+	translations = np.stack((location[:, 0], location[:, 2], -location[:, 1]), axis = 1)
+	translations = np.minimum(np.round(translations), 2**16 - 1).astype(np.int64)
+	for i in range(3):
+		translationData[i].frames.extend(translations[:, i].tolist())
+
+	# Rotation relative to the parent pose and rest pose, 
+	# which is only the pose bone's own rotation.
+	for boneIndex in range(len(animBones)):
+		saveRotationFrames(armatureFrameData[boneIndex], samplePoseBoneRotations(
+			anim, armatureObj.pose.bones[animBones[boneIndex]], frames))
+
 def getNextBone(boneStack, armatureObj):
 	if len(boneStack) == 0:
 		raise PluginError("More bones in animation than on armature.")
@@ -469,7 +876,9 @@ def getNextBone(boneStack, armatureObj):
 	
 	return bone, boneStack
 
-def importAnimationToBlender(romfile, startAddress, armatureObj, segmentData, isDMA):
+# Returns (root translation bone name, [rotation bone names]), 
+# in the order animation data is applied to the armature.
+def getAnimBoneNames(armatureObj):
 	boneStack = findStartBones(armatureObj)
 	startBoneName = boneStack[0]
 	if armatureObj.data.bones[startBoneName].geo_cmd != 'DisplayListWithOffset':
@@ -477,17 +886,37 @@ def importAnimationToBlender(romfile, startAddress, armatureObj, segmentData, is
 		startBoneName = startBone.name
 		boneStack = [startBoneName] + boneStack
 
+	rotationBoneNames = []
+	while len(boneStack) > 0:
+		try:
+			bone, boneStack = getNextBone(boneStack, armatureObj)
+		except PluginError:
+			# No 0x13 bones left
+			break
+		rotationBoneNames.append(bone.name)
+	return startBoneName, rotationBoneNames
+
+# animBoneNames is the result of getAnimBoneNames, 
+# which can be reused when importing multiple animations.
+def importAnimationToBlender(romfile, startAddress, armatureObj, segmentData, isDMA,
+	name = 'sm64_anim', animBoneNames = None):
+	if animBoneNames is None:
+		animBoneNames = getAnimBoneNames(armatureObj)
+	startBoneName, rotationBoneNames = animBoneNames
+
 	animationHeader, armatureFrameData = \
-		readAnimation('sm64_anim', romfile, startAddress, segmentData, isDMA)
+		readAnimation(name, romfile, startAddress, segmentData, isDMA)
 
-	if len(armatureFrameData) > len(armatureObj.data.bones) + 1:
+	if len(armatureFrameData) > len(armatureObj.data.bones) + 1 or \
+		len(armatureFrameData) - 1 > len(rotationBoneNames):
 		raise PluginError('More bones in animation than on armature.')
 
 	#bpy.context.scene.render.fps = 30
 	bpy.context.scene.frame_end = animationHeader.frameInterval[1]
-	anim = bpy.data.actions.new("sm64_anim")
+	anim = bpy.data.actions.new(name)
 
 	isRootTranslation = True
+	boneIndex = 0
 	# boneFrameData = [[x keyframes], [y keyframes], [z keyframes]]
 	# len(armatureFrameData) should be = number of bones
 	# property index = 0,1,2 (aka x,y,z)
@@ -498,23 +927,56 @@ def importAnimationToBlender(romfile, startAddress, armatureObj, segmentData, is
 					data_path = 'pose.bones["' + startBoneName + '"].location',
 					index = propertyIndex,
 					action_group = startBoneName)
-				for frame in range(len(boneFrameData[propertyIndex])):
-					fcurve.keyframe_points.insert(frame, boneFrameData[propertyIndex][frame])
+				setKeyframes(fcurve, boneFrameData[propertyIndex])
 			isRootTranslation = False
 		else:
-			bone, boneStack = getNextBone(boneStack, armatureObj)
+			boneName = rotationBoneNames[boneIndex]
+			boneIndex += 1
 			for propertyIndex in range(3):
 				fcurve = anim.fcurves.new(
-					data_path = 'pose.bones["' + bone.name + '"].rotation_euler', 
+					data_path = 'pose.bones["' + boneName + '"].rotation_euler', 
 					index = propertyIndex,
-					action_group = bone.name)
-				for frame in range(len(boneFrameData[propertyIndex])):
-					fcurve.keyframe_points.insert(frame, boneFrameData[propertyIndex][frame])
+					action_group = boneName)
+				setKeyframes(fcurve, boneFrameData[propertyIndex])
 
 	if armatureObj.animation_data is None:
 		armatureObj.animation_data_create()
 	armatureObj.animation_data.action = anim
+	return anim
+
+# Imports every animation in a DMA table, or the first listCount entries of
+# an animation list, as separate actions named after their table index.
+def importAnimationTableToBlender(romfile, tableAddress, armatureObj, segmentData, 
+	isDMA, listCount):
+	if isDMA:
+		# Animation count, unused address, then (offset from table start, size) per entry
+		count = romfile.readU32(tableAddress)
+		entries = np.frombuffer(romfile.readBytes(tableAddress + 8, count * 8), 
+			dtype = '>u4').reshape((count, 2)).tolist()
+		addresses = [tableAddress + offset if size > 0 else None \
+			for offset, size in entries]
+	else:
+		addresses = [romfile.readSegmentedAddr(tableAddress + 4 * i, segmentData) \
+			if romfile.readU32(tableAddress + 4 * i) != 0 else None \
+			for i in range(listCount)]
+
+	animBoneNames = getAnimBoneNames(armatureObj)
+	anims = []
+	for i in range(len(addresses)):
+		if addresses[i] is not None:
+			anims.append(importAnimationToBlender(romfile, addresses[i], armatureObj,
+				segmentData, isDMA, 'sm64_anim_' + str(i), animBoneNames))
+	return anims
 		
+# Adds a keyframe per value at frames 0, 1, 2..., like keyframe_points.insert would.
+def setKeyframes(fcurve, values):
+	keyframes = np.empty((len(values), 2), dtype = np.float32)
+	keyframes[:, 0] = np.arange(len(values))
+	keyframes[:, 1] = values
+	fcurve.keyframe_points.add(len(values))
+	fcurve.keyframe_points.foreach_set('co', keyframes.reshape(-1))
+	fcurve.update()
+
 def readAnimation(name, romfile, startAddress, segmentData, isDMA):
 	animationHeader = readAnimHeader(name, romfile, startAddress, segmentData, isDMA)
 	
@@ -523,6 +985,8 @@ def readAnimation(name, romfile, startAddress, segmentData, isDMA):
 	animationHeader.transformIndices = readAnimIndices(
 		romfile, animationHeader.transformIndicesStart, animationHeader.nodeCount)
 
+	values = readAnimValues(romfile, animationHeader.transformValuesStart, 
+		animationHeader.transformIndices)
 	armatureFrameData = [] #list of list of frames
 
 	# sm64 space -> blender space -> pose space
@@ -533,9 +997,9 @@ def readAnimation(name, romfile, startAddress, segmentData, isDMA):
 	# handle root translation
 	boneFrameData = [[],[],[]]
 	rootIndexNode = animationHeader.transformIndices[0]
-	boneFrameData[0] = [n for n in getKeyFramesTranslation(romfile, animationHeader.transformValuesStart, rootIndexNode.x)]
-	boneFrameData[1] = [n for n in getKeyFramesTranslation(romfile, animationHeader.transformValuesStart, rootIndexNode.y)]
-	boneFrameData[2] = [n for n in getKeyFramesTranslation(romfile, animationHeader.transformValuesStart, rootIndexNode.z)]
+	boneFrameData[0] = getKeyFramesTranslation(values, rootIndexNode.x)
+	boneFrameData[1] = getKeyFramesTranslation(values, rootIndexNode.y)
+	boneFrameData[2] = getKeyFramesTranslation(values, rootIndexNode.z)
 	armatureFrameData.append(boneFrameData)
 
 	# handle rotations
@@ -543,111 +1007,70 @@ def readAnimation(name, romfile, startAddress, segmentData, isDMA):
 		boneFrameData = [[],[],[]]
 
 		# Transforming SM64 space to Blender space
-		boneFrameData[0] = [n for n in \
-			getKeyFramesRotation(romfile, animationHeader.transformValuesStart, boneIndexNode.x)]
-		boneFrameData[1] = [n for n in \
-			getKeyFramesRotation(romfile, animationHeader.transformValuesStart, boneIndexNode.y)]
-		boneFrameData[2] = [n for n in \
-			getKeyFramesRotation(romfile, animationHeader.transformValuesStart, boneIndexNode.z)]
+		boneFrameData[0] = getKeyFramesRotation(values, boneIndexNode.x)
+		boneFrameData[1] = getKeyFramesRotation(values, boneIndexNode.y)
+		boneFrameData[2] = getKeyFramesRotation(values, boneIndexNode.z)
 
 		armatureFrameData.append(boneFrameData)
 
 	return (animationHeader, armatureFrameData)
 
-def getKeyFramesRotation(romfile, transformValuesStart, boneIndex):
-	ptrToValue = transformValuesStart + boneIndex.startOffset
-	romfile.seek(ptrToValue)
-
-	keyframes = []
-	for frame in range(boneIndex.numFrames):
-		romfile.seek(ptrToValue + frame * 2)
-		value = int.from_bytes(romfile.read(2), 'big') * 360 / (2**16)
-		keyframes.append(math.radians(value))
-
-	return keyframes
-
-def getKeyFramesTranslation(romfile, transformValuesStart, boneIndex):
-	ptrToValue = transformValuesStart + boneIndex.startOffset
-	romfile.seek(ptrToValue)
-
-	keyframes = []
-	for frame in range(boneIndex.numFrames):
-		romfile.seek(ptrToValue + frame * 2)
-		keyframes.append(int.from_bytes(romfile.read(2), 'big', signed = True) /\
-			bpy.context.scene.blenderToSM64Scale)
-
-	return keyframes
+# Reads the whole transform values table as signed shorts.
+# The table ends at the last value used by any of the indices.
+def readAnimValues(romfile, transformValuesStart, transformIndices):
+	valueCount = 0
+	for indexNode in transformIndices:
+		for boneIndex in [indexNode.x, indexNode.y, indexNode.z]:
+			valueCount = max(valueCount, boneIndex.startOffset // 2 + boneIndex.numFrames)
+	return np.frombuffer(romfile.readBytes(transformValuesStart, valueCount * 2), dtype = '>i2')
+
+def getKeyFramesRotation(values, boneIndex):
+	start = boneIndex.startOffset // 2
+	angles = values[start : start + boneIndex.numFrames].view('>u2').astype(np.float64)
+	return np.radians(angles * 360 / (2**16))
+
+def getKeyFramesTranslation(values, boneIndex):
+	start = boneIndex.startOffset // 2
+	return values[start : start + boneIndex.numFrames].astype(np.float64) / \
+		bpy.context.scene.blenderToSM64Scale
 
 def readAnimHeader(name, romfile, startAddress, segmentData, isDMA):
 	frameInterval = [0,0]
 
-	romfile.seek(startAddress + 0x00)
-	numRepeats = int.from_bytes(romfile.read(2), 'big')
-
-	romfile.seek(startAddress + 0x02)
-	marioYOffset = int.from_bytes(romfile.read(2), 'big')
-
-	romfile.seek(startAddress + 0x06)
-	frameInterval[0] = int.from_bytes(romfile.read(2), 'big')
+	numRepeats = romfile.readU16(startAddress + 0x00)
+	marioYOffset = romfile.readU16(startAddress + 0x02)
+	frameInterval[0] = romfile.readU16(startAddress + 0x06)
+	frameInterval[1] = romfile.readU16(startAddress + 0x08)
+	numNodes = romfile.readU16(startAddress + 0x0A)
 
-	romfile.seek(startAddress + 0x08)
-	frameInterval[1] = int.from_bytes(romfile.read(2), 'big')
-
-	romfile.seek(startAddress + 0x0A)
-	numNodes = int.from_bytes(romfile.read(2), 'big')
-
-	romfile.seek(startAddress + 0x0C)
-	transformValuesOffset = int.from_bytes(romfile.read(4), 'big')
+	transformValuesOffset = romfile.readU32(startAddress + 0x0C)
 	if isDMA:	
 		transformValuesStart = startAddress + transformValuesOffset
 	else:
 		transformValuesStart = decodeSegmentedAddr(
 			transformValuesOffset.to_bytes(4, byteorder='big'), segmentData)
 
-	romfile.seek(startAddress + 0x10)
-	transformIndicesOffset = int.from_bytes(romfile.read(4), 'big')
+	transformIndicesOffset = romfile.readU32(startAddress + 0x10)
 	if isDMA:
 		transformIndicesStart = startAddress + transformIndicesOffset
 	else:
 		transformIndicesStart = decodeSegmentedAddr(
 			transformIndicesOffset.to_bytes(4, byteorder='big'), segmentData)
 
-	romfile.seek(startAddress + 0x14)
-	animSize = int.from_bytes(romfile.read(4), 'big')
+	animSize = romfile.readU32(startAddress + 0x14)
 
 	return SM64_AnimationHeader(name, numRepeats, marioYOffset, frameInterval, numNodes, 
 		transformValuesStart, transformIndicesStart, animSize)
 
 def readAnimIndices(romfile, ptrAddress, nodeCount):
-	indices = []
-
-	# Handle root transform
-	rootPosIndex = readTransformIndex(romfile, ptrAddress)
-	indices.append(rootPosIndex)
-
-	# Handle rotations
-	for i in range(nodeCount):
-		rotationIndex = readTransformIndex(romfile, ptrAddress + (i+1) * 12)
-		indices.append(rotationIndex)
-
-	return indices
-
-def readTransformIndex(romfile, startAddress):
-	x = readValueIndex(romfile, startAddress + 0)
-	y = readValueIndex(romfile, startAddress + 4)
-	z = readValueIndex(romfile, startAddress + 8)
-
-	return SM64_AnimIndexNode(x, y, z)
-
-def readValueIndex(romfile, startAddress):
-	romfile.seek(startAddress)
-	numFrames = int.from_bytes(romfile.read(2), 'big')
-	romfile.seek(startAddress + 2)
-
-	# multiply 2 because value is the index in array of shorts (???)
-	startOffset = int.from_bytes(romfile.read(2), 'big') * 2
-	print(str(hex(startAddress)) + ": " + str(numFrames) + " " + str(startOffset))
-	return SM64_AnimIndex(numFrames, startOffset)
+	# Root translation, then a rotation per node.
+	# Each is x, y, z (frame count, value index) pairs.
+	table = np.frombuffer(romfile.readBytes(ptrAddress, (nodeCount + 1) * 12), 
+		dtype = '>u2').reshape((nodeCount + 1, 3, 2)).tolist()
+
+	# multiply 2 because value is the index in array of shorts
+	return [SM64_AnimIndexNode(*[SM64_AnimIndex(numFrames, valueIndex * 2) \
+		for numFrames, valueIndex in transformIndex]) for transformIndex in table]
 
 def writeAnimation(romfile, startAddress, segmentData):
 	pass
@@ -4,8 +4,10 @@ from .sm64_objects import *
 from bpy.utils import register_class, unregister_class
 import bpy, bmesh
 import os
+import io
 from io import BytesIO
 import math
+import numpy as np
 
 class CollisionVertex:
 	def __init__(self, position):
@@ -20,6 +22,9 @@ class CollisionVertex:
 			data.extend(int(round(field)).to_bytes(2, 'big', signed = True))
 		return data
 	
+	def size(self):
+		return 2 * len(self.position)
+
 	def to_c(self):
 		return 'COL_VERTEX(' + \
 			str(int(round(self.position[0]))) + ', ' + \
@@ -42,6 +47,9 @@ class CollisionTriangle:
 		if self.specialParam is not None:
 			data.extend(int(self.specialParam, 16).to_bytes(2, 'big', signed=False))
 		return data
+
+	def size(self):
+		return 2 * len(self.indices) + (2 if self.specialParam is not None else 0)
 	
 	def to_c(self):
 		if self.specialParam is None:
@@ -69,58 +77,67 @@ class Collision:
 	def set_addr(self, startAddress):
 		startAddress = get64bitAlignedAddr(startAddress)
 		self.startAddress = startAddress
+		size = self.size()
 		print('Collision ' + self.name + ': ' + str(startAddress) + \
-			', ' + str(self.size()))
-		return startAddress, startAddress + self.size()
+			', ' + str(size))
+		return startAddress, startAddress + size
 	
 	def save_binary(self, romfile):
 		romfile.seek(self.startAddress)
 		romfile.write(self.to_binary())
 
+	# Same as len(self.to_binary()), without encoding the collision.
 	def size(self):
-		return len(self.to_binary())
+		size = 4 + sum([vertex.size() for vertex in self.vertices])
+		for collisionType, triangles in self.triangles.items():
+			size += 4 + sum([triangle.size() for triangle in triangles])
+		size += 2
+		if len(self.specials) > 0:
+			size += 4 + sum([len(special.to_binary()) for special in self.specials])
+		if len(self.water_boxes) > 0:
+			size += 4 + sum([len(waterBox.to_binary()) for waterBox in self.water_boxes])
+		return size + 2
 
 	def to_c_def(self):
 		return 'extern const Collision ' + self.name + '[];\n'
 
 	def to_c(self):
-		data = 'const Collision ' + self.name + '[] = {\n'
-		data += '\tCOL_INIT(),\n'
-		data += '\tCOL_VERTEX_INIT(' + str(len(self.vertices)) + '),\n'
-		for vertex in self.vertices:
-			data += '\t' + vertex.to_c()
+		out = io.StringIO()
+		self.write_c(out)
+		return out.getvalue()
+
+	def write_c(self, out):
+		formatItem = lambda item: '\t' + item.to_c()
+		out.write('const Collision ' + self.name + '[] = {\n')
+		out.write('\tCOL_INIT(),\n')
+		out.write('\tCOL_VERTEX_INIT(' + str(len(self.vertices)) + '),\n')
+		writeCLines(out, self.vertices, formatItem)
 		for collisionType, triangles in self.triangles.items():
-			data += '\tCOL_TRI_INIT(' + collisionType + ', ' +\
-				str(len(triangles)) + '),\n'
-			for triangle in triangles:
-				data += '\t' + triangle.to_c()
-		data += '\tCOL_TRI_STOP(),\n'
+			out.write('\tCOL_TRI_INIT(' + collisionType + ', ' +\
+				str(len(triangles)) + '),\n')
+			writeCLines(out, triangles, formatItem)
+		out.write('\tCOL_TRI_STOP(),\n')
 		if len(self.specials) > 0:
-			data += '\tCOL_SPECIAL_INIT(' + str(len(self.specials)) + '),\n'
-			for special in self.specials:
-				data += '\t' + special.to_c()
+			out.write('\tCOL_SPECIAL_INIT(' + str(len(self.specials)) + '),\n')
+			writeCLines(out, self.specials, formatItem)
 		if len(self.water_boxes) > 0:
-			data += '\tCOL_WATER_BOX_INIT(' + str(len(self.water_boxes)) + '),\n'
-			for waterBox in self.water_boxes:
-				data += '\t' + waterBox.to_c()
-		data += '\tCOL_END()\n' + '};\n'
-		return data
+			out.write('\tCOL_WATER_BOX_INIT(' + str(len(self.water_boxes)) + '),\n')
+			writeCLines(out, self.water_boxes, formatItem)
+		out.write('\tCOL_END()\n' + '};\n')
 	
 	def rooms_name(self):
 		return self.name + '_rooms'
 
 	def to_c_rooms(self):
-		data = 'const u8 ' + self.rooms_name() + '[] = {\n\t'
-		newlineCount = 0
-		for collisionType, triangles, in self.triangles.items():
-			for triangle in triangles:
-				data += str(triangle.room) + ', '
-				newlineCount += 1
-				if newlineCount >= 8:
-					newlineCount = 0
-					data += '\n\t'
-		data += '\n};\n'
-		return data
+		out = io.StringIO()
+		self.write_c_rooms(out)
+		return out.getvalue()
+
+	def write_c_rooms(self, out):
+		out.write('const u8 ' + self.rooms_name() + '[] = {\n\t')
+		rooms = [triangle.room for collisionType, triangles in self.triangles.items() for triangle in triangles]
+		writeCValueArray(out, rooms, lambda room: str(room) + ', ', 8)
+		out.write('\n};\n')
 
 	def to_c_rooms_def(self):
 		return 'extern const u8 ' + self.rooms_name() + '[];\n'
@@ -259,7 +276,7 @@ def exportCollisionC(obj, transformMatrix, dirPath, includeSpecials,
 	fileObj = open(colPath, 'w', newline='\n')
 	collision = exportCollisionCommon(obj, transformMatrix, includeSpecials,
 		includeChildren, name, None)
-	fileObj.write(collision.to_c())
+	collision.write_c(fileObj)
 	fileObj.close()
 
 	cDefine = collision.to_c_def()
@@ -267,7 +284,7 @@ def exportCollisionC(obj, transformMatrix, dirPath, includeSpecials,
 		cDefine += collision.to_c_rooms_def()
 		roomsPath = os.path.join(colDirPath, 'rooms.inc.c')
 		roomsFile = open(roomsPath, 'w', newline='\n')
-		roomsFile.write(collision.to_c_rooms())
+		collision.write_c_rooms(roomsFile)
 		roomsFile.close()
 
 	headerPath = os.path.join(colDirPath, 'collision_header.h')
@@ -325,38 +342,31 @@ def exportCollisionInsertableBinary(obj, transformMatrix, filepath,
 
 def exportCollisionCommon(obj, transformMatrix, includeSpecials, includeChildren, 
 	name, areaIndex):
-	bpy.ops.object.select_all(action = 'DESELECT')
-	obj.select_set(True)
-
 	# dict of collisionType : faces
 	collisionDict = {}
-	#addCollisionTriangles(obj, collisionDict, includeChildren, transformMatrix, areaIndex)
-	tempObj, allObjs = \
-		duplicateHierarchy(obj, None, True, areaIndex)
-	try:
-		addCollisionTriangles(tempObj, collisionDict, includeChildren, transformMatrix, areaIndex)
-		cleanupDuplicatedObjects(allObjs)
-		obj.select_set(True)
-		bpy.context.view_layer.objects.active = obj
-	except Exception as e:
-		cleanupDuplicatedObjects(allObjs)
-		obj.select_set(True)
-		bpy.context.view_layer.objects.active = obj
-		raise Exception(str(e))
+	# Evaluated meshes and matrices give the same result as duplicating the
+	# hierarchy and applying its transforms / modifiers, mostly without modifying the scene.
+	depsgraph = bpy.context.evaluated_depsgraph_get()
+	addCollisionTriangles(obj, collisionDict, includeChildren, 
+		transformMatrix @ getAppliedRotationScale(obj), areaIndex, depsgraph)
 
 	collision = Collision(toAlnum(name) + '_collision')
-	for collisionType, faces in collisionDict.items():
+	# dict of rounded position : vertex index
+	vertIndices = {}
+	for collisionType, faceGroups in collisionDict.items():
 		collision.triangles[collisionType] = []
-		for (faceVerts, specialParam, room) in faces:
-			indices = []
-			for roundedPosition in faceVerts:
-				index = collisionVertIndex(roundedPosition, collision.vertices)
-				if index is None:
-					collision.vertices.append(CollisionVertex(roundedPosition))
-					indices.append(len(collision.vertices) - 1)
-				else:
+		for (faceVerts, specialParams, room) in faceGroups:
+			for roundedPositions, specialParam in zip(faceVerts.tolist(), specialParams):
+				indices = []
+				for roundedPosition in roundedPositions:
+					roundedPosition = tuple(roundedPosition)
+					index = vertIndices.get(roundedPosition)
+					if index is None:
+						index = len(collision.vertices)
+						vertIndices[roundedPosition] = index
+						collision.vertices.append(CollisionVertex(roundedPosition))
 					indices.append(index)
-			collision.triangles[collisionType].append(CollisionTriangle(indices, specialParam, room))
+				collision.triangles[collisionType].append(CollisionTriangle(indices, specialParam, room))
 	if includeSpecials:
 		area = SM64_Area(areaIndex, '', '', '', None, None, [], name, None)
 		# This assumes that only levels will export with included specials,
@@ -367,55 +377,75 @@ def exportCollisionCommon(obj, transformMatrix, includeSpecials, includeChildren
 
 	return collision
 
-def addCollisionTriangles(obj, collisionDict, includeChildren, transformMatrix, areaIndex):
+# collisionDict is a dict of collision type : list of 
+# (face vertex positions array, list of special params, room).
+# Faces keep the order of the mesh triangles, and the collision 
+# types the order in which they are first used.
+def addCollisionTriangles(obj, collisionDict, includeChildren, transformMatrix, areaIndex, depsgraph):
 	if isinstance(obj.data, bpy.types.Mesh) and not obj.ignore_collision:
 		if len(obj.data.materials) == 0:
 			raise PluginError(obj.name + " must have a material associated with it.")
-		obj.data.calc_loop_triangles()
-		for face in obj.data.loop_triangles:
-			material = obj.data.materials[face.material_index]
-			colType = material.collision_type if material.collision_all_options\
-				else material.collision_type_simple
-			if colType == 'Custom':
-				colType = material.collision_custom
-			specialParam = material.collision_param if material.use_collision_param else None
-
-			(x1, y1, z1) = roundPosition(transformMatrix @ obj.data.vertices[face.vertices[0]].co)
-			(x2, y2, z2) = roundPosition(transformMatrix @ obj.data.vertices[face.vertices[1]].co)
-			(x3, y3, z3) = roundPosition(transformMatrix @ obj.data.vertices[face.vertices[2]].co)
-
-			nx = (y2 - y1) * (z3 - z2) - (z2 - z1) * (y3 - y2)
-			ny = (z2 - z1) * (x3 - x2) - (x2 - x1) * (z3 - z2)
-			nz = (x2 - x1) * (y3 - y2) - (y2 - y1) * (x3 - x2)
-			magSqr = nx * nx + ny * ny + nz * nz
-
-			if magSqr <= 0:
-				print("Ignore denormalized triangle.")
-				continue
-
-			if colType not in collisionDict:
-				collisionDict[colType] = []
-			collisionDict[colType].append(((
-				(x1, y1, z1),
-				(x2, y2, z2),
-				(x3, y3, z3)), specialParam, obj.room_num))
+		processAppliedMesh(obj, depsgraph, transformMatrix, lambda mesh, meshMatrix: 
+			addMeshCollisionTriangles(obj, mesh, collisionDict, meshMatrix))
 	
 	if includeChildren:
-		for child in obj.children:
-			addCollisionTriangles(child, collisionDict, includeChildren, transformMatrix @ child.matrix_local, areaIndex)
-
+		for child in getHierarchyExportChildren(obj, True, areaIndex):
+			addCollisionTriangles(child, collisionDict, includeChildren, 
+				transformMatrix @ child.matrix_local, areaIndex, depsgraph)
+
+def addMeshCollisionTriangles(obj, mesh, collisionDict, transformMatrix):
+	mesh.calc_loop_triangles()
+	triCount = len(mesh.loop_triangles)
+
+	vertCount = len(mesh.vertices)
+	coords = np.empty(vertCount * 3, dtype = np.float32)
+	mesh.vertices.foreach_get('co', coords)
+	positions = roundPositionArray(
+		transformVectors(transformMatrix, coords.reshape((vertCount, 3)))[:, :3])
+	triVerts = np.empty(triCount * 3, dtype = np.int32)
+	mesh.loop_triangles.foreach_get('vertices', triVerts)
+	faceVerts = positions[triVerts].reshape((triCount, 3, 3))
+	triMaterials = np.empty(triCount, dtype = np.int32)
+	mesh.loop_triangles.foreach_get('material_index', triMaterials)
+
+	normals = np.cross(faceVerts[:, 1] - faceVerts[:, 0], faceVerts[:, 2] - faceVerts[:, 1])
+	validFaces = np.nonzero(np.any(normals != 0, axis = 1))[0]
+	if len(validFaces) < triCount:
+		print("Ignore " + str(triCount - len(validFaces)) + " denormalized triangles.")
+
+	# dict of material index : (collision type, special param)
+	materialSettings = {}
+	for materialIndex in np.unique(triMaterials[validFaces]).tolist():
+		material = mesh.materials[materialIndex]
+		colType = material.collision_type if material.collision_all_options\
+			else material.collision_type_simple
+		if colType == 'Custom':
+			colType = material.collision_custom
+		specialParam = material.collision_param if material.use_collision_param else None
+		materialSettings[materialIndex] = (colType, specialParam)
+
+	# dict of collision type : (face indices, special params)
+	faceGroups = {}
+	for faceIndex, materialIndex in zip(validFaces.tolist(), triMaterials[validFaces].tolist()):
+		colType, specialParam = materialSettings[materialIndex]
+		if colType not in faceGroups:
+			faceGroups[colType] = ([], [])
+		faceGroups[colType][0].append(faceIndex)
+		faceGroups[colType][1].append(specialParam)
+
+	for colType, (faceIndices, specialParams) in faceGroups.items():
+		if colType not in collisionDict:
+			collisionDict[colType] = []
+		collisionDict[colType].append((faceVerts[faceIndices], specialParams, obj.room_num))
 
 def roundPosition(position):
 	return (int(round(position[0])),
 		int(round(position[1])),
 		int(round(position[2])))
 
-def collisionVertIndex(vert, vertArray):
-	for i in range(len(vertArray)):
-		colVert = vertArray[i]
-		if colVert.position == vert:
-			return i
-	return None
+# Same as roundPosition for each row. Both round half to even.
+def roundPositionArray(positions):
+	return np.round(positions.astype(np.float64)).astype(np.int64)
 
 class CollisionSettings:
 	def __init__(self):
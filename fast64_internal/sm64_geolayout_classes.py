@@ -103,11 +103,11 @@ class GeolayoutGraph:
 			self.startGeolayout, [self.startGeolayout])
 		self.sortedListGenerated = True
 
+	# Lays out all geolayouts in one pass, returns the end address.
 	def set_addr(self, address):
 		self.checkListSorted()
 		for geolayout in self.sortedList:
-			geolayout.startAddress = address
-			address += geolayout.size()
+			address = geolayout.set_addr(address)
 			print(geolayout.name + " - " + \
 				str(geolayout.startAddress))
 		return address
@@ -163,20 +163,36 @@ class Geolayout:
 		self.name = toAlnum(name)
 		self.startAddress = 0
 		self.isStartGeo = isStartGeo
+		# (size, pointer offsets), set by set_addr once the nodes are final.
+		self.layout = None
+
+	def set_addr(self, address):
+		self.startAddress = address
+		self.layout = None
+		size = self.size()
+		self.layout = (size, self.get_ptr_offsets())
+		return address + size
 	
 	def size(self):
+		if self.layout is not None:
+			return self.layout[0]
 		size = 4 # end command
 		for node in self.nodes:
 			size += node.size()
 		return size
-	
-	def get_ptr_addresses(self):
-		address = self.startAddress
-		addresses = []
+
+	def get_ptr_offsets(self):
+		if self.layout is not None:
+			return self.layout[1]
+		address = 0
+		offsets = []
 		for node in self.nodes:
 			address, ptrs = node.get_ptr_addresses(address)
-			addresses.extend(ptrs)
-		return addresses
+			offsets.extend(ptrs)
+		return offsets
+	
+	def get_ptr_addresses(self):
+		return [self.startAddress + offset for offset in self.get_ptr_offsets()]
 
 	def to_binary(self, segmentData):
 		endCmd = GEO_END if self.isStartGeo else GEO_RETURN
@@ -129,8 +129,7 @@ def parseNode(romfile, geoStartAddress, currentAddress, currentCmd, jumps,
 	currentTransform = copy.deepcopy(currentTransform)
 	originalTransform = copy.deepcopy(currentTransform)
 	currentAddress += getGeoLayoutCmdLength(*currentCmd)
-	romfile.seek(currentAddress)
-	currentCmd = romfile.read(2)
+	currentCmd = romfile.readBytes(currentAddress, 2)
 	armatureMeshGroups = []
 
 	# True if at least one complete node processed.
@@ -306,9 +305,8 @@ def parseNode(romfile, geoStartAddress, currentAddress, currentCmd, jumps,
 		
 		nodeIndex[-1] += 1
 
-		romfile.seek(currentAddress)
 		previousCmdType = currentCmd[0]
-		currentCmd = romfile.read(2)
+		currentCmd = romfile.readBytes(currentAddress, 2)
 
 		if previousCmdType not in nodeGroupCmds or \
 			currentCmd[0] != GEO_NODE_OPEN:
@@ -584,8 +582,7 @@ def parseSwitch(romfile, currentAddress, currentTransform,
 	commandSize = 8
 
 	if not ignoreNode:
-		romfile.seek(currentAddress)
-		command = romfile.read(commandSize)
+		command = romfile.readBytes(currentAddress, commandSize)
 		funcParam = int.from_bytes(command[2:4], 'big', signed = True)
 		switchFunc = bytesToHexClean(command[4:8])
 
@@ -607,9 +604,8 @@ def parseDL(romfile, currentAddress, currentTransform, bMesh, obj, armatureObj,
 
 	drawLayer = bitMask(currentCmd[1], 0, 4)
 
-	romfile.seek(currentAddress)
 	commandSize = 8
-	command = romfile.read(commandSize)
+	command = romfile.readBytes(currentAddress, commandSize)
 
 	if not ignoreNode:
 		boneName = handleNodeCommon(romfile, armatureObj, parentBoneName,
@@ -627,9 +623,7 @@ def parseDLWithOffset(romfile, currentAddress,
 	currentTransform, bMesh, obj, armatureObj, parentBoneName, ignoreNode, nodeIndex, currentCmd, segmentData, vertexBuffer,
 	f3dType, isHWv1):
 	print("DL_OFFSET " + hex(currentAddress))
-	romfile.seek(currentAddress)
-
-	command = romfile.read(getGeoLayoutCmdLength(*currentCmd))
+	command = romfile.readBytes(currentAddress, getGeoLayoutCmdLength(*currentCmd))
 
 	drawLayer = command[1]
 
@@ -668,17 +662,15 @@ def parseDLWithOffset(romfile, currentAddress,
 	# Handle child objects
 	# Validate that next command is 04 (open node)
 	currentAddress += getGeoLayoutCmdLength(*currentCmd)
-	romfile.seek(currentAddress) # DONT FORGET THIS, FIXES PARENTING BUG
-	currentCmd = romfile.read(2)
+	currentCmd = romfile.readBytes(currentAddress, 2)
 
 	return currentAddress, boneName, finalTransform
 
 def parseBranch(romfile, currentCmd, currentAddress, jumps,
 	segmentData = None):
 	print("BRANCH " + hex(currentAddress))
-	romfile.seek(currentAddress)
 	postJumpAddr = currentAddress + getGeoLayoutCmdLength(*currentCmd)
-	currentCmd = romfile.read(getGeoLayoutCmdLength(*currentCmd))
+	currentCmd = romfile.readBytes(currentAddress, getGeoLayoutCmdLength(*currentCmd))
 
 	if currentCmd[1] == 1:
 		jumps.append(postJumpAddr)
@@ -690,9 +682,8 @@ def parseBranch(romfile, currentCmd, currentAddress, jumps,
 def parseBranchStore(romfile, currentCmd, currentAddress, jumps,
 	segmentData = None):
 	print("BRANCH AND STORE " + hex(currentAddress))
-	romfile.seek(currentAddress)
 	postJumpAddr = currentAddress + getGeoLayoutCmdLength(*currentCmd)
-	currentCmd = romfile.read(getGeoLayoutCmdLength(*currentCmd))
+	currentCmd = romfile.readBytes(currentAddress, getGeoLayoutCmdLength(*currentCmd))
 
 	jumps.append(postJumpAddr)
 	currentAddress = decodeSegmentedAddr(currentCmd[4:8],
@@ -737,9 +728,8 @@ def parseScale(romfile, currentAddress, currentCmd, currentTransform,
 	loadDL = bitMask(currentCmd[1], 7, 1)
 	drawLayer = bitMask(currentCmd[1], 0, 4)
 
-	romfile.seek(currentAddress)
 	commandSize = 8 + (4 if loadDL else 0)
-	command = romfile.read(commandSize)
+	command = romfile.readBytes(currentAddress, commandSize)
 
 	scale = int.from_bytes(command[4:8], 'big') / 0x10000
 	#finalTransform = currentTransform @ mathutils.Matrix.Scale(scale, 4)
@@ -778,8 +768,7 @@ def parseTranslateRotate(romfile, currentAddress,
 	if loadDL:
 		commandSize += 4
 
-	romfile.seek(currentAddress)
-	command = romfile.read(commandSize)
+	command = romfile.readBytes(currentAddress, commandSize)
 
 	if fieldLayout == 0:
 		pos = readVectorFromShorts(command, 4)
@@ -840,8 +829,7 @@ def parseTranslate(romfile, currentAddress,
 	else:
 		commandSize = 8
 
-	romfile.seek(currentAddress)
-	command = romfile.read(commandSize)
+	command = romfile.readBytes(currentAddress, commandSize)
 
 	pos = readVectorFromShorts(command, 2)
 	translation = mathutils.Matrix.Translation(
@@ -876,8 +864,7 @@ def parseRotate(romfile, currentAddress,
 	else:
 		commandSize = 8
 
-	romfile.seek(currentAddress)
-	command = romfile.read(commandSize)
+	command = romfile.readBytes(currentAddress, commandSize)
 
 	rot = readEulerVectorFromShorts(command, 2)
 	rotation = mathutils.Euler(rot, geoNodeRotateOrder).to_matrix().to_4x4()
@@ -910,8 +897,7 @@ def parseBillboard(romfile, currentAddress,
 	else:
 		commandSize = 8
 
-	romfile.seek(currentAddress)
-	command = romfile.read(commandSize)
+	command = romfile.readBytes(currentAddress, commandSize)
 
 	pos = readVectorFromShorts(command, 2)
 	translation = mathutils.Matrix.Translation(
@@ -939,8 +925,7 @@ def parseShadow(romfile, currentAddress, currentTransform,
 	print("SHADOW " + hex(currentAddress))
 	commandSize = 8
 
-	romfile.seek(currentAddress)
-	command = romfile.read(commandSize)
+	command = romfile.readBytes(currentAddress, commandSize)
 	shadowType = int.from_bytes(command[2:4], 'big')
 	if str(shadowType) not in enumShadowType:
 		if shadowType > 12 and shadowType < 50: # Square Shadow
@@ -992,8 +977,7 @@ def parseStartWithRenderArea(romfile, currentAddress, currentTransform,
 	print("START W/ RENDER AREA" + hex(currentAddress))
 	
 	commandSize = 4
-	romfile.seek(currentAddress)
-	command = romfile.read(commandSize)
+	command = romfile.readBytes(currentAddress, commandSize)
 	cullingRadius = int.from_bytes(command[2:4], 'big') / bpy.context.scene.blenderToSM64Scale
 
 	if not ignoreNode:
@@ -1017,8 +1001,7 @@ def parseFunction(romfile, currentAddress, currentTransform,
 
 	commandSize = 8
 
-	romfile.seek(currentAddress)
-	command = romfile.read(commandSize)
+	command = romfile.readBytes(currentAddress, commandSize)
 	asmParam = int.from_bytes(command[2:4], 'big', signed = True)
 	asmFunc = bytesToHexClean(command[4:8])
 
@@ -1037,8 +1020,7 @@ def parseHeldObject(romfile, currentAddress, currentTransform,
 	armatureObj, parentBoneName, ignoreNode, nodeIndex, segmentData):
 	print("HELD OBJECT " + hex(currentAddress))
 	commandSize = 12
-	romfile.seek(currentAddress)
-	command = romfile.read(commandSize)
+	command = romfile.readBytes(currentAddress, commandSize)
 
 	pos = readVectorFromShorts(command, 2)
 	translation = mathutils.Matrix.Translation(
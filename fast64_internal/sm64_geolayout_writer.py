@@ -5,6 +5,7 @@ import copy
 
 from os.path import basename
 import os
+import io
 from io import BytesIO
 
 from .sm64_geolayout_bone import getSwitchOptionBone
@@ -213,6 +214,7 @@ def convertArmatureToGeolayout(armatureObj, obj, convertTransformMatrix,
 			[], name, meshGeolayout, geolayoutGraph, infoDict, convertTextureData)
 	generateSwitchOptions(meshGeolayout.nodes[0], meshGeolayout, geolayoutGraph,
 		name)
+	optimizeModelDrawLists(fModel)
 	appendRevertToGeolayout(geolayoutGraph, fModel)
 	geolayoutGraph.generateSortedList()
 	if DLFormat == 'SM64 Function Node':
@@ -249,6 +251,9 @@ def convertObjectToGeolayout(obj, convertTransformMatrix,
 		meshGeolayout = geolayoutGraph.startGeolayout
 		rootObj = obj
 
+	# Level areas share one fModel, so only this call's mesh groups are optimized.
+	existingMeshGroups = set(fModel.meshGroups)
+
 	# Duplicate objects to apply scale / modifiers / linked data
 	tempObj, allObjs = \
 		duplicateHierarchy(rootObj, 'ignore_render', True, None if areaObj is None else areaObj.areaIndex)
@@ -265,6 +270,8 @@ def convertObjectToGeolayout(obj, convertTransformMatrix,
 		bpy.context.view_layer.objects.active = rootObj
 		raise Exception(str(e))
 
+	optimizeModelDrawLists(fModel, 
+		[groupName for groupName in fModel.meshGroups if groupName not in existingMeshGroups])
 	appendRevertToGeolayout(geolayoutGraph, fModel)
 	geolayoutGraph.generateSortedList()
 	if DLFormat == "SM64 Function Node":
@@ -306,7 +313,6 @@ def saveGeolayoutC(geoName, dirName, geolayoutGraph, fModel, exportDir, texDir,
 		scrollName = 'actor_geo_' + dirName
 	elif headerType == 'Level':
 		scrollName = levelName + '_level_geo_' + dirName
-	static_data, dynamic_data, texC, scroll_data = fModel.to_c(texSeparate, savePNG, texDir, scrollName)
 	cDefineStatic, cDefineDynamic, cDefineScroll, hasScrolling = fModel.to_c_def(scrollName)
 	geolayoutGraph.startGeolayout.name = geoName
 
@@ -351,27 +357,30 @@ def saveGeolayoutC(geoName, dirName, geolayoutGraph, fModel, exportDir, texDir,
 		matHInclude = '#include "levels/' + levelName + '/' + dirName + '/material.inc.h"'
 		headerInclude = '#include "levels/' + levelName + '/' + dirName + '/geo_header.h"'
 	
+	# Static data is streamed straight to model.inc.c
+	modelPath = os.path.join(geoDirPath, 'model.inc.c')
+	modelFile = open(modelPath, 'w', newline='\n')
+	texFile = open(os.path.join(geoDirPath, 'texture.inc.c'), 'w', newline='\n') if texSeparate else None
+	dynamicOut = io.StringIO()
+	try:
+		scroll_data = fModel.write_c(modelFile, dynamicOut, texFile, savePNG, texDir, scrollName)
+		dynamic_data = dynamicOut.getvalue()
+		if DLFormat == "Static":
+			modelFile.write('\n' + dynamic_data)
+	finally:
+		modelFile.close()
+		if texFile is not None:
+			texFile.close()
+
 	modifyTexScrollFiles(exportDir, geoDirPath, cDefineScroll, scroll_data, hasScrolling)
 	
 	if DLFormat == "Static":
-		static_data += '\n' + dynamic_data
 		cDefineStatic = geolayoutGraph.to_c_def() + cDefineStatic + cDefineDynamic
 	else:
 		geoData = writeMaterialFiles(exportDir, geoDirPath, 
 			headerInclude, matHInclude,
 			cDefineDynamic, dynamic_data, geoData, customExport)
 
-	modelPath = os.path.join(geoDirPath, 'model.inc.c')
-	modelFile = open(modelPath, 'w', newline='\n')
-	modelFile.write(static_data)
-	modelFile.close()
-
-	if texSeparate:
-		texPath = os.path.join(geoDirPath, 'texture.inc.c')
-		texFile = open(texPath, 'w', newline='\n')
-		texFile.write(texC)
-		texFile.close()
-
 	fModel.freePalettes()
 
 	# save geolayout
@@ -549,9 +558,7 @@ def getBinaryBank0GeolayoutData(fModel, geolayoutGraph, RAMAddr, exportRange):
 	fModel.freePalettes()
 	segmentData = copy.copy(bank0Segment)
 	startRAM = get64bitAlignedAddr(RAMAddr)
-	nonGeoStartAddr = startRAM + geolayoutGraph.size()
-
-	geolayoutGraph.set_addr(startRAM)
+	nonGeoStartAddr = geolayoutGraph.set_addr(startRAM)
 	addrRange = fModel.set_addr(nonGeoStartAddr)
 	addrEndInROM = addrRange[1] - startRAM + exportRange[0]
 	if addrEndInROM > exportRange[1]:
@@ -595,9 +602,7 @@ def saveGeolayoutBinary(romfile, geolayoutGraph, fModel, exportRange,
 	# Get length of data, then actually write it after relative addresses 
 	# are found.
 	startAddress = get64bitAlignedAddr(exportRange[0])
-	nonGeoStartAddr = startAddress + geolayoutGraph.size()
-
-	geolayoutGraph.set_addr(startAddress)
+	nonGeoStartAddr = geolayoutGraph.set_addr(startAddress)
 	addrRange = fModel.set_addr(nonGeoStartAddr)
 	if addrRange[1] > exportRange[1]:
 		raise PluginError('Size too big: Data ends at ' + hex(addrRange[1]) +\
@@ -1323,14 +1328,15 @@ def getGroupNameFromIndex(obj, index):
 			return group.name
 	return None
 
-def getGroupIndex(vert, armatureObj, obj):
+# groupNames is a dict of vertex group index : name, boneNames a set of the armature's bone names.
+def getGroupIndex(vert, obj, groupNames, boneNames):
 	actualGroups = []
 	belowLimitGroups = []
 	nonBoneGroups = []
 	for group in vert.groups:
-		groupName = getGroupNameFromIndex(obj, group.group)
+		groupName = groupNames.get(group.group)
 		if groupName is not None:
-			if groupName in armatureObj.data.bones:
+			if groupName in boneNames:
 				if group.weight > 0.4:
 					actualGroups.append(group)
 				else:
@@ -1353,13 +1359,37 @@ def getGroupIndex(vert, armatureObj, obj):
 			else:
 				highlightWeightErrors(obj, [vert], "VERT")
 				raise VertexWeightError("A vertex was found that was significantly weighted to multiple groups. Make sure each vertex only belongs to one group whose weight is greater than 0.5. (" + \
-					getGroupNameFromIndex(obj, group.group) + ', ' + getGroupNameFromIndex(obj, significantWeightGroup.group) + ')')
+					groupNames.get(group.group) + ', ' + groupNames.get(significantWeightGroup.group) + ')')
 		if group.weight > vertGroup.weight:
 			vertGroup = group
 	#if vertGroup not in actualGroups:
 	#raise VertexWeightError("A vertex was found that was primarily weighted to a group that does not correspond to a bone in #the armature. (" + getGroupNameFromIndex(obj, vertGroup.group) + ') Either decrease the weights of this vertex group or remove it. If you think this group should correspond to a bone, make sure to check your spelling.')
 	return vertGroup.group
 
+# Returns ([vertex group index of each vertex], {vertex group index : faces}).
+# Faces are in the order they are first reached going through the group's vertices.
+# Computed once per mesh and stored in infoDict, since every bone needs it.
+def getVertexGroupFaces(infoDict, obj, armatureObj):
+	if 'vertGroupFaces' not in infoDict:
+		groupNames = {group.index : group.name for group in obj.vertex_groups}
+		boneNames = set([bone.name for bone in armatureObj.data.bones])
+		vertGroupIndices = [getGroupIndex(vert, obj, groupNames, boneNames) \
+			for vert in obj.data.vertices]
+
+		# Dicts are used as ordered sets to ignore repeat faces
+		groupFaces = {}
+		vertDict = infoDict['vert']
+		for vertIndex in range(len(vertGroupIndices)):
+			groupIndex = vertGroupIndices[vertIndex]
+			if groupIndex not in groupFaces:
+				groupFaces[groupIndex] = {}
+			if vertIndex in vertDict:
+				for face in vertDict[vertIndex]:
+					groupFaces[groupIndex][face] = None
+		infoDict['vertGroupFaces'] = (vertGroupIndices, 
+			{groupIndex : list(faces) for groupIndex, faces in groupFaces.items()})
+	return infoDict['vertGroupFaces']
+
 class SkinnedFace():
 	def __init__(self, bFace, loopsInGroup, loopsNotInGroup):
 		self.bFace= bFace
@@ -1530,15 +1560,14 @@ def saveModelGivenVertexGroup(fModel, obj, vertexGroup,
 	#checkForF3DMaterial(obj)
 
 	mesh = obj.data
+	vertGroupIndices, vertGroupFaces = getVertexGroupFaces(infoDict, obj, armatureObj)
 	currentGroupIndex = getGroupIndexFromname(obj, vertexGroup)
-	vertIndices = [vert.index for vert in obj.data.vertices if\
-		getGroupIndex(vert, armatureObj, obj) == currentGroupIndex]
 	parentGroupIndex = getGroupIndexFromname(obj, parentGroup) \
 		if parentGroup is not None else -1
 
-	ancestorGroups = getAncestorGroups(parentGroup, vertexGroup, armatureObj, obj)
+	ancestorGroups = set(getAncestorGroups(parentGroup, vertexGroup, armatureObj, obj))
 
-	if len(vertIndices) == 0:
+	if currentGroupIndex not in vertGroupFaces:
 		print("No vert indices in " + vertexGroup)
 		return None, False
 
@@ -1560,49 +1589,37 @@ def saveModelGivenVertexGroup(fModel, obj, vertexGroup,
 	# dict of material_index keys to SkinnedFace objects
 	skinnedFaces = {}
 
-	handledFaces = []
-	for vertIndex in vertIndices:
-		if vertIndex not in infoDict['vert']:
-			continue
-		for face in infoDict['vert'][vertIndex]:
-			# Ignore repeat faces
-			if face in handledFaces:
-				continue
-			else:
-				handledFaces.append(face)
-
-			loopsInGroup = []
-			loopsNotInGroup = []
-			isChildSkinnedFace = False
-
-			# loop is interpreted as face + loop index
-			for i in range(3):
-				vertGroupIndex = \
-					getGroupIndex(mesh.vertices[face.vertices[i]], 
-						armatureObj, obj)
-				if vertGroupIndex == currentGroupIndex:
-					loopsInGroup.append((face, mesh.loops[face.loops[i]]))
-				elif vertGroupIndex == parentGroupIndex:
-					loopsNotInGroup.append((face, mesh.loops[face.loops[i]]))
-				elif vertGroupIndex not in ancestorGroups:
-					# Only want to handle skinned faces connected to parent
-					isChildSkinnedFace = True
-					break
-				else:
-					highlightWeightErrors(obj, [face], 'FACE')
-					raise VertexWeightError("Error with " + vertexGroup + ": Verts attached to one bone can not be attached to any of its ancestor or sibling bones besides its first immediate deformable parent bone. For example, a foot vertex can be connected to a leg vertex, but a foot vertex cannot be connected to a thigh vertex.")
-			if isChildSkinnedFace:
-				continue
-			
-			if len(loopsNotInGroup) == 0:
-				if face.material_index not in groupFaces:
-					groupFaces[face.material_index] = []
-				groupFaces[face.material_index].append(face)
+	for face in vertGroupFaces[currentGroupIndex]:
+		loopsInGroup = []
+		loopsNotInGroup = []
+		isChildSkinnedFace = False
+
+		# loop is interpreted as face + loop index
+		for i in range(3):
+			vertGroupIndex = vertGroupIndices[face.vertices[i]]
+			if vertGroupIndex == currentGroupIndex:
+				loopsInGroup.append((face, mesh.loops[face.loops[i]]))
+			elif vertGroupIndex == parentGroupIndex:
+				loopsNotInGroup.append((face, mesh.loops[face.loops[i]]))
+			elif vertGroupIndex not in ancestorGroups:
+				# Only want to handle skinned faces connected to parent
+				isChildSkinnedFace = True
+				break
 			else:
-				if face.material_index not in skinnedFaces:
-					skinnedFaces[face.material_index] = []
-				skinnedFaces[face.material_index].append(
-					SkinnedFace(face, loopsInGroup, loopsNotInGroup))
+				highlightWeightErrors(obj, [face], 'FACE')
+				raise VertexWeightError("Error with " + vertexGroup + ": Verts attached to one bone can not be attached to any of its ancestor or sibling bones besides its first immediate deformable parent bone. For example, a foot vertex can be connected to a leg vertex, but a foot vertex cannot be connected to a thigh vertex.")
+		if isChildSkinnedFace:
+			continue
+		
+		if len(loopsNotInGroup) == 0:
+			if face.material_index not in groupFaces:
+				groupFaces[face.material_index] = []
+			groupFaces[face.material_index].append(face)
+		else:
+			if face.material_index not in skinnedFaces:
+				skinnedFaces[face.material_index] = []
+			skinnedFaces[face.material_index].append(
+				SkinnedFace(face, loopsInGroup, loopsNotInGroup))
 
 	# Save skinned mesh
 	if len(skinnedFaces) > 0:
@@ -1625,7 +1642,8 @@ def saveModelGivenVertexGroup(fModel, obj, vertexGroup,
 	fModel.meshGroups[toAlnum(namePrefix + vertexGroup)] = fMeshGroup
 
 	# Save unskinned mesh
-	for material_index, bFaces in groupFaces.items():
+	for material_index, bFaces in getStateOrderedFaceGroups(groupFaces, 
+		fModel, obj, drawLayer, convertTextureData):
 		material = obj.data.materials[material_index]
 		checkForF3dMaterialInFaces(obj, material)
 		saveMeshByFaces(material, bFaces, 
@@ -1696,16 +1714,6 @@ def saveOverrideDraw(obj, fModel, material, specificMat, overrideType, fMesh, dr
 	#		meshMatOverride.commands.append(SPDisplayList(fOverrideMat.revert))
 	#	meshMatOverride.commands.append(SPEndDisplayList())		
 
-def findVertIndexInBuffer(loop, buffer, loopDict):
-	i = 0
-	for material_index, vertData in buffer:
-		for f3dVert in vertData:
-			if f3dVert == loopDict[loop]:
-				return i
-			i += 1
-	#print("Can't find " + str(loop))
-	return -1
-
 def convertVertDictToArray(vertDict):
 	data = []
 	matRegions = {}
@@ -1717,13 +1725,14 @@ def convertVertDictToArray(vertDict):
 	return data, matRegions
 
 # This collapses similar loops together IF they are in the same material.
-def splitSkinnedFacesIntoTwoGroups(skinnedFaces, fModel, obj, uv_data, drawLayer, convertTextureData):
+def splitSkinnedFacesIntoTwoGroups(skinnedFaces, fModel, obj, meshData, drawLayer, convertTextureData):
 	inGroupVertArray = []
 	notInGroupVertArray = []
 
 	# For selecting on error
 	notInGroupBlenderVerts = []
 	loopDict = {}
+	handledBlenderVerts = set()
 	for material_index, skinnedFaceArray in skinnedFaces.items():
 		# These MUST be arrays (not dicts) as order is important
 		inGroupVerts = []
@@ -1732,24 +1741,28 @@ def splitSkinnedFacesIntoTwoGroups(skinnedFaces, fModel, obj, uv_data, drawLayer
 		notInGroupVerts = []
 		notInGroupVertArray.append([material_index, notInGroupVerts])
 
+		# Sets to check for repeats, the lists keep the order
+		handledInGroupVerts = set()
+		handledNotInGroupVerts = set()
+
 		material = obj.data.materials[material_index]
 		fMaterial, texDimensions = \
 			saveOrGetF3DMaterial(material, fModel, obj, drawLayer, convertTextureData)
 		
-		exportVertexColors = isLightingDisabled(material)
-		convertInfo = LoopConvertInfo(uv_data, obj, exportVertexColors)
 		for skinnedFace in skinnedFaceArray:
 			for (face, loop) in skinnedFace.loopsInGroup:
-				f3dVert = getF3DVert(loop, face, convertInfo, obj.data)
-				if f3dVert not in inGroupVerts:
+				f3dVert = meshData.getLoopVertID(loop.index)
+				if f3dVert not in handledInGroupVerts:
+					handledInGroupVerts.add(f3dVert)
 					inGroupVerts.append(f3dVert)
 				loopDict[loop] = f3dVert
 			for (face, loop) in skinnedFace.loopsNotInGroup:
-				vert = obj.data.vertices[loop.vertex_index]
-				if vert not in notInGroupBlenderVerts:
-					notInGroupBlenderVerts.append(vert)
-				f3dVert = getF3DVert(loop, face, convertInfo, obj.data)
-				if f3dVert not in notInGroupVerts:
+				if loop.vertex_index not in handledBlenderVerts:
+					handledBlenderVerts.add(loop.vertex_index)
+					notInGroupBlenderVerts.append(obj.data.vertices[loop.vertex_index])
+				f3dVert = meshData.getLoopVertID(loop.index)
+				if f3dVert not in handledNotInGroupVerts:
+					handledNotInGroupVerts.add(f3dVert)
 					notInGroupVerts.append(f3dVert)
 				loopDict[loop] = f3dVert
 	
@@ -1765,9 +1778,9 @@ def saveSkinnedMeshByMaterial(skinnedFaces, fModel, name, obj,
 	currentMatrix, parentMatrix, namePrefix, infoDict, vertexGroup, drawLayer, convertTextureData):
 	# We choose one or more loops per vert to represent a material from which 
 	# texDimensions can be found, since it is required for UVs.
-	uv_data = obj.data.uv_layers['UVMap'].data
+	meshData = infoDict['meshData']
 	inGroupVertArray, notInGroupVertArray, loopDict, notInGroupBlenderVerts = \
-		splitSkinnedFacesIntoTwoGroups(skinnedFaces, fModel, obj, uv_data, drawLayer, convertTextureData)
+		splitSkinnedFacesIntoTwoGroups(skinnedFaces, fModel, obj, meshData, drawLayer, convertTextureData)
 
 	notInGroupCount = getGroupVertCount(notInGroupVertArray)
 	if notInGroupCount > fModel.f3d.vert_load_size - 2:
@@ -1788,6 +1801,7 @@ def saveSkinnedMeshByMaterial(skinnedFaces, fModel, name, obj,
 	# It seems like material setup must be done BEFORE triangles are drawn.
 	# Because of this we cannot share verts between materials (?)
 	curIndex = 0
+	parentTransforms = getVertexTransforms(parentMatrix)
 	for material_index, vertData in notInGroupVertArray:
 		material = obj.data.materials[material_index]
 		checkForF3dMaterialInFaces(obj, material)
@@ -1808,10 +1822,9 @@ def saveSkinnedMeshByMaterial(skinnedFaces, fModel, name, obj,
 				len(vertData), curIndex))
 		curIndex += len(vertData)
 
-		for f3dVert in vertData:
-			skinnedTriGroup.vertexList.vertices.append(convertVertexData(obj.data,
-				f3dVert[0], f3dVert[1], f3dVert[2], texDimensions,
-				parentMatrix, isPointSampled, exportVertexColors))
+		skinnedTriGroup.vertexList.vertices.extend(convertVertexArrays(
+			meshData.vertData[vertData], texDimensions, parentTransforms,
+			isPointSampled, exportVertexColors))
 		
 		skinnedTriGroup.triList.commands.append(SPEndDisplayList())
 		if fMaterial.revert is not None:
@@ -1841,12 +1854,11 @@ def saveSkinnedMeshByMaterial(skinnedFaces, fModel, name, obj,
 		if fMaterial.revert is not None:
 			fMesh.draw.commands.append(SPDisplayList(fMaterial.revert))
 
-		convertInfo = LoopConvertInfo(uv_data, obj, exportVertexColors)
 		saveTriangleStrip(
 			[skinnedFace.bFace for skinnedFace in skinnedFaceArray],
-			convertInfo, triGroup.triList, triGroup.vertexList, fModel.f3d, 
+			triGroup.triList, triGroup.vertexList, fModel.f3d, 
 			texDimensions, currentMatrix, isPointSampled, exportVertexColors,
-			copy.deepcopy(existingVertData), copy.deepcopy(matRegionDict),
+			list(existingVertData), dict(matRegionDict),
 			infoDict, obj.data)
 	
 	return FMeshGroup(toAlnum(namePrefix + \
@@ -0,0 +1,137 @@
+import bpy
+import hashlib
+import json
+import os
+import numpy as np
+
+from .utility import *
+from .f3d_texture_encoder import *
+
+# Fingerprints of everything a level area export depends on, stored next to
+# the exported area files. Areas whose fingerprints match the stored ones
+# reuse their previously exported files instead of being converted again.
+# The geometry of all areas shares one level model, so it is only reused
+# when no area's geometry has changed.
+
+levelCacheVersion = 'fast64_level_cache_1'
+levelCacheFileName = 'export_cache.json'
+
+# Properties that change without affecting the exported data.
+# Image pixels are hashed separately with getImagePixels, 
+# the rest is runtime state like GPU textures and previews.
+ignoredProperties = {'rna_type', 'session_uid', 'tag', 'is_evaluated',
+	'original', 'users', 'original_name', 'is_runtime_data', 'pixels',
+	'bindcode', 'is_dirty', 'has_data', 'preview', 'packed_file', 'packed_files',
+	'render_slots'}
+
+def hashValue(hashObj, value):
+	hashObj.update(repr(value).encode())
+
+def hashCollection(hashObj, collection, attr, size, dtype):
+	data = np.empty(len(collection) * size, dtype = dtype)
+	collection.foreach_get(attr, data)
+	hashObj.update(data.tobytes())
+
+def getDescendants(obj):
+	descendants = []
+	for child in obj.children:
+		descendants.append(child)
+		descendants.extend(getDescendants(child))
+	return descendants
+
+class LevelExportCache:
+	def __init__(self, forceRebuild, depsgraph):
+		self.forceRebuild = forceRebuild
+		self.depsgraph = depsgraph
+		# dict of data block : hash digest, so shared data is only hashed once.
+		self.hashes = {}
+
+	# Data blocks are hashed by name, except images and materials.
+	def getIDValue(self, value):
+		if isinstance(value, bpy.types.Image) or isinstance(value, bpy.types.Material):
+			return self.getDataHash(value)
+		return getattr(value, 'name', None)
+
+	def hashMesh(self, hashObj, mesh):
+		mesh.calc_normals_split()
+		hashValue(hashObj, (len(mesh.vertices), len(mesh.loops), len(mesh.polygons)))
+		hashCollection(hashObj, mesh.vertices, 'co', 3, np.float32)
+		hashCollection(hashObj, mesh.loops, 'vertex_index', 1, np.int32)
+		hashCollection(hashObj, mesh.loops, 'normal', 3, np.float32)
+		hashCollection(hashObj, mesh.polygons, 'loop_start', 1, np.int32)
+		hashCollection(hashObj, mesh.polygons, 'loop_total', 1, np.int32)
+		hashCollection(hashObj, mesh.polygons, 'material_index', 1, np.int32)
+		for uvLayer in mesh.uv_layers:
+			hashValue(hashObj, (uvLayer.name, uvLayer.active))
+			hashCollection(hashObj, uvLayer.data, 'uv', 2, np.float32)
+		for colorLayer in mesh.vertex_colors:
+			hashValue(hashObj, colorLayer.name)
+			hashCollection(hashObj, colorLayer.data, 'color', 4, np.float32)
+		for material in mesh.materials:
+			hashValue(hashObj, None if material is None else self.getDataHash(material))
+
+	def getDataHash(self, data):
+		if data in self.hashes:
+			return self.hashes[data]
+		hashObj = hashlib.sha1()
+		hashValue(hashObj, getRNAPropertyValues(data, ignoredProperties, self.getIDValue))
+		if isinstance(data, bpy.types.Image):
+			hashValue(hashObj, (tuple(data.size), data.channels))
+			hashObj.update(getImagePixels(data).tobytes())
+		elif isinstance(data, bpy.types.Material) and data.node_tree is not None:
+			for node in data.node_tree.nodes:
+				hashValue(hashObj, (node.name, node.bl_idname))
+				for nodeInput in node.inputs:
+					if hasattr(nodeInput, 'default_value'):
+						value = nodeInput.default_value
+						hashValue(hashObj, (nodeInput.name, tuple(value) \
+							if hasattr(value, '__len__') else value))
+		elif isinstance(data, bpy.types.Object):
+			for materialSlot in data.material_slots:
+				hashValue(hashObj, None if materialSlot.material is None else \
+					self.getDataHash(materialSlot.material))
+			if isinstance(data.data, bpy.types.Mesh):
+				processEvaluatedMesh(data, self.depsgraph,
+					lambda mesh: self.hashMesh(hashObj, mesh))
+		self.hashes[data] = hashObj.hexdigest()
+		return self.hashes[data]
+
+	# Returns the (geometry, collision) fingerprints of an area.
+	# exportOptions should contain everything else the area export depends on.
+	def getAreaFingerprints(self, areaObj, exportOptions):
+		geometryHash = hashlib.sha1(levelCacheVersion.encode())
+		collisionHash = hashlib.sha1(levelCacheVersion.encode())
+		for hashObj in [geometryHash, collisionHash]:
+			hashValue(hashObj, exportOptions)
+			hashValue(hashObj, self.getDataHash(areaObj))
+		for obj in getDescendants(areaObj):
+			objHash = self.getDataHash(obj)
+			# Objects like macros and specials only affect collision / area data.
+			if isHierarchyExportObject(obj, True, areaObj.areaIndex):
+				hashValue(geometryHash, objHash)
+			hashValue(collisionHash, objHash)
+		return geometryHash.hexdigest(), collisionHash.hexdigest()
+
+	# Returns the data stored by save, or None if it can't be reused.
+	def load(self, directory):
+		if self.forceRebuild:
+			return None
+		try:
+			with open(os.path.join(directory, levelCacheFileName), 'r') as cacheFile:
+				data = json.load(cacheFile)
+		except (OSError, ValueError):
+			return None
+		if not isinstance(data, dict) or data.get('version') != levelCacheVersion:
+			return None
+		return data
+
+	def save(self, directory, data):
+		data = dict(data)
+		data['version'] = levelCacheVersion
+		with open(os.path.join(directory, levelCacheFileName), 'w', newline = '\n') as cacheFile:
+			json.dump(data, cacheFile, indent = '\t')
+
+	def remove(self, directory):
+		cachePath = os.path.join(directory, levelCacheFileName)
+		if os.path.exists(cachePath):
+			os.remove(cachePath)
@@ -3,9 +3,11 @@ from .sm64_constants import *
 from .sm64_objects import *
 from .sm64_collision import *
 from .sm64_geolayout_writer import *
+from .sm64_level_cache import *
 from bpy.utils import register_class, unregister_class
 import bpy, bmesh
 import os
+import io
 from io import BytesIO
 import math
 import re
@@ -462,7 +464,7 @@ def parseLevelScript(filepath, levelName):
 	return levelscript
 	
 def exportLevelC(obj, transformMatrix, f3dType, isHWv1, levelName, exportDir,
-	savePNG, customExport, levelCameraVolumeName, DLFormat):
+	savePNG, customExport, levelCameraVolumeName, DLFormat, forceRebuild = False):
 	
 	if customExport:
 		levelDir = os.path.join(exportDir, levelName)
@@ -489,6 +491,35 @@ def exportLevelC(obj, transformMatrix, f3dType, isHWv1, levelName, exportDir,
 	if len(childAreas) == 0:
 		raise PluginError("The level root has no child empties with the 'Area Root' object type.")
 
+	# Needs to be done BEFORE collision parsing and fingerprinting
+	for child in childAreas:
+		setRooms(child)
+
+	# Unchanged areas reuse their previously exported files.
+	# All areas share the level model, so geometry is only reused if no area's geometry changed.
+	levelCache = LevelExportCache(forceRebuild, bpy.context.evaluated_depsgraph_get())
+	exportOptions = ([tuple(row) for row in transformMatrix], f3dType, isHWv1, levelName, 
+		savePNG, DLFormat, bpy.context.scene.decomp_compatible, 
+		bpy.context.scene.ignoreTextureRestrictions, bpy.context.scene.optimizeVertexLoads,
+		bpy.context.scene.optimizeDisplayLists, bpy.context.scene.displayListInlineSize,
+		bpy.context.scene.useTextureAtlas,
+		levelCache.getDataHash(obj),
+		None if bpy.context.scene.world is None else levelCache.getDataHash(bpy.context.scene.world))
+	areaFingerprints = {}
+	for child in childAreas:
+		areaFingerprints[str(child.areaIndex)] = levelCache.getAreaFingerprints(child, exportOptions)
+
+	geometryCache = levelCache.load(levelDir)
+	reuseGeometry = DLFormat == "Static" and geometryCache is not None and \
+		geometryCache['geometry'] == {index : fingerprints[0] for index, fingerprints in areaFingerprints.items()} and \
+		all([os.path.exists(os.path.join(levelDir, path)) for path in geometryCache['files']])
+	if not reuseGeometry:
+		levelCache.remove(levelDir)
+		geometryCache = {
+			'geometry' : {index : fingerprints[0] for index, fingerprints in areaFingerprints.items()},
+			'files' : ['model.inc.c'] + (['texture_include.inc.c'] if savePNG else []),
+			'areas' : {}}
+
 	usesEnvFX = False
 	echoLevels = ['0x00', '0x00', '0x00']
 	zoomFlags = [False, False, False, False]
@@ -516,41 +547,60 @@ def exportLevelC(obj, transformMatrix, f3dType, isHWv1, levelName, exportDir,
 		if child.areaIndex == 1 or child.areaIndex == 2 or child.areaIndex == 3 or child.areaIndex == 4:
 			zoomFlags[child.areaIndex - 1] = child.zoomOutOnPause
 
-		# Needs to be done BEFORE collision parsing
-		setRooms(child)
+		if reuseGeometry:
+			areaGeometry = geometryCache['areas'][str(areaIndex)]
+			startGeolayout = Geolayout(areaGeometry['name'], True)
+		else:
+			geolayoutGraph, fModel = \
+				convertObjectToGeolayout(obj, transformMatrix, 
+				f3dType, isHWv1, child.areaCamera, levelName + '_' + areaName, fModel, child, DLFormat, not savePNG)
+
+			# Write geolayout
+			geoFile = open(os.path.join(areaDir, 'geo.inc.c'), 'w', newline = '\n')
+			geoFile.write(geolayoutGraph.to_c())
+			geoFile.close()
+			startGeolayout = geolayoutGraph.startGeolayout
+			areaGeometry = {'name' : startGeolayout.name, 'header' : geolayoutGraph.to_c_def()}
+			geometryCache['areas'][str(areaIndex)] = areaGeometry
+			geometryCache['files'].append(areaName + '/geo.inc.c')
+		geoString += '#include "levels/' + levelName + '/' + areaName + '/geo.inc.c"\n'
+		headerString += areaGeometry['header']
+
+		collisionFingerprint = areaFingerprints[str(areaIndex)][1]
+		collisionCache = levelCache.load(areaDir)
+		if collisionCache is not None and collisionCache['collision'] == collisionFingerprint and \
+			os.path.exists(os.path.join(areaDir, 'collision.inc.c')) and \
+			(not child.enableRoomSwitch or os.path.exists(os.path.join(areaDir, 'room.inc.c'))):
+			# Only the name is needed for the headers and the area
+			collision = Collision(collisionCache['name'])
+		else:
+			levelCache.remove(areaDir)
 
-		geolayoutGraph, fModel = \
-			convertObjectToGeolayout(obj, transformMatrix, 
-			f3dType, isHWv1, child.areaCamera, levelName + '_' + areaName, fModel, child, DLFormat, not savePNG)
+			# Write collision
+			collision = \
+				exportCollisionCommon(child, transformMatrix, True, True, 
+					levelName + '_' + areaName, child.areaIndex)
+			colFile = open(os.path.join(areaDir, 'collision.inc.c'), 'w', newline = '\n')
+			collision.write_c(colFile)
+			colFile.close()
+
+			# Write rooms
+			if child.enableRoomSwitch:
+				roomFile = open(os.path.join(areaDir, 'room.inc.c'), 'w', newline = '\n')
+				collision.write_c_rooms(roomFile)
+				roomFile.close()
+
+			levelCache.save(areaDir, {'collision' : collisionFingerprint, 'name' : collision.name})
 
-		# Write geolayout
-		geoFile = open(os.path.join(areaDir, 'geo.inc.c'), 'w', newline = '\n')
-		geoFile.write(geolayoutGraph.to_c())
-		geoFile.close()
-		geoString += '#include "levels/' + levelName + '/' + areaName + '/geo.inc.c"\n'
-		headerString += geolayoutGraph.to_c_def()
-
-		# Write collision
-		collision = \
-			exportCollisionCommon(child, transformMatrix, True, True, 
-				levelName + '_' + areaName, child.areaIndex)
-		colFile = open(os.path.join(areaDir, 'collision.inc.c'), 'w', newline = '\n')
-		colFile.write(collision.to_c())
-		colFile.close()
 		levelDataString += '#include "levels/' + levelName + '/' + areaName + '/collision.inc.c"\n'
 		headerString += collision.to_c_def()
-
-		# Write rooms
 		if child.enableRoomSwitch:
-			roomFile = open(os.path.join(areaDir, 'room.inc.c'), 'w', newline = '\n')
-			roomFile.write(collision.to_c_rooms())
-			roomFile.close()
 			levelDataString += '#include "levels/' + levelName + '/' + areaName + '/room.inc.c"\n'
 			headerString += collision.to_c_rooms_def()
 
 		# Get area
 		area = exportAreaCommon(child, transformMatrix, 
-			geolayoutGraph.startGeolayout, collision, levelName + '_' + areaName)
+			startGeolayout, collision, levelName + '_' + areaName)
 		if area.mario_start is not None:
 			prevLevelScript.marioStart = area.mario_start
 		areaString += area.to_c_script(child.enableRoomSwitch)
@@ -594,23 +644,46 @@ def exportLevelC(obj, transformMatrix, f3dType, isHWv1, levelName, exportDir,
 			if not existingArea:
 				shutil.rmtree(os.path.join(levelDir, f))
 	
-	static_data, dynamic_data, texC, scroll_data = fModel.to_c(savePNG, savePNG, 'levels/' + levelName, levelName)
-	headerStatic, headerDynamic, headerScroll, hasScrolling = fModel.to_c_def(levelName)
 	if savePNG:
 		levelDataString =  '#include "levels/' + levelName + '/texture_include.inc.c"\n' + levelDataString
-		fModel.save_textures(levelDir)
 
-		texPath = os.path.join(levelDir, 'texture_include.inc.c')
-		texFile = open(texPath, 'w', newline='\n')
-		texFile.write(texC)
-		texFile.close()
+	if reuseGeometry:
+		headerStatic = geometryCache['headerStatic']
+		headerDynamic = geometryCache['headerDynamic']
+		headerScroll = geometryCache['headerScroll']
+		hasScrolling = geometryCache['hasScrolling']
+		scroll_data = geometryCache['scroll_data']
+	else:
+		headerStatic, headerDynamic, headerScroll, hasScrolling = fModel.to_c_def(levelName)
+		if savePNG:
+			# Reuse also requires the pngs, which the model's C files don't contain.
+			geometryCache['files'].extend(fModel.save_textures(levelDir))
+
+		# Static data is streamed straight to model.inc.c
+		modelPath = os.path.join(levelDir, 'model.inc.c')
+		modelFile = open(modelPath, 'w', newline='\n')
+		texFile = open(os.path.join(levelDir, 'texture_include.inc.c'), 'w', newline='\n') if savePNG else None
+		dynamicOut = io.StringIO()
+		try:
+			scroll_data = fModel.write_c(modelFile, dynamicOut, texFile, savePNG, 'levels/' + levelName, levelName)
+			dynamic_data = dynamicOut.getvalue()
+			if DLFormat == "Static":
+				modelFile.write(dynamic_data)
+		finally:
+			modelFile.close()
+			if texFile is not None:
+				texFile.close()
+
+		geometryCache['headerStatic'] = headerStatic
+		geometryCache['headerDynamic'] = headerDynamic
+		geometryCache['headerScroll'] = headerScroll
+		geometryCache['hasScrolling'] = hasScrolling
+		geometryCache['scroll_data'] = scroll_data
 
-	
 	modifyTexScrollFiles(exportDir, levelDir, headerScroll, scroll_data, hasScrolling)
 
 	# Write materials
 	if DLFormat == "Static":
-		static_data += dynamic_data
 		headerStatic += headerDynamic
 	else:
 		geoString = writeMaterialFiles(exportDir, levelDir, 
@@ -618,12 +691,8 @@ def exportLevelC(obj, transformMatrix, f3dType, isHWv1, levelName, exportDir,
 			'#include "levels/' + levelName + '/material.inc.h"',
 			headerDynamic, dynamic_data, geoString, customExport)
 
-	modelPath = os.path.join(levelDir, 'model.inc.c')
-	modelFile = open(modelPath, 'w', newline='\n')
-	modelFile.write(static_data)
-	modelFile.close()
-
-	fModel.freePalettes()
+	if not reuseGeometry:
+		fModel.freePalettes()
 
 	levelDataString += '#include "levels/' + levelName + '/model.inc.c"\n'
 	headerString += headerStatic
@@ -647,6 +716,9 @@ def exportLevelC(obj, transformMatrix, f3dType, isHWv1, levelName, exportDir,
 	scriptFile.write(levelscriptString)
 	scriptFile.close()
 
+	if not reuseGeometry:
+		levelCache.save(levelDir, geometryCache)
+
 	if customExport:
 		cameraVolumeString = '// Replace the level specific camera volume struct in src/game/camera.c with this.\n' +\
 			'// Make sure to also add the struct name to the LEVEL_DEFINE in levels/level_defines.h.\n' +\
@@ -10,6 +10,9 @@ import math
 import traceback
 import re
 import os
+import mmap
+import struct
+import numpy as np
 from .utility_anim import *
 
 class PluginError(Exception):
@@ -243,6 +246,35 @@ def overwriteData(headerRegex, name, value, filePath, writeNewBeforeString, isFu
 	else:
 		raise PluginError(filePath + " does not exist.")
 
+# C data is written to an output with a write() method (an open file, or an
+# io.StringIO for to_c()), a chunk of lines at a time instead of building
+# one large string, so big exports are streamed to disk.
+cWriteChunkSize = 1024
+
+def writeCLines(out, items, formatItem):
+	for start in range(0, len(items), cWriteChunkSize):
+		out.write(''.join([formatItem(item) for item in items[start:start + cWriteChunkSize]]))
+
+# Writes ', ' separated values, with '\n\t' after every valuesPerLine values.
+def writeCValueArray(out, values, formatValue, valuesPerLine):
+	chunkSize = valuesPerLine * cWriteChunkSize
+	for chunkStart in range(0, len(values), chunkSize):
+		chunk = []
+		for lineStart in range(chunkStart, min(chunkStart + chunkSize, len(values)), valuesPerLine):
+			line = values[lineStart:lineStart + valuesPerLine]
+			chunk.append(''.join([formatValue(value) for value in line]))
+			if len(line) == valuesPerLine:
+				chunk.append('\n\t')
+		out.write(''.join(chunk))
+
+cHexByteStrings = ['0x' + format(value, 'X') + ', ' for value in range(256)]
+
+def formatCHexByte(value):
+	return cHexByteStrings[value]
+
+def formatCHexShort(value):
+	return '0x' + format(value, '04X') + ', '
+
 def writeIfNotFound(filePath, stringValue, footer):
 	if os.path.exists(filePath):
 		fileData = open(filePath, 'r')
@@ -275,6 +307,18 @@ def deleteIfFound(filePath, stringValue):
 			fileData.write(stringData)
 		fileData.close()
 
+# Same as matrix @ vector in mathutils for each row of vectors, which sums 
+# float32 products as doubles. Vectors shorter than the matrix get a 1 appended.
+def transformVectors(matrix, vectors):
+	matrix = np.asarray(matrix, dtype = np.float32)
+	if vectors.shape[1] < matrix.shape[1]:
+		vectors = np.column_stack((vectors, np.ones(len(vectors))))
+	products = matrix[np.newaxis, :, :] * vectors.astype(np.float32)[:, np.newaxis, :]
+	result = products[:, :, 0].astype(np.float64)
+	for i in range(1, products.shape[2]):
+		result += products[:, :, i]
+	return result.astype(np.float32)
+
 def duplicateHierarchy(obj, ignoreAttr, includeEmpties, areaIndex):
 	# Duplicate objects to apply scale / modifiers / linked data
 	bpy.ops.object.select_all(action = 'DESELECT')
@@ -330,6 +374,112 @@ def selectMeshChildrenOnly(obj, ignoreAttr, includeEmpties, areaIndex):
 				continue
 		selectMeshChildrenOnly(child, ignoreAttr, includeEmpties, areaIndex)
 
+# Whether duplicateHierarchy would duplicate obj along with its parent.
+# Hidden objects are never duplicated by bpy.ops.object.duplicate.
+def isHierarchyExportObject(obj, includeEmpties, areaIndex):
+	checkArea = areaIndex is not None and obj.data is None
+	if checkArea and obj.sm64_obj_type == 'Area Root' and obj.areaIndex != areaIndex:
+		return False
+	if not obj.visible_get():
+		return False
+	isMesh = isinstance(obj.data, bpy.types.Mesh)
+	isEmpty = (obj.data is None) and includeEmpties and \
+		(obj.sm64_obj_type == 'Level Root' or \
+		obj.sm64_obj_type == 'Area Root' or \
+		obj.sm64_obj_type == 'None' or \
+		obj.sm64_obj_type == 'Switch')
+	return isMesh or isEmpty
+
+# The children that would still be children of obj in a hierarchy
+# duplicated by duplicateHierarchy, without duplicating anything.
+def getHierarchyExportChildren(obj, includeEmpties, areaIndex):
+	children = obj.children
+	if areaIndex is not None and obj.data is None and obj.sm64_obj_type == 'Level Root':
+		children = [child for child in children if \
+			child.data is None and child.sm64_obj_type == 'Area Root']
+	return [child for child in children if \
+		isHierarchyExportObject(child, includeEmpties, areaIndex)]
+
+# duplicateHierarchy applies rotation and scale, but not location, to the root object.
+def getAppliedRotationScale(obj):
+	matrix = obj.matrix_basis.copy()
+	matrix.translation = (0, 0, 0)
+	return matrix
+
+# Returns a nested list of (identifier, value) for every property of an RNA struct,
+# recursing into property groups. Data blocks are replaced by getIDValue(value).
+# Sets are sorted, and arrays, vectors and matrices converted to tuples,
+# so equal settings always give equal lists.
+def getRNAPropertyValues(data, ignored, getIDValue, depth = 0):
+	values = []
+	if depth > 4:
+		return values
+	for prop in data.bl_rna.properties:
+		identifier = prop.identifier
+		if identifier in ignored:
+			continue
+		try:
+			value = getattr(data, identifier)
+		except AttributeError:
+			continue
+		if prop.type == 'POINTER':
+			if value is None or isinstance(value, bpy.types.ID):
+				values.append((identifier, getIDValue(value)))
+			else:
+				values.append((identifier, 
+					getRNAPropertyValues(value, ignored, getIDValue, depth + 1)))
+		elif prop.type == 'COLLECTION':
+			values.append((identifier, [getIDValue(item) if isinstance(item, bpy.types.ID) \
+				else getRNAPropertyValues(item, ignored, getIDValue, depth + 1) for item in value]))
+		elif isinstance(value, set):
+			values.append((identifier, tuple(sorted(value))))
+		elif isinstance(value, str) or not hasattr(value, '__len__'):
+			values.append((identifier, value))
+		else:
+			values.append((identifier, tuple([tuple(item) if hasattr(item, '__len__') \
+				else item for item in value])))
+	return values
+
+# Calls func(mesh) with the mesh of obj after modifiers, 
+# as modifier_apply would have, without creating any data blocks.
+def processEvaluatedMesh(obj, depsgraph, func):
+	evaluatedObj = obj.evaluated_get(depsgraph)
+	mesh = evaluatedObj.to_mesh()
+	try:
+		return func(mesh)
+	finally:
+		evaluatedObj.to_mesh_clear()
+
+# Calls func(mesh, meshMatrix) with the mesh of obj as duplicateHierarchy gives it,
+# where rotation and scale are applied before modifiers, so that modifiers
+# depending on object space (bevel, solidify, displace...) give the same result.
+# transformMatrix includes the rotation and scale of obj, 
+# and meshMatrix is what is left of it to apply to the mesh.
+# Objects with enabled modifiers and a rotation / scale are evaluated from a 
+# temporary copy with them applied, other objects from their evaluated mesh.
+def processAppliedMesh(obj, depsgraph, transformMatrix, func):
+	rotationScale = getAppliedRotationScale(obj)
+	if rotationScale == Matrix.Identity(4) or \
+		not any([modifier.show_viewport for modifier in obj.modifiers]):
+		return processEvaluatedMesh(obj, depsgraph, 
+			lambda mesh: func(mesh, transformMatrix))
+
+	tempMesh = obj.data.copy()
+	tempMesh.transform(rotationScale)
+	tempObj = obj.copy()
+	tempObj.data = tempMesh
+	tempObj.animation_data_clear()
+	tempObj.constraints.clear()
+	tempObj.parent = None
+	tempObj.matrix_world = Matrix.Translation(obj.matrix_world.translation)
+	bpy.context.scene.collection.objects.link(tempObj)
+	try:
+		return processEvaluatedMesh(tempObj, bpy.context.evaluated_depsgraph_get(), 
+			lambda mesh: func(mesh, transformMatrix @ rotationScale.inverted_safe()))
+	finally:
+		bpy.data.objects.remove(tempObj)
+		bpy.data.meshes.remove(tempMesh)
+
 def cleanupDuplicatedObjects(selected_objects):
 	meshData = []
 	for selectedObj in selected_objects:
@@ -586,6 +736,63 @@ def decodeSegmentedAddr(address, segmentData):
 	segmentStart = segmentData[address[0]][0]
 	return segmentStart + bytesToInt(address[1:4])
 
+romU16 = struct.Struct('>H')
+romS16 = struct.Struct('>h')
+romU32 = struct.Struct('>I')
+
+# Read only, memory mapped view of a ROM file, used by the importers.
+# It can be used like a file opened with 'rb', but reads are slices of the
+# mapping instead of system calls, and the read* functions unpack values at
+# an address without moving the read position.
+class RomView:
+	def __init__(self, filepath):
+		self.file = open(filepath, 'rb')
+		try:
+			self.data = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+		except (OSError, ValueError) as e:
+			self.file.close()
+			raise PluginError('Unable to read ROM ' + filepath + ': ' + str(e))
+		self.position = 0
+
+	def seek(self, offset, whence = 0):
+		if whence == 1:
+			offset += self.position
+		elif whence == 2:
+			offset += len(self.data)
+		self.position = offset
+		return offset
+
+	def tell(self):
+		return self.position
+
+	def read(self, size = -1):
+		start = self.position
+		end = len(self.data) if size is None or size < 0 else start + size
+		data = self.data[start:end]
+		self.position = start + len(data)
+		return data
+
+	# Same as seek(address) followed by read(size)
+	def readBytes(self, address, size):
+		self.position = address
+		return self.read(size)
+
+	def readU16(self, address):
+		return romU16.unpack_from(self.data, address)[0]
+
+	def readS16(self, address):
+		return romS16.unpack_from(self.data, address)[0]
+
+	def readU32(self, address):
+		return romU32.unpack_from(self.data, address)[0]
+
+	def readSegmentedAddr(self, address, segmentData):
+		return decodeSegmentedAddr(self.data[address:address + 4], segmentData)
+
+	def close(self):
+		self.data.close()
+		self.file.close()
+
 #int input
 # returns bytes, usually used for writing new segmented addresses
 def encodeSegmentedAddr(address, segmentData):
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+# f3d_gbi needs Blender's modules, so these tests only run inside Blender's python.
+pytest.importorskip('bpy')
+pytest.importorskip('mathutils')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from fast64_internal.f3d_gbi import *
+
+def getLayoutGfxList():
+	f3d = F3D('F3D', False)
+	gfxList = GfxList('test', 'Static')
+	subList = GfxList('sub', 'Static')
+	gfxList.commands.append(DPPipeSync())
+	gfxList.commands.append(SPEndDisplayList())
+	return f3d, gfxList, subList
+
+def test_layout_after_append():
+	f3d, gfxList, subList = getLayoutGfxList()
+	assert gfxList.get_ptr_addresses(f3d) == []
+	gfxList.commands.append(SPDisplayList(subList))
+	assert gfxList.size(f3d) == 24
+	assert gfxList.get_ptr_addresses(f3d) == [20]
+
+# Modifications that keep the command count must update the layout too.
+def test_layout_after_same_length_changes():
+	f3d, gfxList, subList = getLayoutGfxList()
+	assert gfxList.get_ptr_addresses(f3d) == []
+	gfxList.commands[0] = SPDisplayList(subList)
+	assert gfxList.get_ptr_addresses(f3d) == [4]
+	gfxList.commands.remove(gfxList.commands[0])
+	gfxList.commands.insert(1, SPDisplayList(subList))
+	assert gfxList.get_ptr_addresses(f3d) == [12]
+	gfxList.commands.reverse()
+	assert gfxList.get_ptr_addresses(f3d) == [4]
+
+def test_layout_after_assignment():
+	f3d, gfxList, subList = getLayoutGfxList()
+	assert gfxList.get_ptr_addresses(f3d) == []
+	gfxList.commands = [SPDisplayList(subList), SPEndDisplayList()]
+	assert isinstance(gfxList.commands, GfxCommandList)
+	assert gfxList.get_ptr_addresses(f3d) == [4]
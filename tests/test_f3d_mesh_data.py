@@ -0,0 +1,28 @@
+import importlib.util
+import os
+import types
+
+import numpy as np
+
+# f3d_mesh_data only needs numpy, so it is loaded directly without bpy.
+modulePath = os.path.join(os.path.dirname(__file__), '..', 'fast64_internal', 'f3d_mesh_data.py')
+spec = importlib.util.spec_from_file_location('f3d_mesh_data', modulePath)
+f3d_mesh_data = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(f3d_mesh_data)
+
+class LoopTriangles(list):
+	def foreach_get(self, attr, data):
+		data[:] = [value for face in self for value in getattr(face, attr)]
+
+def test_group_triangle_corners_empty():
+	assert f3d_mesh_data.groupTriangleCorners(np.array([], dtype = np.int64)) == ([], [])
+
+def test_group_triangle_corners():
+	# Two triangles sharing vertices 1 and 2, with vertex 2 repeated in the second.
+	keys, groups = f3d_mesh_data.groupTriangleCorners(np.array([0, 1, 2, 2, 1, 2]))
+	assert keys == [0, 1, 2]
+	assert groups == [[0], [1, 4], [2, 3]]
+
+def test_mesh_adjacency_without_triangles():
+	mesh = types.SimpleNamespace(loop_triangles = LoopTriangles(), vertices = [None] * 4)
+	assert f3d_mesh_data.getMeshAdjacency(mesh, [], []) == ({}, {}, {}, {})